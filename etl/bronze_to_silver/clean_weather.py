@@ -2,10 +2,16 @@
 
 #Time,                      Value,      Prediction, Site,               Measurement,        Unit
 #2023-01-05 00:00:00+00:00,-99999.0,    00,         Aadorf / Tänikon,   PRED_GLOB_ctrl,     Watt/m2
+#
+# Usage:
+#   python -m etl.bronze_to_silver.clean_weather                         # new files
+#   python -m etl.bronze_to_silver.clean_weather --backfill-site "Visp"  # add a site from all of bronze
 
 
+import contextlib
 import os
 import logging
+import sys
 from datetime import datetime
 from pathlib import Path
 
@@ -13,6 +19,18 @@ import pandas as pd
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from etl.bronze_to_silver import weather_partitions
+from ingestion.fast_flow import bronze_codec, skip_list
+
+try:
+    import pyarrow  # noqa: F401  -- optional, WEATHER_CSV_ENGINE=pyarrow
+except ImportError:
+    pyarrow = None
+
 
 # ─── MACRO ───
 load_dotenv()
@@ -22,13 +40,30 @@ DB_URL = os.getenv("DB_URL")
 WEATHER_MIN_YEAR = int(os.getenv("WEATHER_MIN_YEAR", "2023"))
 
 # Same bronze post-processing as flatten_sensors.py: by default COMPRESS the
-# CSV in place after silver ingestion (file.csv -> file.csv.gz). Set
+# CSV in place after silver ingestion (file.csv -> file.csv.gz, or .zst per
+# BRONZE_CODEC -- without the sensor dictionary, which doesn't fit CSV). Set
 # KEEP_BRONZE=1 to keep raw uncompressed; set DELETE_BRONZE=1 to hard-delete
-# instead. Filenames go into processed.log so future scans skip them.
+# instead. Filenames go into the skip list (skip_list.py) so future scans
+# skip them.
 COMPRESS_BRONZE_ON_SILVER = os.getenv("KEEP_BRONZE", "0") != "1" and os.getenv("DELETE_BRONZE", "0") != "1"
 DELETE_BRONZE_ON_SILVER   = os.getenv("DELETE_BRONZE", "0") == "1"
-PROCESSED_LOG = (BRONZE_ROOT.parent / "processed.log") if BRONZE_ROOT.is_absolute() \
-    else (Path(__file__).resolve().parent.parent.parent / BRONZE_ROOT.parent / "processed.log")
+
+# CSV reader (read_weather_csv): only the six needed columns, dtypes pinned
+# (Site / Measurement / Unit as categoricals, Value / Prediction coerced to
+# numbers per chunk), read in chunks of
+# WEATHER_CSV_CHUNK_ROWS rows that are cut down to RELEVANT_MEASUREMENTS
+# before anything else is parsed. WEATHER_CSV_ENGINE=pyarrow reads the file
+# in one multi-threaded pass instead (needs pyarrow; falls back to c).
+CSV_ENGINE     = os.getenv("WEATHER_CSV_ENGINE", "c").lower()
+CSV_CHUNK_ROWS = int(os.getenv("WEATHER_CSV_CHUNK_ROWS", "50000"))
+
+# Opt-in site allowlist (WEATHER_SITE_FILTER=1): only the sites gold uses --
+# the WEATHER_SITES list populate_gold.py reads -- are loaded into silver;
+# every other site is dropped while the CSV is read, and a file's slice is
+# then (prediction_date, those sites). A site added to WEATHER_SITES later is
+# pulled in from (compressed) bronze with --backfill-site.
+WEATHER_SITES = [s.strip() for s in os.getenv("WEATHER_SITES", "Sion").split(",")]
+SITE_FILTER   = os.getenv("WEATHER_SITE_FILTER", "0") == "1"
 
 
 # ─── LOGGING ───
@@ -50,22 +85,8 @@ log.addHandler(_fh)
 
 # ─── DDL ───
 
-WEATHER_CLEAN_DDL = """
-CREATE TABLE IF NOT EXISTS silver.weather_forecasts (
-    id               BIGSERIAL PRIMARY KEY,
-    timestamp        TIMESTAMPTZ  NOT NULL,
-    site             VARCHAR(100),
-    prediction       SMALLINT,
-    prediction_date  DATE,
-    measurement      VARCHAR(50),
-    value            FLOAT,
-    unit             VARCHAR(20),
-    is_outlier       BOOLEAN      DEFAULT FALSE,
-    UNIQUE (timestamp, site, prediction, prediction_date, measurement)
-);
-CREATE INDEX IF NOT EXISTS idx_weather_forecasts_timestamp ON silver.weather_forecasts (timestamp);
-CREATE INDEX IF NOT EXISTS idx_weather_forecasts_pred_date ON silver.weather_forecasts (prediction_date);
-"""
+# silver.weather_forecasts: partitioned by month of prediction_date, see
+# weather_partitions.py (PARTITIONED_DDL).
 
 WATERMARK_DDL = """
 CREATE TABLE IF NOT EXISTS silver.weather_watermark (
@@ -79,7 +100,7 @@ def init_db(engine):
     """Ensure that the necessary tables exist before starting."""
     with engine.begin() as conn:
         conn.execute(text(WATERMARK_DDL))
-        conn.execute(text(WEATHER_CLEAN_DDL))
+        weather_partitions.ensure_schema(conn)
 
 def load_watermark(engine):
     """Load processed filenames from watermark table."""
@@ -91,8 +112,15 @@ def load_watermark(engine):
     return {r[0] for r in rows}
 
 
-def mark_done(engine, filename):
-    """Insert filename into watermark table."""
+def mark_done(engine, filename, cur=None):
+    """Insert filename into watermark table. Pass `cur` to write inside the
+    caller's transaction (the caller commits)."""
+    if cur is not None:
+        cur.execute(
+            "INSERT INTO silver.weather_watermark (filename) VALUES (%s) ON CONFLICT DO NOTHING",
+            (filename,),
+        )
+        return
     with engine.begin() as conn:
         conn.execute(
             text("""
@@ -130,6 +158,55 @@ BOUNDS = {
 
 REQUIRED_COLUMNS = {"Time", "Value", "Prediction", "Site", "Measurement", "Unit"}
 
+# Pinned on read: no per-column inference, repeated strings stored once.
+# Value / Prediction are read as text and coerced per chunk in _prune(), so
+# a malformed cell becomes NaN instead of failing the whole file.
+CSV_DTYPES = {
+    "Time": "string",
+    "Value": "string",
+    "Prediction": "string",
+    "Site": "category",
+    "Measurement": "category",
+    "Unit": "category",
+}
+SENTINEL = -99999.0
+
+
+def _prune(df: pd.DataFrame, sites=None) -> pd.DataFrame:
+    """Rows worth parsing: relevant measurement, real value and, with a
+    site allowlist, an allowed site (matched on the cleaned name, checked
+    once per category rather than per row)."""
+    df = df.assign(
+        Value=pd.to_numeric(df["Value"], errors="coerce").astype("float64"),
+        Prediction=pd.to_numeric(df["Prediction"], errors="coerce").astype("Int16"),
+    )
+    keep = df["Measurement"].isin(RELEVANT_MEASUREMENTS) & (df["Value"] != SENTINEL)
+    if sites is not None:
+        site = df["Site"].astype("category")
+        allowed = [c for c in site.cat.categories if str(c).replace('"', "").strip() in sites]
+        keep &= site.isin(allowed)
+    return df[keep]
+
+
+def read_weather_csv(path: Path, sites=None) -> pd.DataFrame:
+    """Read a bronze weather CSV (.csv, or any bronze codec) down to the
+    rows clean_dataframe() keeps, optionally only for `sites`. Only the
+    header is read before the columns are validated."""
+    with contextlib.ExitStack() as stack:
+        src = stack.enter_context(bronze_codec.open_text(path)) if bronze_codec.is_compressed(path) else path
+        missing = REQUIRED_COLUMNS - set(pd.read_csv(src, nrows=0).columns)
+        if missing:
+            raise ValueError(f"CSV missing required columns: {missing}")
+        if hasattr(src, "seek"):
+            src.seek(0)
+        opts = {"usecols": list(CSV_DTYPES), "dtype": CSV_DTYPES}
+        if CSV_ENGINE == "pyarrow" and pyarrow is not None:
+            return _prune(pd.read_csv(src, engine="pyarrow", **opts), sites)
+        chunks = [_prune(c, sites) for c in pd.read_csv(src, chunksize=CSV_CHUNK_ROWS, **opts)]
+    if not chunks:
+        return pd.DataFrame({c: pd.Series(dtype=t) for c, t in CSV_DTYPES.items()})
+    return pd.concat(chunks, ignore_index=True)
+
 
 def parse_prediction_date(filename):
     """Extract prediction date from filename: Pred_2023-01-01.csv -> 2023-01-01"""
@@ -149,8 +226,12 @@ def clean_dataframe(df: pd.DataFrame, prediction_date) -> pd.DataFrame:
     if missing:
         raise ValueError(f"CSV missing required columns: {missing}")
 
+    # keep relevant fields only (before the timestamp parse -- most rows go)
+    df = df[df["Measurement"].isin(RELEVANT_MEASUREMENTS)].copy()
+    n_after_filter = len(df)
+
     # timestamp
-    df["timestamp"] = pd.to_datetime(df["Time"], errors="coerce", utc=True)
+    df["timestamp"] = pd.to_datetime(df["Time"], errors="coerce", utc=True, format="ISO8601")
     df = df.dropna(subset=["timestamp"])
     n_after_ts = len(df)
 
@@ -158,12 +239,8 @@ def clean_dataframe(df: pd.DataFrame, prediction_date) -> pd.DataFrame:
     df = df[df["timestamp"].dt.year >= WEATHER_MIN_YEAR].copy()
     n_after_year = len(df)
 
-    # keep relevant fields only
-    df = df[df["Measurement"].isin(RELEVANT_MEASUREMENTS)].copy()
-    n_after_filter = len(df)
-
     # site clean
-    df["site"] = df["Site"].str.replace('"', "").str.strip()
+    df["site"] = df["Site"].astype("string").str.replace('"', "").str.strip()
 
     # prediction number
     df["prediction"] = pd.to_numeric(df["Prediction"], errors="coerce").astype("Int16")
@@ -180,10 +257,10 @@ def clean_dataframe(df: pd.DataFrame, prediction_date) -> pd.DataFrame:
     df["prediction_date"] = prediction_date
 
     # measurement (keep original name — mapping done in Gold)
-    df["measurement"] = df["Measurement"]
+    df["measurement"] = df["Measurement"].astype("string")
 
     # unit
-    df["unit"] = df["Unit"].str.strip()
+    df["unit"] = df["Unit"].astype("string").str.strip()
 
     # outlier flagging (silent — outlier counts not interesting per-file)
     df["is_outlier"] = False
@@ -197,10 +274,18 @@ def clean_dataframe(df: pd.DataFrame, prediction_date) -> pd.DataFrame:
 
 # ─── BULK LOAD ───
 
-def upsert(engine, df):
-    """Bulk load via COPY to temp table + INSERT ON CONFLICT. Fastest method."""
+def load_slice(engine, df, prediction_date, filename=None, sites=None):
+    """Replace the file's prediction_date slice of silver.weather_forecasts:
+    COPY to temp table, DELETE the slice, INSERT the new rows -- no
+    ON CONFLICT probe per row (see weather_partitions.py). With `sites` the
+    slice is only those sites' rows; other sites are left untouched.
+    `filename` is watermarked in the same transaction, so a file's rows and
+    its watermark commit (or roll back) together."""
     import io
 
+    # Partition first, in its own transaction (creating one locks the parent)
+    weather_partitions.ensure_month(engine, prediction_date, log)
+
     # 1. Write DataFrame to CSV buffer in memory
     buf = io.StringIO()
     df.to_csv(buf, index=False, header=False, sep='\t')
@@ -212,7 +297,6 @@ def upsert(engine, df):
         cur = raw.cursor()
 
         # 3. Create temp table (no constraints = fast writes)
-        cur.execute("DROP TABLE IF EXISTS _tmp_weather")
         cur.execute("""
             CREATE TEMP TABLE _tmp_weather (
                 timestamp   TIMESTAMPTZ,
@@ -223,27 +307,23 @@ def upsert(engine, df):
                 value       FLOAT,
                 unit        VARCHAR(20),
                 is_outlier  BOOLEAN
-            )
+            ) ON COMMIT DROP
         """)
 
         # 4. COPY from buffer — this is the fast part
         cur.copy_from(buf, '_tmp_weather', sep='\t', null='')
 
-        # 5. Merge into target
-        cur.execute("""
-            INSERT INTO silver.weather_forecasts
-                (timestamp, site, prediction, prediction_date, measurement, value, unit, is_outlier)
-            SELECT timestamp, site, prediction, prediction_date, measurement, value, unit, is_outlier
-            FROM _tmp_weather
-            ON CONFLICT (timestamp, site, prediction, prediction_date, measurement)
-            DO UPDATE SET
-                value = EXCLUDED.value,
-                unit = EXCLUDED.unit,
-                is_outlier = EXCLUDED.is_outlier
-        """)
+        # 5. Replace the slice (one partition)
+        if sites is None:
+            cur.execute(weather_partitions.DELETE_SLICE_SQL, {"d": prediction_date})
+        else:
+            cur.execute(weather_partitions.DELETE_SITES_SQL, {"d": prediction_date, "sites": sorted(sites)})
+        cur.execute(weather_partitions.INSERT_SLICE_SQL)
         n = cur.rowcount
 
-        cur.execute("DROP TABLE IF EXISTS _tmp_weather")
+        # 6. Watermark, same transaction
+        if filename is not None:
+            mark_done(engine, filename, cur=cur)
         raw.commit()
     except Exception:
         raw.rollback()
@@ -254,62 +334,71 @@ def upsert(engine, df):
     return n
 
 
-def _load_processed_log() -> set[str]:
-    """Load filenames already imported + cleaned up from bronze. Same skip-list
+def _load_processed_log():
+    """Filenames already imported + cleaned up from bronze. Same skip list
     bulk_to_bronze.py uses, so we don't re-process files that were already
     cleaned and deleted from bronze."""
-    if not PROCESSED_LOG.exists():
-        return set()
     try:
-        with PROCESSED_LOG.open(encoding="utf-8") as f:
-            return {line.strip() for line in f if line.strip()}
+        return skip_list.SkipList()
     except Exception:
         return set()
 
 
 def find_csv(watermark):
     """Find new CSV files in bronze directory that are not in the watermark
-    or in the processed.log skip-list."""
+    or in the skip list."""
     root = BRONZE_ROOT / "weather"
     if not root.exists():
         return []
 
-    skip = watermark | _load_processed_log()
+    skip = _load_processed_log()
     all_files = list(root.rglob("*.csv"))
-    return [f for f in all_files if f.name not in skip]
+    return [f for f in all_files if f.name not in watermark and f.name not in skip]
 
 
 
 # ─── JOB ───
 
-# Parallel file processor. Workers run independently — each opens its own
-# connection, processes one CSV (read → clean → COPY → upsert), and returns
-# row count. PostgreSQL handles concurrent INSERT FROM SELECT against the same
-# table fine, so we get ~3-4x speedup vs the previous sequential loop.
+# Parallel file processor. Workers run independently — each processes one
+# CSV at a time (read → clean → COPY → slice replace + watermark in one
+# transaction)
+# and returns row count. PostgreSQL handles concurrent INSERT FROM SELECT
+# against the same table fine, so we get ~3-4x speedup vs the previous
+# sequential loop.
 WORKERS = int(os.getenv("CLEAN_WEATHER_WORKERS", "4"))
 
+# One single-connection engine per worker process, created by the pool
+# initializer and kept for every file that process handles (the pool reuses
+# its processes) -- no connect / dispose per file.
+_WORKER_ENGINE = None
+
+
+def _init_worker(db_url: str) -> None:
+    global _WORKER_ENGINE
+    _WORKER_ENGINE = create_engine(db_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+
+
+def _worker_engine():
+    if _WORKER_ENGINE is None:
+        _init_worker(DB_URL)
+    return _WORKER_ENGINE
+
 
 def _append_processed_log(name: str) -> None:
     try:
-        PROCESSED_LOG.parent.mkdir(parents=True, exist_ok=True)
-        with PROCESSED_LOG.open("a", encoding="utf-8") as f:
-            f.write(name + "\n")
+        skip_list.add([name])
     except Exception:
         pass
 
 
 def _compress_bronze_csv(path: Path) -> None:
-    """Compress a bronze CSV in place (file.csv -> file.csv.gz, original
+    """Compress a bronze CSV in place (file.csv -> file.csv.gz|.zst, original
     removed) after successful silver ingestion. Preserves the audit trail
     while shrinking disk ~10-20x for typical weather CSVs."""
-    import gzip, shutil
     try:
         if not path.exists():
             return
-        dst = path.with_suffix(path.suffix + ".gz")
-        with path.open("rb") as f_in, gzip.open(dst, "wb", compresslevel=6) as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        path.unlink()
+        bronze_codec.compress_file(path, use_dict=False)
     except Exception:
         return
     _append_processed_log(path.name)
@@ -328,7 +417,8 @@ def _post_silver(path: Path) -> None:
     """Compress (default) or delete the bronze CSV after silver ingestion."""
     if COMPRESS_BRONZE_ON_SILVER:
         _compress_bronze_csv(path)
-    el_post_silver(path)
+    elif DELETE_BRONZE_ON_SILVER:
+        _delete_bronze_csv(path)
 
 
 def _process_one_file(path_str: str) -> tuple[str, int, str | None]:
@@ -338,39 +428,26 @@ def _process_one_file(path_str: str) -> tuple[str, int, str | None]:
     if prediction_date is None:
         return (path.name, 0, "could not parse prediction date")
 
+    sites = set(WEATHER_SITES) if SITE_FILTER else None
     try:
-        df = pd.read_csv(path)
+        engine = _worker_engine()
+        df = read_weather_csv(path, sites)
         if df.empty:
             # Empty source — mark as done so we don't keep re-reading it
-            engine = create_engine(DB_URL)
-            try:
-                mark_done(engine, path.name)
-            finally:
-                engine.dispose()
+            mark_done(engine, path.name)
             _post_silver(path)
             return (path.name, 0, "empty file")
 
         df_clean = clean_dataframe(df, prediction_date)
         if df_clean.empty:
-            engine = create_engine(DB_URL)
-            try:
-                mark_done(engine, path.name)
-            finally:
-                engine.dispose()
+            mark_done(engine, path.name)
             _post_silver(path)
             return (path.name, 0, "no rows after cleaning")
 
-        # Each worker gets its own engine
-        engine = create_engine(DB_URL)
-        try:
-            n = upsert(engine, df_clean)
-            mark_done(engine, path.name)
-        finally:
-            engine.dispose()
+        n = load_slice(engine, df_clean, prediction_date, filename=path.name, sites=sites)
 
-        # Aggressive cleanup: delete the bronze CSV now that silver has it
-        if DELETE_BRONZE_ON_SILVER:
-            _delete_bronze_csv(path)
+        # Compress (or delete) the bronze CSV now that silver has it
+        _post_silver(path)
 
         return (path.name, n, None)
     except Exception as e:
@@ -403,7 +480,7 @@ def run():
     done = 0
     errors = 0
 
-    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker, initargs=(DB_URL,)) as executor:
         futures = {executor.submit(_process_one_file, str(p)): p for p in files}
         for fut in as_completed(futures):
             done += 1
@@ -430,5 +507,80 @@ def run():
              f"{done - errors} ok, {errors} failed")
 
 
+# ─── SITE BACKFILL ───
+
+def find_bronze_csv():
+    """Every weather CSV still in bronze, compressed or not."""
+    root = BRONZE_ROOT / "weather"
+    if not root.exists():
+        return []
+    return sorted(p for p in root.rglob("*.csv*") if bronze_codec.strip_suffix(p.name).endswith(".csv"))
+
+
+def _backfill_one_file(path_str: str, sites: set) -> tuple[str, int, str | None]:
+    """Worker entrypoint for --backfill-site: load only `sites` from an
+    already-ingested file. Watermark and bronze are left as they are."""
+    path = Path(path_str)
+    name = bronze_codec.strip_suffix(path.name)
+    prediction_date = parse_prediction_date(name)
+    if prediction_date is None:
+        return (name, 0, "could not parse prediction date")
+    try:
+        df = read_weather_csv(path, sites)
+        if df.empty:
+            return (name, 0, None)
+        df_clean = clean_dataframe(df, prediction_date)
+        if df_clean.empty:
+            return (name, 0, None)
+        return (name, load_slice(_worker_engine(), df_clean, prediction_date, sites=sites), None)
+    except Exception as e:
+        return (name, 0, str(e)[:120])
+
+
+def backfill_sites(sites: list[str]):
+    """Load `sites` from every weather file in bronze (.csv, .csv.gz,
+    .csv.zst), replacing only their rows -- the sites already in silver
+    are not re-read or rewritten. Files cleanup_bronze already deleted
+    cannot be backfilled."""
+    if not DB_URL:
+        raise EnvironmentError("DB_URL not set")
+    sites = {s.strip() for s in sites if s.strip()}
+    if SITE_FILTER and not sites <= set(WEATHER_SITES):
+        log.warning(f"{sorted(sites - set(WEATHER_SITES))} not in WEATHER_SITES -- "
+                    f"new files will drop them again; add them to .env")
+
+    engine = create_engine(DB_URL)
+    init_db(engine)
+    engine.dispose()
+
+    files = find_bronze_csv()
+    log.info(f"Backfilling {', '.join(sorted(sites))} from {len(files)} bronze files  ({WORKERS} parallel workers)")
+
+    import time
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    t_start = time.monotonic()
+    total_rows = errors = 0
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=_init_worker, initargs=(DB_URL,)) as executor:
+        futures = [executor.submit(_backfill_one_file, str(p), sites) for p in files]
+        for done, fut in enumerate(as_completed(futures), 1):
+            name, n, err = fut.result()
+            total_rows += n
+            if err:
+                errors += 1
+                log.warning(f"  {done:>4}/{len(files)}  {name}  ✗ {err}")
+            elif done % 25 == 0 or done == len(files):
+                log.info(f"  {done:>4}/{len(files)}  {total_rows:,} rows")
+
+    log.info(f"Backfill done in {(time.monotonic() - t_start)/60:.1f}min — {total_rows:,} rows, "
+             f"{len(files) - errors} files ok, {errors} failed")
+
+
 if __name__ == "__main__":
-    run()
+    if "--backfill-site" in sys.argv:
+        i = sys.argv.index("--backfill-site") + 1
+        sites = sys.argv[i].split(",") if i < len(sys.argv) else []
+        if not any(s.strip() for s in sites):
+            sys.exit('Usage: python -m etl.bronze_to_silver.clean_weather --backfill-site "Site[,Site...]"')
+        backfill_sites(sites)
+    else:
+        run()
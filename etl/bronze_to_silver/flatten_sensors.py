@@ -2,29 +2,45 @@
 flatten_sensors.py -- Bronze to Silver: sensor_events (optimized)
 ================================================================
 Parallel processing, resume-capable via watermark.
-Only scans recent Bronze folders instead of full rglob.
+New files are found through the bronze catalog (indexed query) instead of
+an rglob over every apartment tree; the walk is kept as a fallback.
+
+Usage:
+  python -m etl.bronze_to_silver.flatten_sensors            # normal run
+  python -m etl.bronze_to_silver.flatten_sensors --rescan   # rebuild bronze catalog from disk first
+  python -m etl.bronze_to_silver.flatten_sensors --bulk     # force the backlog bulk load (sensor_bulkload.py)
+  python -m etl.bronze_to_silver.flatten_sensors --reparse  # parse every file, even with an unchanged digest
 
 Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
 """
 
 import csv
-import gzip
 import io
 import json
 import logging
 import os
-import shutil
+import sys
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from datetime import datetime, timezone
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from dotenv import load_dotenv
-from psycopg2 import extras as _pg_extras
+from psycopg2 import errors as _pg_errors
 from sqlalchemy import create_engine, text
 
 load_dotenv()
 
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from etl.bronze_to_silver import sensor_bulkload, sensor_channels, sensor_partitions, sensor_watermark
+from etl.bronze_to_silver.sensor_batch import BINARY_COLUMNS, SensorBatch
+from ingestion.fast_flow import bronze_catalog, bronze_codec, bronze_segments, coverage, skip_list
+
 BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
 DB_URL      = os.getenv("DB_URL")
 APARTMENTS  = ["jimmy", "jeremie"]
@@ -33,7 +49,8 @@ BATCH_SIZE  = 5000  # bigger batches = fewer round-trips + better COPY amortisat
 LOG_EVERY   = 1     # log after every batch — keeps the user reassured during long runs
 
 # After a batch is successfully inserted into silver + watermarked, compress
-# the bronze JSON files in place (file.json -> file.json.gz). This preserves
+# the bronze JSON files in place (file.json -> file.json.gz, or .zst with
+# BRONZE_CODEC=zstd / zstd+dict -- see bronze_codec.py). This preserves
 # the full audit trail (the whole point of having a bronze layer) while
 # shrinking disk usage 10-15x with gzip. Set KEEP_BRONZE=1 to keep raw
 # uncompressed files (e.g. for debugging). Set DELETE_BRONZE=1 to delete
@@ -42,11 +59,40 @@ LOG_EVERY   = 1     # log after every batch — keeps the user reassured during
 COMPRESS_BRONZE_ON_SILVER = os.getenv("KEEP_BRONZE", "0") != "1" and os.getenv("DELETE_BRONZE", "0") != "1"
 DELETE_BRONZE_ON_SILVER   = os.getenv("DELETE_BRONZE", "0") == "1"
 
-# When we delete a file from bronze, we also append its filename to this log.
-# bulk_to_bronze.py reads this log on every scan and skips files listed here,
-# so a later SMB rescan doesn't re-copy the same files we just cleaned up.
-PROCESSED_LOG = (BRONZE_ROOT.parent / "processed.log") if BRONZE_ROOT.is_absolute() \
-    else (Path(__file__).resolve().parent.parent.parent / BRONZE_ROOT.parent / "processed.log")
+# Who writes each batch to silver:
+#   parent  -- workers parse and pickle their rows back; the parent COPYs,
+#              upserts and post-processes bronze one batch at a time (default)
+#   workers -- each worker process owns a connection, COPYs its batch into
+#              its own temp table, commits rows + watermark in one
+#              transaction and compresses its bronze files; only filenames
+#              and counters travel back. Ingest then scales with WORKERS
+#              instead of being capped by the parent's single writer loop.
+SILVER_WRITER = os.getenv("SILVER_WRITER", "parent").lower()
+
+# Wire format of the COPY into the temp table:
+#   csv    -- text rows; Postgres parses every float and ISO timestamp (default)
+#   binary -- PGCOPY binary streamed from the SensorBatch columns: float8 and
+#             timestamptz go over as raw 8-byte values, nothing to parse.
+#             Compare with scripts/bench_sensor_copy.py.
+COPY_FORMAT = os.getenv("SENSOR_COPY_FORMAT", "csv").lower()
+COPY_READ_SIZE = 1 << 20  # bytes psycopg2 pulls per read() of the binary stream
+
+# Append-only fast path: a batch whose readings are all newer than the
+# newest silver row of their apartment is deduplicated in Python and COPYed
+# straight into the target -- no temp table, no DISTINCT ON sort, no
+# ON CONFLICT probe. The per-apartment maximum is read from silver once per
+# process and advanced after every commit. If the guess is wrong (another
+# writer got there first) the COPY hits the unique index and the batch
+# falls back to the upsert, so the outcome is always the same.
+APPEND_FAST_PATH = os.getenv("SENSOR_APPEND_FAST_PATH", "1") == "1"
+
+# Content-digest skip: before a batch is parsed, the parent looks up the
+# digests recorded for its files (silver.sensor_file_digests, see
+# sensor_watermark.py) that the watermark still covers. A file whose
+# content hashes the same is only post-processed -- no JSON parse, no
+# upsert -- so a replay of months of unchanged bronze costs a read and a
+# hash per file. After a watermark reset every file is parsed again.
+SKIP_UNCHANGED = os.getenv("FLATTEN_SKIP_UNCHANGED", "1") == "1" and "--reparse" not in sys.argv
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
 log = logging.getLogger("flatten_sensors")
@@ -55,77 +101,107 @@ R="\033[0m"; B="\033[1m"; D="\033[2m"; GR="\033[32m"; RE="\033[31m"
 
 
 def canonical_bronze_name(name: str) -> str:
-    """Strip trailing .gz so .json and .json.gz map to the same watermark key.
-    Lets us recognise compressed-and-already-processed files without
-    fragmenting the watermark across two suffixes."""
-    return name[:-3] if name.endswith(".gz") else name
+    """Strip trailing .gz / .zst so .json and its compressed forms map to the
+    same watermark key. Lets us recognise compressed-and-already-processed
+    files without fragmenting the watermark across suffixes."""
+    return bronze_codec.strip_suffix(name)
 
 
 def open_bronze(path: Path):
-    """Open a bronze file as a text stream, handling both .json and .json.gz."""
-    if path.suffix == ".gz":
-        return gzip.open(path, "rt", encoding="utf-8")
+    """Open a bronze file as a text stream, handling .json, .json.gz,
+    .json.zst (with or without dictionary) and members of an hourly segment
+    (.../HH.seg/<file>.json)."""
+    if bronze_segments.is_member(path):
+        return bronze_segments.open_member(path)
+    if bronze_codec.is_compressed(path):
+        return bronze_codec.open_text(path)
     return open(path, encoding="utf-8")
 
 
 # -- WATERMARK -----------------------------------------------------------------
-
-WATERMARK_DDL = """
-    CREATE TABLE IF NOT EXISTS silver.etl_watermark (
-        filename     VARCHAR(200) PRIMARY KEY,
-        processed_at TIMESTAMPTZ DEFAULT NOW()
-    );
-"""
+# Range-compressed: see sensor_watermark.py. The returned object behaves like
+# the old set of filenames (`in`, `len`, `update`).
 
 def load_watermark(engine):
+    sensor_watermark.ensure_schema(engine, log)
+    return sensor_watermark.load(engine)
+
+
+# Warm state for long-lived callers (watcher --daemon). A one-shot CLI run
+# builds both once and exits; the daemon keeps them across run() calls so
+# each minute only pays for the delta.
+_ENGINE = None
+_WATERMARK = None
+_WATERMARK_SYNCED_AT = None
+
+# Ranges are stamped with the writing transaction's NOW(), which can be a
+# little older than its commit. Re-read this much overlap on every delta.
+WATERMARK_SYNC_OVERLAP = timedelta(minutes=10)
+
+
+def get_engine():
+    """Process-wide engine (connection pool), created on first use."""
+    global _ENGINE
+    if _ENGINE is None:
+        _ENGINE = create_engine(DB_URL, pool_size=WORKERS, max_overflow=4, pool_pre_ping=True)
+    return _ENGINE
+
+
+# One single-connection engine per worker process (SILVER_WRITER=workers).
+# ProcessPoolExecutor reuses its processes, so it survives across batches.
+_WORKER_ENGINE = None
+
+
+def get_worker_engine(db_url):
+    global _WORKER_ENGINE
+    if _WORKER_ENGINE is None:
+        _WORKER_ENGINE = create_engine(db_url, pool_size=1, max_overflow=0, pool_pre_ping=True)
+    return _WORKER_ENGINE
+
+
+def load_watermark_warm(engine):
+    """Full load on the first call, then only ranges stamped since the last
+    sync. The returned watermark is kept and updated in place by run()."""
+    global _WATERMARK, _WATERMARK_SYNCED_AT
+    if _WATERMARK is None:
+        with engine.begin() as conn:
+            _WATERMARK_SYNCED_AT = conn.execute(text("SELECT NOW()")).scalar()
+        _WATERMARK = load_watermark(engine)
+        return _WATERMARK
+
     with engine.begin() as conn:
-        conn.execute(text(WATERMARK_DDL))
-        rows = conn.execute(text("SELECT filename FROM silver.etl_watermark")).fetchall()
-    return {r[0] for r in rows}
+        now = conn.execute(text("SELECT NOW()")).scalar()
+    sensor_watermark.load_into(engine, _WATERMARK, since=_WATERMARK_SYNCED_AT - WATERMARK_SYNC_OVERLAP)
+    _WATERMARK_SYNCED_AT = now
+    return _WATERMARK
 
 
 def watermark_count(engine):
-    """Fast count without loading all filenames."""
-    with engine.begin() as conn:
-        row = conn.execute(text("SELECT COUNT(*) FROM silver.etl_watermark")).fetchone()
-    return row[0]
+    """Fast count without loading the ranges."""
+    return sensor_watermark.count(engine)
 
 
-def mark_done(engine, filenames):
-    """Bulk-mark filenames as processed. Uses psycopg2.execute_values for
-    ~10-30x speedup over SQLAlchemy executemany."""
-    if not filenames:
-        return
-    raw = engine.raw_connection()
-    try:
-        cur = raw.cursor()
-        _pg_extras.execute_values(
-            cur,
-            "INSERT INTO silver.etl_watermark (filename) VALUES %s ON CONFLICT DO NOTHING",
-            [(f,) for f in filenames],
-            page_size=5000,
-        )
-        raw.commit()
-    finally:
-        raw.close()
+def mark_done(engine, filenames, cur=None):
+    """Mark filenames as processed -- one range merge per contiguous run of
+    minutes instead of one row per file. With `cur`, inside the caller's
+    transaction."""
+    sensor_watermark.mark_done(engine, filenames, cur=cur)
 
 
 def _append_processed_log(filenames: list[str]):
-    """Append filenames to processed.log so future SMB rescans + watermark
-    scans skip them. Best-effort."""
+    """Record filenames in the skip list (skip_list.py) so future SMB
+    rescans + watermark scans skip them. Best-effort."""
     try:
-        PROCESSED_LOG.parent.mkdir(parents=True, exist_ok=True)
-        with PROCESSED_LOG.open("a", encoding="utf-8") as f:
-            for name in filenames:
-                f.write(name + "\n")
+        skip_list.add(filenames)
     except Exception as e:
-        log.warning(f"Could not append to {PROCESSED_LOG}: {e}")
+        log.warning(f"Could not append to skip list {skip_list.JOURNAL}: {e}")
 
 
 def compress_bronze_files(paths: list[str], filenames: list[str]):
     """Compress bronze files in-place after silver ingestion (file.json
-    -> file.json.gz, original removed). Preserves the audit trail while
-    shrinking disk usage ~10-15x for typical sensor JSON payloads.
+    -> file.json.gz|.zst per BRONZE_CODEC, original removed). Preserves the
+    audit trail while shrinking disk usage ~10-15x for typical sensor JSON
+    payloads (more with a trained zstd dictionary).
 
     Best-effort: never crashes the pipeline on a permission error or
     missing file, just counts and warns.
@@ -134,20 +210,20 @@ def compress_bronze_files(paths: list[str], filenames: list[str]):
         return 0, 0
     compressed = 0
     failed = 0
+    compressed_names = []
     for p in paths:
         try:
             src = Path(p)
             if not src.exists():
                 # Already processed in a previous run, skip silently
                 continue
-            dst = src.with_suffix(src.suffix + ".gz")
-            with src.open("rb") as f_in, gzip.open(dst, "wb", compresslevel=6) as f_out:
-                shutil.copyfileobj(f_in, f_out)
-            src.unlink()
+            bronze_codec.compress_file(src)
             compressed += 1
+            compressed_names.append(src.name)
         except Exception:
             failed += 1
     _append_processed_log(filenames)
+    bronze_catalog.record(compressed_names, bronze_codec.SUFFIX_STATES[bronze_codec.suffix()])
     return compressed, failed
 
 
@@ -163,13 +239,20 @@ def delete_bronze_files(paths: list[str], filenames: list[str]):
         return 0, 0
     deleted = 0
     failed = 0
+    deleted_names = []
     for p in paths:
+        # A segment member can't be removed on its own; whole segments are
+        # dropped by cleanup_bronze.py once every minute in them expired.
+        if bronze_segments.is_member(p):
+            continue
         try:
             Path(p).unlink(missing_ok=True)
             deleted += 1
+            deleted_names.append(Path(p).name)
         except Exception:
             failed += 1
     _append_processed_log(filenames)
+    bronze_catalog.record(deleted_names, "deleted")
     return deleted, failed
 
 # -- SENSOR PARSING ------------------------------------------------------------
@@ -211,27 +294,28 @@ def make_row(apt, room, stype, field, value, unit, ts):
     }
 
 
-def flatten(apt, payload, ts):
-    rows = []
+def readings(payload):
+    """Yield (room, sensor_type, field, value, unit) for every reading in
+    one sensor JSON. Rooms are raw (norm_room() is applied by the caller)."""
     for room, d in payload.get("plugs", {}).items():
         for f, u in [("power","W"),("total","Wh"),("temperature","C")]:
             if d.get(f) is not None:
-                rows.append(make_row(apt, room, "plug", f, d[f], u, ts))
+                yield room, "plug", f, d[f], u
 
     for room, sensors in payload.get("doorsWindows", {}).items():
         if not isinstance(sensors, list):
             sensors = [sensors]
         for s in sensors:
             stype = s.get("type","door").lower()
-            rows.append(make_row(apt, room, stype, "open", 1.0 if str(s.get("switch","off")).lower()=="on" else 0.0, "bool", ts))
+            yield room, stype, "open", 1.0 if str(s.get("switch","off")).lower()=="on" else 0.0, "bool"
             if s.get("battery") is not None:
-                rows.append(make_row(apt, room, stype, "battery", s["battery"], "%", ts))
+                yield room, stype, "battery", s["battery"], "%"
 
     for room, d in payload.get("motions", {}).items():
         for f, u in [("motion","bool"),("light","lux"),("temperature","C")]:
             if d.get(f) is not None:
                 v = 1.0 if d[f] is True else (0.0 if d[f] is False else d[f])
-                rows.append(make_row(apt, room, "motion", f, v, u, ts))
+                yield room, "motion", f, v, u
 
     inner = payload.get("meteos", {}).get("meteo", payload.get("meteos", {}))
     for room, d in inner.items():
@@ -242,54 +326,142 @@ def flatten(apt, payload, ts):
             ("battery_percent","battery","%"),
         ]:
             if d.get(src) is not None:
-                rows.append(make_row(apt, room, "meteo", field, d[src], unit, ts))
+                yield room, "meteo", field, d[src], unit
 
     for room, d in payload.get("humidities", {}).items():
         for f, u in [("temperature","C"),("humidity","%")]:
             if d.get(f) is not None:
-                rows.append(make_row(apt, room, "humidity", f, d[f], u, ts))
+                yield room, "humidity", f, d[f], u
         if d.get("devicePower") is not None:
-            rows.append(make_row(apt, room, "humidity", "battery", d["devicePower"], "%", ts))
+            yield room, "humidity", "battery", d["devicePower"], "%"
 
     for loc, d in payload.get("consumptions", {}).items():
         for f, u in [("total_power","W"),("power1","W"),("power2","W"),("power3","W"),
                      ("current1","A"),("current2","A"),("current3","A"),
                      ("voltage1","V"),("voltage2","V"),("voltage3","V")]:
             if d.get(f) is not None:
-                rows.append(make_row(apt, loc, "consumption", f, d[f], u, ts))
+                yield loc, "consumption", f, d[f], u
+
+
+def flatten(apt, payload, ts):
+    """One sensor JSON -> list of row dicts (make_row() shape)."""
+    return [make_row(apt, room, stype, field, value, unit, ts)
+            for room, stype, field, value, unit in readings(payload)]
 
-    return rows
+
+def flatten_into(batch, apt, payload, ts):
+    """One sensor JSON -> appended to a columnar SensorBatch. Room names and
+    outlier flags are resolved once per batch in batch.finish()."""
+    epoch = int(ts.timestamp())
+    append = batch.append
+    for room, stype, field, value, unit in readings(payload):
+        append(apt, room, stype, field, value, unit, epoch)
 
 # -- BATCH PROCESSING ----------------------------------------------------------
 
 def process_batch(args):
-    paths_and_apt, db_url = args
-    all_rows = []
+    paths_and_apt, known = args[0], args[3]
+    batch = SensorBatch()
     processed = []        # filenames (for watermark)
     processed_paths = []  # full paths (for optional deletion)
-    errors = 0
+    digests = {}          # filename -> content digest, for files parsed
+    errors = unchanged = 0
     for path_str, apt in paths_and_apt:
+        mark = batch.mark()
         try:
             path = Path(path_str)
-            with open_bronze(path) as f:
-                payload = json.load(f)
-            ts = parse_timestamp(payload.get("datetime", ""))
-            all_rows.extend(flatten(apt, payload, ts))
             # Always store the canonical (.json) form in the watermark, even
             # if we just read a .json.gz — keeps the watermark key stable
             # whether or not the file has been compressed.
-            processed.append(canonical_bronze_name(path.name))
+            name = canonical_bronze_name(path.name)
+            with open_bronze(path) as f:
+                data = f.read()
+            digest = sensor_watermark.digest(data)
+            if known.get(name) == digest:
+                unchanged += 1   # same content already in silver
+            else:
+                payload = json.loads(data)
+                ts = parse_timestamp(payload.get("datetime", ""))
+                flatten_into(batch, apt, payload, ts)
+                digests[name] = digest
+            processed.append(name)
             processed_paths.append(path_str)
         except Exception:
+            batch.truncate(mark)   # all-or-nothing per file
             errors += 1
     return {
-        "rows": all_rows,
+        "rows": batch.finish(room_map=ROOM_MAP, bounds=BOUNDS),
         "processed": processed,
         "processed_paths": processed_paths,
+        "digests": digests,
+        "unchanged": unchanged,
         "errors": errors,
     }
 
 
+def known_digests(engine, paths_and_apt) -> dict:
+    """Recorded digests of a batch's files ({} with SKIP_UNCHANGED off)."""
+    if not SKIP_UNCHANGED:
+        return {}
+    return sensor_watermark.known_digests(
+        engine, [canonical_bronze_name(Path(p).name) for p, _ in paths_and_apt])
+
+
+def post_process_bronze(paths: list[str], filenames: list[str]):
+    """Compress (default) or delete bronze files that just made it into
+    silver. Returns (compressed, deleted)."""
+    if COMPRESS_BRONZE_ON_SILVER:
+        return compress_bronze_files(paths, filenames)[0], 0
+    if DELETE_BRONZE_ON_SILVER:
+        return 0, delete_bronze_files(paths, filenames)[0]
+    return 0, 0
+
+
+def process_and_write(args):
+    """SILVER_WRITER=workers: parse a batch, upsert it through this
+    process's own connection (rows + watermark in one transaction) and
+    post-process its bronze files. Returns filenames and counters only."""
+    _, db_url, staging, _ = args
+    result = process_batch(args)
+    upsert(get_worker_engine(db_url), result["rows"], result["processed"], staging=staging,
+           digests=result["digests"])
+    compressed, deleted = post_process_bronze(result["processed_paths"], result["processed"])
+    return {
+        "n_rows": len(result["rows"]),
+        "processed": result["processed"],
+        "unchanged": result["unchanged"],
+        "errors": result["errors"],
+        "compressed": compressed,
+        "deleted": deleted,
+        "written": True,
+    }
+
+
+def process_payloads(items):
+    """process_batch() for files already in memory: `items` is a list of
+    (filename, apartment, raw_bytes). Used by the streaming SMB -> silver
+    path in bulk_to_bronze.py, which has just read the bytes off the share
+    and must not read them again from bronze."""
+    batch = SensorBatch()
+    processed = []
+    digests = {}
+    errors = 0
+    for filename, apt, data in items:
+        mark = batch.mark()
+        try:
+            payload = json.loads(data)
+            ts = parse_timestamp(payload.get("datetime", ""))
+            flatten_into(batch, apt, payload, ts)
+            name = canonical_bronze_name(filename)
+            processed.append(name)
+            digests[name] = sensor_watermark.digest(data)
+        except Exception:
+            batch.truncate(mark)
+            errors += 1
+    return {"rows": batch.finish(room_map=ROOM_MAP, bounds=BOUNDS), "processed": processed,
+            "processed_paths": [], "digests": digests, "unchanged": 0, "errors": errors}
+
+
 _TEMP_DDL = """
     CREATE TEMP TABLE _tmp_sensor_events (
         apartment   text,
@@ -317,9 +489,115 @@ _UPSERT_FROM_TMP = """
     DO UPDATE SET value      = EXCLUDED.value,
                   unit       = EXCLUDED.unit,
                   is_outlier = EXCLUDED.is_outlier
+    WHERE (sensor_events.value, sensor_events.unit, sensor_events.is_outlier)
+          IS DISTINCT FROM (EXCLUDED.value, EXCLUDED.unit, EXCLUDED.is_outlier)
 """
 
-def upsert(engine, rows):
+def _rows_to_csv(rows):
+    """COPY stream for a list of make_row() dicts (the columnar SensorBatch
+    has its own, faster to_csv())."""
+    buf = io.StringIO()
+    w = csv.writer(buf, quoting=csv.QUOTE_MINIMAL)
+    for r in rows:
+        ts = r["timestamp"]
+        if hasattr(ts, "isoformat"):
+            ts = ts.isoformat()
+        w.writerow([
+            r["apartment"],
+            r["room"],
+            r["sensor_type"],
+            r["field"],
+            r["value"] if r["value"] is not None else "",
+            r["unit"]  if r["unit"]  is not None else "",
+            ts,
+            "true" if r["is_outlier"] else "false",
+        ])
+    buf.seek(0)
+    return buf
+
+
+def copy_rows(cur, rows, fmt=None, table="_tmp_sensor_events"):
+    """COPY rows into `table` (the temp table, or silver.sensor_events on
+    the append-only path) in COPY_FORMAT (or `fmt`). Lists of make_row()
+    dicts always go as CSV."""
+    if (fmt or COPY_FORMAT) == "binary" and isinstance(rows, SensorBatch):
+        columns = ", ".join(f'"{c}"' for c in BINARY_COLUMNS)
+        cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT BINARY)",
+                        rows.binary_stream(), size=COPY_READ_SIZE)
+        return
+    # Stream rows as CSV into the temp table. NULL '' makes empty cells
+    # be NULL (so missing value/unit doesn't blow up doubles).
+    buf = rows.to_csv() if isinstance(rows, SensorBatch) else _rows_to_csv(rows)
+    cur.copy_expert(
+        f"COPY {table} "
+        "(apartment, room, sensor_type, field, value, unit, \"timestamp\", is_outlier) "
+        "FROM STDIN WITH (FORMAT CSV, NULL '')",
+        buf,
+    )
+
+
+def _ts_span(rows):
+    """(first, last) reading timestamp of a batch, as UTC datetimes."""
+    if isinstance(rows, SensorBatch):
+        lo, hi = int(rows.ts.min()), int(rows.ts.max())
+        return (datetime.fromtimestamp(lo, tz=timezone.utc), datetime.fromtimestamp(hi, tz=timezone.utc))
+    stamps = [r["timestamp"] for r in rows]
+    return min(stamps), max(stamps)
+
+
+# apartment -> epoch seconds of the newest reading known to be in silver
+# (-1 = none). Filled lazily per apartment; see APPEND_FAST_PATH.
+_SILVER_MAX_TS = {}
+_SILVER_MAX_LOCK = threading.Lock()
+
+
+def _silver_max_ts(engine, apartment, compact) -> int:
+    if compact:
+        # One backward probe of the (channel_id, timestamp) key per channel;
+        # sensor_readings has only a BRIN index on timestamp.
+        sql = """
+            SELECT EXTRACT(EPOCH FROM MAX(x.m))::BIGINT
+            FROM silver.sensor_channel c
+            CROSS JOIN LATERAL (SELECT MAX(r.timestamp) AS m FROM silver.sensor_readings r
+                                WHERE r.channel_id = c.channel_id) x
+            WHERE c.apartment = :a
+        """
+    else:
+        sql = "SELECT EXTRACT(EPOCH FROM MAX(timestamp))::BIGINT FROM silver.sensor_events WHERE apartment = :a"
+    with engine.connect() as conn:
+        value = conn.execute(text(sql), {"a": apartment}).scalar()
+    return -1 if value is None else int(value)
+
+
+def _is_append_only(engine, batch, compact) -> bool:
+    """Every reading of the batch is newer than its apartment's newest
+    silver row."""
+    spans = batch.apartment_spans()
+    with _SILVER_MAX_LOCK:
+        for apartment in spans:
+            if apartment not in _SILVER_MAX_TS:
+                _SILVER_MAX_TS[apartment] = _silver_max_ts(engine, apartment, compact)
+        return all(lo > _SILVER_MAX_TS[apartment] for apartment, (lo, _) in spans.items())
+
+
+def _advance_silver_max(batch):
+    with _SILVER_MAX_LOCK:
+        for apartment, (_, hi) in batch.apartment_spans().items():
+            if apartment in _SILVER_MAX_TS:
+                _SILVER_MAX_TS[apartment] = max(_SILVER_MAX_TS[apartment], hi)
+
+
+def _as_batch(rows):
+    """make_row() dicts -> finished SensorBatch (the compact layout only
+    writes batches)."""
+    batch = SensorBatch()
+    for r in rows:
+        batch.append(r["apartment"], r["room"], r["sensor_type"], r["field"],
+                     r["value"], r["unit"], int(r["timestamp"].timestamp()))
+    return batch.finish(bounds=BOUNDS)
+
+
+def upsert(engine, rows, filenames=None, staging=False, digests=None):
     """Bulk-upsert sensor events using PostgreSQL COPY into a TEMP TABLE,
     then a single INSERT ... SELECT ... ON CONFLICT to merge into silver.
 
@@ -328,56 +606,128 @@ def upsert(engine, rows):
     network round trips. Combined with a single set-based upsert, this is
     typically 5-10x faster than execute_values and 50-150x faster than the
     original per-row INSERT.
+
+    `rows` is a finished SensorBatch (what the parsers produce) or a list of
+    make_row() dicts.
+
+    `filenames` are watermarked in the same transaction, so a crash can
+    never leave rows in silver without their watermark (or the reverse);
+    so are `digests` ({filename: content digest}) for SKIP_UNCHANGED.
+    Conflicting rows are only rewritten when a value actually differs.
+
+    With the compact layout (sensor_channels.py) the rows go to
+    silver.sensor_readings as (channel_id, timestamp, value, is_outlier).
+
+    A batch entirely newer than silver takes the append-only path (see
+    APPEND_FAST_PATH). With `staging` (a backlog run, see
+    sensor_bulkload.py) rows are only COPYed into the staging table.
     """
-    if not rows:
+    if not rows and not filenames:
         return
+    compact = sensor_channels.is_compact(engine)
+    append = False
+    if rows:
+        if compact and not isinstance(rows, SensorBatch):
+            rows = _as_batch(rows)
+        if not staging and APPEND_FAST_PATH and isinstance(rows, SensorBatch) \
+                and _is_append_only(engine, rows, compact):
+            rows = rows.dedupe()
+            append = True
+        # Before the data transaction: creating a partition locks the parent
+        # (which must not be held while the merge runs), and channel ids must
+        # be committed before any reading refers to them.
+        if not staging:
+            sensor_partitions.ensure_range(engine, *_ts_span(rows), log=log,
+                                           relname="sensor_readings" if compact else "sensor_events")
+        if compact:
+            channel_id = sensor_channels.channel_ids(engine, rows)
     raw = engine.raw_connection()
     try:
         cur = raw.cursor()
-        cur.execute(_TEMP_DDL)
-
-        # Stream rows as CSV into the temp table. NULL '' makes empty cells
-        # be NULL (so missing value/unit doesn't blow up doubles).
-        buf = io.StringIO()
-        w = csv.writer(buf, quoting=csv.QUOTE_MINIMAL)
-        for r in rows:
-            ts = r["timestamp"]
-            if hasattr(ts, "isoformat"):
-                ts = ts.isoformat()
-            w.writerow([
-                r["apartment"],
-                r["room"],
-                r["sensor_type"],
-                r["field"],
-                r["value"] if r["value"] is not None else "",
-                r["unit"]  if r["unit"]  is not None else "",
-                ts,
-                "true" if r["is_outlier"] else "false",
-            ])
-        buf.seek(0)
-        cur.copy_expert(
-            "COPY _tmp_sensor_events "
-            "(apartment, room, sensor_type, field, value, unit, \"timestamp\", is_outlier) "
-            "FROM STDIN WITH (FORMAT CSV, NULL '')",
-            buf,
-        )
-
-        cur.execute(_UPSERT_FROM_TMP)
+        if not rows:
+            mark_done(engine, filenames, cur=cur)
+            sensor_watermark.record_digests(cur, digests)
+            raw.commit()
+            return
+        if staging:
+            if compact:
+                sensor_channels.copy_into(cur, sensor_bulkload.STAGING, rows, channel_id)
+            else:
+                copy_rows(cur, rows, table=sensor_bulkload.STAGING)
+        elif append:
+            cur.execute("SAVEPOINT append_only")
+            try:
+                if compact:
+                    sensor_channels.copy_append(cur, rows, channel_id)
+                else:
+                    copy_rows(cur, rows, table="silver.sensor_events")
+            except _pg_errors.UniqueViolation:
+                # Silver already had some of these keys: merge instead.
+                cur.execute("ROLLBACK TO SAVEPOINT append_only")
+                append = False
+        if not staging and not append:
+            if compact:
+                sensor_channels.copy_and_merge(cur, rows, channel_id)
+            else:
+                cur.execute(_TEMP_DDL)
+                copy_rows(cur, rows)
+                cur.execute(_UPSERT_FROM_TMP)
+        mark_done(engine, filenames, cur=cur)
+        sensor_watermark.record_digests(cur, digests)
         raw.commit()
     finally:
         raw.close()
+    if isinstance(rows, SensorBatch) and not staging:
+        _advance_silver_max(rows)
 
 
 # -- FIND NEW FILES (FAST) -----------------------------------------------------
 
-def count_bronze_files(apt):
-    """Count JSON files in a Bronze apartment folder."""
+def count_bronze_files(apt, catalog=None):
+    """Count JSON files in a Bronze apartment folder (catalog lookup when
+    available, rglob otherwise)."""
+    if catalog is not None:
+        return bronze_catalog.count(catalog, apt)
     apt_root = BRONZE_ROOT / apt
     if not apt_root.exists():
         return 0
     # Match both raw (.json) and compressed (.json.gz) files so the count
-    # reflects the real bronze footprint after compress-after-silver.
-    return sum(1 for _ in apt_root.rglob("*.json*"))
+    # reflects the real bronze footprint after compress-after-silver, plus
+    # the members of packed segments.
+    return (sum(1 for _ in apt_root.rglob("*.json*"))
+            + sum(len(bronze_segments.read_index(seg)) for seg in apt_root.rglob("*" + bronze_segments.SEGMENT_SUFFIX)))
+
+
+def find_new_files_catalog(catalog, watermark_set):
+    """Catalog-backed discovery: an indexed query for bronze files not yet
+    flagged as silvered, filtered against the watermark. Files the catalog
+    doesn't know are silvered but the watermark does (first run after the
+    bootstrap) get flagged so the next query skips them."""
+    if bronze_catalog.silvered_count(catalog) > len(watermark_set):
+        # Watermark shrank (silver rebuild) -- unflag what silver lost.
+        reset = bronze_catalog.resync_silvered(catalog, watermark_set)
+        log.info(f"Bronze catalog: {reset:,} files re-queued (no longer in watermark)")
+
+    all_tasks = []
+    for apt in APARTMENTS:
+        apt_new = 0
+        already = []
+        for path, name in bronze_catalog.pending(catalog, apt):
+            if name in watermark_set:
+                already.append(name)
+            else:
+                all_tasks.append((str(path), apt))
+                apt_new += 1
+        bronze_catalog.mark_silvered(already, catalog)
+
+        apt_total = count_bronze_files(apt, catalog)
+        if apt_new > 0:
+            log.info(f"[{apt}] {apt_new:,} new files to process  "
+                     f"({apt_total:,} total in bronze, catalog)")
+        else:
+            log.info(f"[{apt}] up to date  ({apt_total:,} total in bronze, catalog)")
+
+    return all_tasks
 
 
 def find_new_files_fast(engine, watermark_set):
@@ -395,6 +745,11 @@ def find_new_files_fast(engine, watermark_set):
 
     A full scan over ~200k files takes 1-3 seconds — cheap insurance against
     silent data loss.
+
+    With the range watermark, an hour folder whose 60 minutes are all
+    covered is skipped without listing it. That is exact per-minute
+    coverage, not the old "N consecutive hits" heuristic, so it is safe
+    under out-of-order batch completion.
     """
     all_tasks = []
 
@@ -406,32 +761,172 @@ def find_new_files_fast(engine, watermark_set):
 
         apt_new = 0
         apt_total = 0
+        skipped_hours = 0
         # Walk ALL year/month/day/hour folders, no early stop. Match both
         # raw (.json) and compressed (.json.gz) — so a silver rebuild after
         # compress-after-silver can still replay from compressed bronze.
-        for f in apt_root.rglob("*.json*"):
-            apt_total += 1
-            # Compare on the canonical (.json) form so a .json.gz we already
-            # processed (entry stored as .json) is recognised and skipped.
-            if canonical_bronze_name(f.name) not in watermark_set:
-                all_tasks.append((str(f), apt))
-                apt_new += 1
-
+        # HH.seg segments are expanded to member addresses via their index.
+        for folder in apt_root.glob("*/*/*/*"):
+            is_segment = folder.suffix == bronze_segments.SEGMENT_SUFFIX
+            if not is_segment and not folder.is_dir():
+                continue  # HH.idx / lock files next to a segment
+            hour_start = _hour_folder_minute(folder)
+            if hour_start is not None and watermark_set.covers(apt, hour_start, hour_start + 59):
+                skipped_hours += 1
+                continue
+            if is_segment:
+                files = [bronze_segments.member_path(folder, n) for n in bronze_segments.members(folder)]
+            else:
+                files = folder.glob("*.json*")
+            for f in files:
+                apt_total += 1
+                # Compare on the canonical (.json) form so a .json.gz we already
+                # processed (entry stored as .json) is recognised and skipped.
+                if canonical_bronze_name(f.name) not in watermark_set:
+                    all_tasks.append((str(f), apt))
+                    apt_new += 1
+
+        skipped = f", {skipped_hours:,} fully-watermarked hours skipped" if skipped_hours else ""
         if apt_new > 0:
             log.info(f"[{apt}] {apt_new:,} new files to process  "
-                     f"({apt_total:,} total in bronze)")
+                     f"({apt_total:,} scanned in bronze{skipped})")
         else:
-            log.info(f"[{apt}] up to date  ({apt_total:,} total in bronze)")
+            log.info(f"[{apt}] up to date  ({apt_total:,} scanned in bronze{skipped})")
 
     return all_tasks
 
 
+def _hour_folder_minute(folder: Path):
+    """bronze/<apt>/YYYY/MM/DD/HH[.seg] -> epoch minute of HH:00 UTC, or None."""
+    try:
+        y, m, d, h = (int(p) for p in (*folder.parts[-4:-1], folder.stem))
+        dt = datetime(y, m, d, h, tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return sensor_watermark.dt_to_minute(dt)
+
+
 # -- MAIN ----------------------------------------------------------------------
 
-def run():
+# run() is three stages joined by bounded queues, so parsing, the DB merge
+# and bronze compression overlap instead of taking turns:
+#
+#   parse pool (WORKERS processes) --[PIPELINE_DEPTH]--> DB writer threads
+#       (DB_WRITERS) --[POST_WORKERS x 2]--> bronze post-processor threads
+#
+# Every hand-off blocks when the next stage is behind, so at most
+# WORKERS + PIPELINE_DEPTH parsed batches exist at once. Compression runs in
+# threads: zlib / zstd release the GIL, and the files are local disk I/O.
+PIPELINE_DEPTH = int(os.getenv("FLATTEN_PIPELINE_DEPTH", "4"))
+DB_WRITERS     = int(os.getenv("FLATTEN_DB_WRITERS", "2"))
+POST_WORKERS   = int(os.getenv("FLATTEN_POST_WORKERS", "4"))
+
+_END = object()
+
+
+def _iter_results(engine, batches, stop=None, staging=False):
+    """Yield process_batch() (or, with SILVER_WRITER=workers,
+    process_and_write()) results, keeping at most WORKERS + PIPELINE_DEPTH
+    batches submitted so finished results can't pile up unbounded. A single
+    batch (the steady-state minute: a couple of files) is handled inline --
+    spinning up a process pool costs more than the work itself. Each batch
+    travels with its files' known digests (one indexed lookup, here)."""
+    if len(batches) == 1:
+        # parent writes it
+        yield process_batch((batches[0], DB_URL, staging, known_digests(engine, batches[0])))
+        return
+    fn = process_and_write if SILVER_WRITER == "workers" else process_batch
+    todo = iter(batches)
+    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
+        pending = set()
+        while True:
+            while len(pending) < WORKERS + PIPELINE_DEPTH and not (stop and stop.is_set()):
+                batch = next(todo, None)
+                if batch is None:
+                    break
+                pending.add(executor.submit(fn, (batch, DB_URL, staging, known_digests(engine, batch))))
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def _run_pipeline(engine, batches, watermark, on_done, staging=False):
+    """Drive the three stages; on_done(result) is called (serialised) once a
+    batch is in silver (or staging) and its bronze post-processed. Re-raises
+    the first parse or write error after the stages have drained."""
+    parsed = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+    lock = threading.Lock()
+    errors = []
+    post_slots = threading.BoundedSemaphore(POST_WORKERS * 2)
+    post_pool = ThreadPoolExecutor(max_workers=POST_WORKERS)
+
+    def finish(result):
+        with lock:
+            on_done(result)
+
+    def post(result):
+        try:
+            result["compressed"], result["deleted"] = post_process_bronze(
+                result.pop("processed_paths"), result["processed"])
+            finish(result)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            post_slots.release()
+
+    def writer():
+        while (result := parsed.get()) is not _END:
+            if stop.is_set():
+                continue  # drain so the parse stage never blocks on put()
+            try:
+                if not result.get("written"):
+                    upsert(engine, result["rows"], result["processed"], staging=staging,
+                           digests=result.pop("digests"))
+                    result["n_rows"] = len(result.pop("rows"))
+                with lock:
+                    watermark.update(result["processed"])
+                bronze_catalog.mark_silvered(result["processed"])
+                coverage.mark("silver", result["processed"])
+                if result.get("written"):
+                    finish(result)  # worker already post-processed its bronze
+                    continue
+                post_slots.acquire()
+                post_pool.submit(post, result)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+
+    writers = [threading.Thread(target=writer, name=f"silver-writer-{i}", daemon=True)
+               for i in range(max(1, DB_WRITERS))]
+    for t in writers:
+        t.start()
+    try:
+        for result in _iter_results(engine, batches, stop, staging):
+            parsed.put(result)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for _ in writers:
+            parsed.put(_END)
+        for t in writers:
+            t.join()
+        post_pool.shutdown(wait=True)
+    if errors:
+        raise errors[0]
+
+
+def run(rescan=None):
+    """rescan=True (or --rescan) rebuilds the bronze catalog from disk before
+    discovery; the watcher's nightly gap-repair run passes it."""
+    rescan = ("--rescan" in sys.argv) if rescan is None else rescan
     if not DB_URL:
         raise EnvironmentError("DB_URL not set in .env")
-    engine = create_engine(DB_URL, pool_size=WORKERS, max_overflow=4)
+    engine = get_engine()
 
     print(f"\n{B}flatten_sensors -- Bronze to Silver{R}")
     print(f"{D}Bronze  : {BRONZE_ROOT.resolve()}{R}")
@@ -441,62 +936,82 @@ def run():
     # Load watermark and scan newest Bronze folders for new files
     t0 = time.monotonic()
     log.info("Loading watermark...")
-    watermark = load_watermark(engine)
+    watermark = load_watermark_warm(engine)
     log.info(f"Watermark: {len(watermark):,} files already processed")
 
-    log.info("Scanning for new files (newest first)...")
-    all_tasks = find_new_files_fast(engine, watermark)
+    catalog = bronze_catalog.open_catalog(log)
+    if catalog is not None and rescan:
+        log.info("Rescan: rebuilding bronze catalog from disk...")
+        bronze_catalog.rebuild_from_disk(catalog, log)
+
+    if catalog is not None:
+        log.info("Querying bronze catalog for new files...")
+        all_tasks = find_new_files_catalog(catalog, watermark)
+        catalog.close()
+    else:
+        log.info("Scanning for new files (newest first)...")
+        all_tasks = find_new_files_fast(engine, watermark)
 
     check_time = time.monotonic() - t0
     log.info(f"Found {len(all_tasks):,} files to process in {check_time:.1f}s")
 
+    # Backlog planner (sensor_bulkload.py): a big backlog -- or an
+    # interrupted bulk load -- goes through unindexed staging + a set-wise
+    # merge instead of the per-batch ON CONFLICT path.
+    phase = sensor_bulkload.active_phase(engine)
+    if phase == "merging":
+        log.info("Bulk load: finishing an interrupted merge")
+        sensor_bulkload.merge(engine, log)
+        phase = None
+    staging = phase == "loading" or "--bulk" in sys.argv or sensor_bulkload.should_bulk_load(len(all_tasks))
+
     if not all_tasks:
+        if staging:
+            sensor_bulkload.merge(engine, log)
         print(f"\n{GR}Nothing to do.{R}\n")
         return
+    if staging:
+        sensor_bulkload.start(engine, len(all_tasks), log)
 
     batches = [all_tasks[i:i+BATCH_SIZE] for i in range(0, len(all_tasks), BATCH_SIZE)]
-    log.info(f"Batches: {len(batches)} x {BATCH_SIZE} files  ({WORKERS} parallel workers)")
+    log.info(f"Batches: {len(batches)} x {BATCH_SIZE} files  ({WORKERS} parallel workers, "
+             f"silver written by {SILVER_WRITER if len(batches) > 1 else 'parent'})")
     log.info(f"Starting... first progress line will appear after the first batch finishes (~10-30s).")
 
-    total_files = total_rows = total_errors = 0
-    total_compressed = total_deleted = 0
+    totals = {"batches": 0, "files": 0, "rows": 0, "unchanged": 0, "errors": 0, "compressed": 0, "deleted": 0}
     t_start = time.monotonic()
 
-    with ProcessPoolExecutor(max_workers=WORKERS) as executor:
-        futures = {executor.submit(process_batch, (batch, DB_URL)): i for i, batch in enumerate(batches)}
-        for n, future in enumerate(as_completed(futures), 1):
-            result = future.result()
-            upsert(engine, result["rows"])
-            mark_done(engine, result["processed"])
-            total_files  += len(result["processed"])
-            total_rows   += len(result["rows"])
-            total_errors += result["errors"]
-            # Bronze post-processing: by default, COMPRESS in place to keep
-            # the audit trail while shrinking disk ~10-15x. Hard-delete only
-            # if DELETE_BRONZE=1 is explicitly set.
-            if COMPRESS_BRONZE_ON_SILVER:
-                done, failed = compress_bronze_files(
-                    result["processed_paths"], result["processed"]
-                )
-                total_compressed += done
-            elif DELETE_BRONZE_ON_SILVER:
-                done, failed = delete_bronze_files(
-                    result["processed_paths"], result["processed"]
-                )
-                total_deleted += done
-
-            if n % LOG_EVERY == 0 or n == len(batches):
-                elapsed   = time.monotonic() - t_start
-                rate      = total_files / elapsed if elapsed > 0 else 1
-                remaining = (len(all_tasks) - total_files) / rate
-                pct       = total_files / len(all_tasks) * 100
-                # Render a simple text progress bar so users see motion
-                bar_w = 24
-                filled = int(bar_w * pct / 100)
-                bar = "█" * filled + "░" * (bar_w - filled)
-                print(f"  [{bar}] batch {n:>3}/{len(batches)}  "
-                      f"{total_files:>7,} files  {total_rows:>10,} rows  "
-                      f"{pct:5.1f}%  {D}~{remaining/60:.1f}min left{R}")
+    def on_done(result):
+        totals["batches"] += 1
+        totals["files"]   += len(result["processed"])
+        totals["rows"]    += result["n_rows"]
+        totals["unchanged"] += result["unchanged"]
+        totals["errors"]  += result["errors"]
+        # Bronze post-processing: by default COMPRESSED in place to keep the
+        # audit trail while shrinking disk ~10-15x; hard-deleted only if
+        # DELETE_BRONZE=1 is explicitly set.
+        totals["compressed"] += result["compressed"]
+        totals["deleted"]    += result["deleted"]
+
+        n = totals["batches"]
+        if n % LOG_EVERY == 0 or n == len(batches):
+            elapsed   = time.monotonic() - t_start
+            rate      = totals["files"] / elapsed if elapsed > 0 else 1
+            remaining = (len(all_tasks) - totals["files"]) / rate
+            pct       = totals["files"] / len(all_tasks) * 100
+            # Render a simple text progress bar so users see motion
+            bar_w = 24
+            filled = int(bar_w * pct / 100)
+            bar = "█" * filled + "░" * (bar_w - filled)
+            print(f"  [{bar}] batch {n:>3}/{len(batches)}  "
+                  f"{totals['files']:>7,} files  {totals['rows']:>10,} rows  "
+                  f"{pct:5.1f}%  {D}~{remaining/60:.1f}min left{R}")
+
+    _run_pipeline(engine, batches, watermark, on_done, staging=staging)
+    if staging:
+        sensor_bulkload.merge(engine, log)
+        _SILVER_MAX_TS.clear()
+    total_files, total_rows, total_errors = totals["files"], totals["rows"], totals["errors"]
 
     elapsed = time.monotonic() - t_start
     total_time = time.monotonic() - t0
@@ -504,6 +1019,8 @@ def run():
     print(f"\n{B}{'_'*48}{R}")
     print(f"{GR}{B}  Done in {total_time:.0f}s (check {check_time:.1f}s + process {elapsed:.1f}s){R}")
     print(f"  {GR}v{R} {total_files:,} files  {total_rows:,} rows")
+    if totals["unchanged"]:
+        print(f"  {D}{totals['unchanged']:,} files unchanged since last ingest (digest match, not re-parsed){R}")
     if total_errors:
         print(f"  {RE}x {total_errors} errors{R}")
     print()
@@ -0,0 +1,355 @@
+"""
+sensor_batch.py -- Columnar row batches for silver.sensor_events
+=================================================================
+A batch of 5 000 sensor files is ~300 000 readings. Holding each one as an
+8-key dict (the old make_row()) costs ~1 KB of Python objects per reading,
+re-runs norm_room() / is_outlier() per value and has to be walked again to
+write the COPY stream. SensorBatch keeps the same data as parallel columns:
+
+    apartment, room, sensor_type, field, unit   int16 codes into per-batch
+                                                string dictionaries
+    value                                        float64 (NaN = NULL)
+    ts                                           int64 epoch seconds
+
+Appends go into compact array.array buffers (no per-reading object kept);
+finish() turns them into NumPy arrays, after which outlier flags are one
+vectorised comparison per BOUNDS field and room names are normalised once
+per distinct room instead of once per reading. The whole batch pickles as a
+handful of buffers, so ProcessPool workers ship back kilobytes, not a list
+of dicts.
+
+Two COPY serialisers: to_csv() (text, the default) and iter_binary() /
+binary_stream() (PGCOPY binary, SENSOR_COPY_FORMAT=binary), which sends
+float8 and timestamptz as raw 8-byte values and is produced chunk by chunk.
+The compact layout (sensor_channels.py) uses channel_keys() and
+to_readings_csv() instead.
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import io
+import struct
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+
+_CODED  = ("apartment", "room", "sensor_type", "field", "unit")
+CSV_CHUNK = 20_000
+
+# PGCOPY binary layout (FORMAT BINARY). Columns are sent text-first so the
+# fixed-width tail (float8, timestamptz, bool) can be encoded for a whole
+# chunk with one NumPy structured array:
+BINARY_COLUMNS = ("apartment", "room", "sensor_type", "field", "unit", "value", "timestamp", "is_outlier")
+PGCOPY_HEADER  = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+_FIELD_COUNT   = struct.pack("!h", len(BINARY_COLUMNS))
+_NULL          = struct.pack("!i", -1)
+_PG_EPOCH      = 946_684_800  # 2000-01-01 UTC in Unix seconds
+_TAIL = np.dtype([("vlen", ">i4"), ("value", ">f8"), ("tlen", ">i4"), ("ts", ">i8"),
+                  ("blen", ">i4"), ("flag", "u1")])
+
+
+def _csv_field(s: str) -> str:
+    """CSV-quote a dictionary entry once (COPY ... FORMAT CSV, NULL '')."""
+    if s is None:
+        return ""
+    if s == "" or any(c in s for c in ',"\n\r'):
+        return '"' + s.replace('"', '""') + '"'
+    return s
+
+
+class SensorBatch:
+    """Columnar sensor readings. Build with append(), then finish() before
+    reading columns or serialising."""
+
+    def __init__(self):
+        self._dicts = {c: {} for c in _CODED}     # value -> code
+        self._codes = {c: array("h") for c in _CODED}
+        self._value = array("d")
+        self._ts    = array("q")
+        self.finished = False
+
+    def _code(self, column, s):
+        d = self._dicts[column]
+        code = d.get(s)
+        if code is None:
+            code = d[s] = len(d)
+        return code
+
+    def append(self, apartment, room, sensor_type, field, value, unit, ts_epoch):
+        # Convert first: a bad value must not leave the columns ragged.
+        value = float("nan") if value is None else float(value)
+        codes = self._codes
+        codes["apartment"].append(self._code("apartment", apartment))
+        codes["room"].append(self._code("room", room))
+        codes["sensor_type"].append(self._code("sensor_type", sensor_type))
+        codes["field"].append(self._code("field", field))
+        codes["unit"].append(self._code("unit", unit))
+        self._value.append(value)
+        self._ts.append(ts_epoch)
+
+    def mark(self) -> int:
+        """Current row count, for truncate()."""
+        return len(self._ts)
+
+    def truncate(self, n: int):
+        """Drop every row appended after mark() returned `n` -- used to undo
+        a file that failed halfway through."""
+        for col in self._codes.values():
+            del col[n:]
+        del self._value[n:]
+        del self._ts[n:]
+
+    def __len__(self):
+        return len(self.ts) if self.finished else len(self._ts)
+
+    # -- finish / columns ------------------------------------------------------
+
+    def finish(self, room_map=None, bounds=None):
+        """Freeze into NumPy columns, normalise room names through
+        `room_map` (once per distinct room) and flag outliers against
+        `bounds` {field: (lo, hi)}. Returns self."""
+        if self.finished:
+            return self
+        self.codes = {c: np.frombuffer(self._codes[c], dtype=np.int16) for c in _CODED}
+        self.value = np.frombuffer(self._value, dtype=np.float64)
+        self.ts    = np.frombuffer(self._ts, dtype=np.int64)
+        self._strings = {c: list(self._dicts[c]) for c in _CODED}
+        if room_map:
+            self._strings["room"] = [room_map.get(r, r) for r in self._strings["room"]]
+        self.is_outlier = np.zeros(len(self.value), dtype=bool)
+        if bounds:
+            fields = self._dicts["field"]
+            with np.errstate(invalid="ignore"):
+                for field, (lo, hi) in bounds.items():
+                    code = fields.get(field)
+                    if code is None:
+                        continue
+                    # NaN compares False both ways: a NULL value is never an outlier.
+                    self.is_outlier |= (self.codes["field"] == code) & ((self.value < lo) | (self.value > hi))
+        self._dicts = self._codes = self._value = self._ts = None
+        self.finished = True
+        return self
+
+    def strings(self, column) -> list:
+        """Dictionary of a coded column: code -> string."""
+        return self._strings[column]
+
+    def apartment_spans(self) -> dict:
+        """{apartment: (first ts, last ts)} in epoch seconds."""
+        spans = {}
+        codes = self.codes["apartment"]
+        for code, apartment in enumerate(self._strings["apartment"]):
+            ts = self.ts[codes == code]
+            if len(ts):
+                lo, hi = int(ts.min()), int(ts.max())
+                if apartment in spans:  # two codes can share a string
+                    lo, hi = min(lo, spans[apartment][0]), max(hi, spans[apartment][1])
+                spans[apartment] = (lo, hi)
+        return spans
+
+    def take(self, rows):
+        """New finished batch holding only `rows` (an index array)."""
+        out = SensorBatch.__new__(SensorBatch)
+        out.codes = {c: a[rows] for c, a in self.codes.items()}
+        out.value, out.ts, out.is_outlier = self.value[rows], self.ts[rows], self.is_outlier[rows]
+        out._strings = self._strings
+        out._dicts = out._codes = out._value = out._ts = None
+        out.finished = True
+        return out
+
+    def dedupe(self):
+        """Drop repeated (apartment, room, sensor_type, field, timestamp)
+        keys, keeping the last occurrence -- what DISTINCT ON + DO UPDATE
+        would leave, done here so the batch can be appended without either.
+        Returns self when there is nothing to drop."""
+        n = len(self)
+        if n < 2:
+            return self
+        keys, inverse = self.channel_keys()
+        # Channels are per code tuple; normalised rooms can map two of them
+        # to the same strings, so key on the strings.
+        canon = {}
+        channel = np.array([canon.setdefault(k[:4], len(canon)) for k in keys], dtype=np.int64)[inverse]
+        packed = (channel << 40) | (self.ts - self.ts.min())
+        _, last = np.unique(packed[::-1], return_index=True)
+        if len(last) == n:
+            return self
+        return self.take(np.sort(n - 1 - last))
+
+    # -- serialisation ---------------------------------------------------------
+
+    def to_csv(self) -> io.StringIO:
+        """CSV stream for COPY ... (COLUMNS) FROM STDIN WITH (FORMAT CSV,
+        NULL ''). Dictionary entries and timestamps are formatted once per
+        distinct value; the per-row work is one f-string."""
+        enc = {c: [_csv_field(s) for s in self._strings[c]] for c in _CODED}
+        ts_text = {int(t): datetime.fromtimestamp(int(t), tz=timezone.utc).isoformat() for t in np.unique(self.ts)}
+        buf = io.StringIO()
+        # In slices, so the temporary per-column string lists stay small.
+        for lo in range(0, len(self), CSV_CHUNK):
+            hi = lo + CSV_CHUNK
+            values = ["" if v != v else repr(v) for v in self.value[lo:hi].tolist()]
+            flags = np.where(self.is_outlier[lo:hi], "true", "false").tolist()
+            apt, room, stype, field, unit = (
+                [enc[c][k] for k in self.codes[c][lo:hi].tolist()] for c in _CODED
+            )
+            ts = [ts_text[t] for t in self.ts[lo:hi].tolist()]
+            buf.writelines(
+                f"{a},{r},{s},{f},{v},{u},{t},{o}\n"
+                for a, r, s, f, v, u, t, o in zip(apt, room, stype, field, values, unit, ts, flags)
+            )
+        buf.seek(0)
+        return buf
+
+    def iter_binary(self, chunk_rows=CSV_CHUNK):
+        """Yield the PGCOPY binary stream for COPY ... (BINARY_COLUMNS) FROM
+        STDIN WITH (FORMAT BINARY) chunk by chunk. Floats and timestamps go
+        over as float8 / int64 microseconds -- nothing for the server to
+        parse. Each distinct (apartment, room, sensor_type, field, unit)
+        channel prefix is encoded once; rows are assembled per chunk by
+        _binary_chunk() without a Python-level loop over rows."""
+        yield PGCOPY_HEADER
+        n = len(self)
+        if n:
+            channels, inverse = self._channels()
+            heads = []
+            for codes in channels:
+                parts = [_FIELD_COUNT]
+                for c, k in zip(_CODED, codes):
+                    s = self._strings[c][k]
+                    if s is None:
+                        parts.append(_NULL)
+                    else:
+                        b = s.encode("utf-8")
+                        parts.append(struct.pack("!i", len(b)) + b)
+                heads.append(b"".join(parts))
+
+            head_bytes = [np.frombuffer(h, dtype=np.uint8) for h in heads]
+            head_len = np.array([len(h) for h in heads], dtype=np.int64)
+            width = _TAIL.itemsize
+            for lo in range(0, n, chunk_rows):
+                hi = min(lo + chunk_rows, n)
+                yield self._binary_chunk(lo, hi, inverse[lo:hi], head_bytes, head_len, width)
+        yield PGCOPY_TRAILER
+
+    def _channels(self):
+        """(distinct code tuples, per-row channel index). The five int16
+        codes are packed into one int64 when they fit -- np.unique on an
+        int64 column is far cheaper than on rows of a 2-D array."""
+        bits = [max(1, (len(self._strings[c]) - 1).bit_length()) for c in _CODED]
+        if sum(bits) > 63:
+            keys = np.stack([self.codes[c] for c in _CODED], axis=1)
+            channels, inverse = np.unique(keys, axis=0, return_inverse=True)
+            return channels.tolist(), inverse.reshape(-1)
+        packed = np.zeros(len(self), dtype=np.int64)
+        for c, b in zip(_CODED, bits):
+            packed = (packed << b) | self.codes[c].astype(np.int64)
+        uniq, inverse = np.unique(packed, return_inverse=True)
+        channels = []
+        for key in uniq.tolist():
+            codes = []
+            for b in reversed(bits):
+                codes.append(key & ((1 << b) - 1))
+                key >>= b
+            channels.append(codes[::-1])
+        return channels, inverse.reshape(-1)
+
+    def _binary_chunk(self, lo, hi, channel, head_bytes, head_len, width):
+        """Rows lo:hi as PGCOPY tuples, assembled with NumPy scatters: one
+        per distinct channel prefix and one for the fixed-width tails."""
+        value = self.value[lo:hi]
+        tail = np.empty(hi - lo, dtype=_TAIL)
+        tail["vlen"] = 8
+        tail["value"] = value
+        tail["tlen"] = 8
+        tail["ts"] = (self.ts[lo:hi] - _PG_EPOCH) * 1_000_000
+        tail["blen"] = 1
+        tail["flag"] = self.is_outlier[lo:hi]
+        tail = tail.view(np.uint8).reshape(-1, width)
+        nulls = np.isnan(value)
+        if nulls.any():
+            # NULL value: length -1 and no 8-byte payload (4 bytes shorter).
+            null_tail = np.concatenate(
+                [np.broadcast_to(np.frombuffer(_NULL, dtype=np.uint8), (int(nulls.sum()), 4)),
+                 tail[nulls, 12:]], axis=1)
+
+        row_head = head_len[channel]
+        row_len = row_head + np.where(nulls, width - 8, width)
+        starts = np.zeros(len(row_len), dtype=np.int64)
+        np.cumsum(row_len[:-1], out=starts[1:])
+        out = np.empty(int(row_len.sum()), dtype=np.uint8)
+
+        order = np.argsort(channel, kind="stable")
+        bounds = np.searchsorted(channel[order], np.arange(len(head_bytes) + 1))
+        for c, head in enumerate(head_bytes):
+            rows = order[bounds[c]:bounds[c + 1]]
+            if len(rows):
+                out[starts[rows, None] + np.arange(len(head))] = head
+        tail_start = starts + row_head
+        full = ~nulls
+        out[tail_start[full, None] + np.arange(width)] = tail[full]
+        if nulls.any():
+            out[tail_start[nulls, None] + np.arange(width - 8)] = null_tail
+        return out.tobytes()
+
+    def channel_keys(self):
+        """(distinct (apartment, room, sensor_type, field, unit) string
+        tuples, per-row index into them) -- what the compact layout maps to
+        silver.sensor_channel ids."""
+        channels, inverse = self._channels()
+        keys = [tuple(self._strings[c][k] for c, k in zip(_CODED, codes)) for codes in channels]
+        return keys, inverse
+
+    def to_readings_csv(self, channel_id) -> io.StringIO:
+        """CSV stream for COPY ... (channel_id, "timestamp", value,
+        is_outlier) FROM STDIN WITH (FORMAT CSV, NULL ''); `channel_id` is
+        the per-row id array. Four short columns instead of eight."""
+        ts_text = {int(t): datetime.fromtimestamp(int(t), tz=timezone.utc).isoformat() for t in np.unique(self.ts)}
+        buf = io.StringIO()
+        for lo in range(0, len(self), CSV_CHUNK):
+            hi = lo + CSV_CHUNK
+            values = ["" if v != v else repr(v) for v in self.value[lo:hi].tolist()]
+            flags = np.where(self.is_outlier[lo:hi], "true", "false").tolist()
+            ts = [ts_text[t] for t in self.ts[lo:hi].tolist()]
+            buf.writelines(
+                f"{c},{t},{v},{o}\n"
+                for c, t, v, o in zip(channel_id[lo:hi].tolist(), ts, values, flags)
+            )
+        buf.seek(0)
+        return buf
+
+    def binary_stream(self):
+        """File-like object over iter_binary() for cursor.copy_expert():
+        chunks are produced as psycopg2 reads, so the whole COPY payload is
+        never held in memory at once."""
+        return _ChunkReader(self.iter_binary())
+
+
+class _ChunkReader(io.RawIOBase):
+    """Minimal read()-able wrapper around an iterator of bytes chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._cur = b""
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        out = []
+        want = size if size is not None and size >= 0 else None
+        while want is None or want > 0:
+            if self._pos >= len(self._cur):
+                self._cur, self._pos = next(self._chunks, b""), 0
+                if not self._cur:
+                    break
+            end = len(self._cur) if want is None else self._pos + want
+            take = self._cur[self._pos:end]
+            self._pos += len(take)
+            if want is not None:
+                want -= len(take)
+            out.append(take)
+        return b"".join(out)
@@ -0,0 +1,242 @@
+"""
+sensor_bulkload.py -- Backlog bulk-load strategy for flatten_sensors
+=====================================================================
+Pushing a large backlog (first install, a weekend outage) through the
+per-batch COPY + ON CONFLICT path probes the unique index once per row in
+random order -- the "unique-index slowdown wall". fast_silver_backfill.py
+avoids it but has to be run by hand. When flatten_sensors finds more than
+BULK_MIN_ROWS (estimated) pending, it switches to this strategy instead:
+
+    loading   every batch is COPYed into silver.sensor_events_staging -- a
+              plain table with no index or constraint -- in the same
+              transaction as its watermark, exactly like a normal upsert
+    merging   month by month, the staged rows are deduplicated set-wise
+              (one DISTINCT ON sort, the last staged row per key wins)
+              and either
+                - attached: when the month's partition is still empty, the
+                  sorted rows become a new table that is indexed once and
+                  swapped in with ATTACH PARTITION, or
+                - merged: INSERT ... SELECT DISTINCT ON ... ON CONFLICT in
+                  key order, which walks the unique index sequentially
+              and the month is deleted from staging in the same transaction
+    done      staging dropped
+
+The phase lives in silver.sensor_bulkload. Every step is its own
+transaction, so an interrupted run resumes where it stopped: rows staged
+before a crash are watermarked and wait in staging, a half-merged month is
+rolled back as a whole and merged again. The next flatten_sensors run sees
+the open phase and continues -- loading any new files into staging too --
+before returning to the normal path.
+
+Rows in staging are not visible in silver.sensor_events until their month
+is merged.
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import os
+import time
+
+from sqlalchemy import text
+
+from etl.bronze_to_silver import sensor_channels, sensor_partitions
+
+STAGING        = "silver.sensor_events_staging"
+ROWS_PER_FILE  = 62    # readings in one sensor JSON (both apartments, measured)
+BULK_MIN_ROWS  = int(os.getenv("FLATTEN_BULK_MIN_ROWS", "600000"))  # 0 = never
+
+STATE_DDL = """
+    CREATE TABLE IF NOT EXISTS silver.sensor_bulkload (
+        run_id        SERIAL       PRIMARY KEY,
+        phase         VARCHAR(10)  NOT NULL,     -- loading | merging | done
+        planned_files INTEGER,
+        started_at    TIMESTAMPTZ  NOT NULL DEFAULT NOW(),
+        updated_at    TIMESTAMPTZ  NOT NULL DEFAULT NOW()
+    )
+"""
+
+# Per layout: staging columns, target table, conflict key, updated columns.
+_WIDE = {
+    "ddl": f"""
+        CREATE TABLE IF NOT EXISTS {STAGING} (
+            apartment   text,
+            room        text,
+            sensor_type text,
+            field       text,
+            value       double precision,
+            unit        text,
+            "timestamp" timestamptz,
+            is_outlier  boolean,
+            seq         bigserial
+        )
+    """,
+    "target": "sensor_events",
+    "columns": ("apartment", "room", "sensor_type", "field", "value", "unit", "timestamp", "is_outlier"),
+    "key": ("apartment", "room", "sensor_type", "field", "timestamp"),
+    "update": ("value", "unit", "is_outlier"),
+}
+_COMPACT = {
+    "ddl": f"""
+        CREATE TABLE IF NOT EXISTS {STAGING} (
+            channel_id  smallint,
+            "timestamp" timestamptz,
+            value       double precision,
+            is_outlier  boolean,
+            seq         bigserial
+        )
+    """,
+    "target": "sensor_readings",
+    "columns": ("channel_id", "timestamp", "value", "is_outlier"),
+    "key": ("channel_id", "timestamp"),
+    "update": ("value", "is_outlier"),
+}
+
+
+def _layout(engine) -> dict:
+    return _COMPACT if sensor_channels.is_compact(engine) else _WIDE
+
+
+# -- PHASES --------------------------------------------------------------------
+
+def active_phase(engine):
+    """'loading' or 'merging' if a bulk load is unfinished, else None."""
+    with engine.begin() as conn:
+        conn.execute(text(STATE_DDL))
+        return conn.execute(text(
+            "SELECT phase FROM silver.sensor_bulkload WHERE phase <> 'done' ORDER BY run_id DESC LIMIT 1"
+        )).scalar()
+
+
+def _set_phase(conn, phase: str):
+    conn.execute(text(
+        "UPDATE silver.sensor_bulkload SET phase = :p, updated_at = NOW() WHERE phase <> 'done'"
+    ), {"p": phase})
+
+
+def should_bulk_load(pending_files: int) -> bool:
+    return BULK_MIN_ROWS > 0 and pending_files * ROWS_PER_FILE >= BULK_MIN_ROWS
+
+
+def start(engine, pending_files: int, log):
+    """Create staging and open (or resume) the 'loading' phase."""
+    layout = _layout(engine)
+    with engine.begin() as conn:
+        conn.execute(text(STATE_DDL))
+        conn.execute(text(layout["ddl"]))
+        if conn.execute(text("SELECT 1 FROM silver.sensor_bulkload WHERE phase = 'loading'")).scalar():
+            staged = conn.execute(text(f"SELECT COUNT(*) FROM {STAGING}")).scalar()
+            log.info(f"Bulk load: resuming ({staged:,} rows already staged, {pending_files:,} files to add)")
+            return
+        conn.execute(text(
+            "INSERT INTO silver.sensor_bulkload (phase, planned_files) VALUES ('loading', :n)"
+        ), {"n": pending_files})
+    log.info(f"Bulk load: {pending_files:,} files (~{pending_files * ROWS_PER_FILE:,} rows) "
+             f"-> {STAGING}, merged per month afterwards")
+
+
+# -- MERGE ---------------------------------------------------------------------
+
+def _month_bounds(month):
+    return {"a": f"{month.isoformat()} 00:00:00+00",
+            "b": f"{sensor_partitions.next_month(month).isoformat()} 00:00:00+00"}
+
+
+def _dedupe_select(layout) -> str:
+    """One row per key for the month; like the upsert path, the row staged
+    last wins (seq follows COPY order)."""
+    cols = ", ".join(f'"{c}"' for c in layout["columns"])
+    key = ", ".join(f'"{c}"' for c in layout["key"])
+    return (f"SELECT DISTINCT ON ({key}) {cols} FROM {STAGING} "
+            f"WHERE \"timestamp\" >= :a AND \"timestamp\" < :b ORDER BY {key}, seq DESC")
+
+
+class _Occupied(Exception):
+    """The partition received rows while the month was being built."""
+
+
+def _attach_month(engine, layout, month) -> int | None:
+    """Build the month as a standalone sorted table and swap it in for the
+    (empty) partition. Returns rows attached, or None if the partition
+    already holds data and the month has to be merged instead."""
+    target = layout["target"]
+    part = sensor_partitions.partition_name(month, target)
+    bulk = f"{part}_bulk"
+    bounds = _month_bounds(month)
+    a, b = bounds["a"], bounds["b"]
+    cols = ", ".join(f'"{c}"' for c in layout["columns"])
+    try:
+        with engine.begin() as conn:
+            if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM silver.{part})")).scalar():
+                return None
+            conn.execute(text(f"DROP TABLE IF EXISTS silver.{bulk}"))
+            conn.execute(text(f"CREATE TABLE silver.{bulk} (LIKE silver.{target} INCLUDING DEFAULTS)"))
+            n = conn.execute(text(f"INSERT INTO silver.{bulk} ({cols}) {_dedupe_select(layout)}"), bounds).rowcount
+            # A matching CHECK lets ATTACH skip its validation scan.
+            conn.execute(text(f"ALTER TABLE silver.{bulk} ADD CONSTRAINT {bulk}_range "
+                              f"CHECK (\"timestamp\" >= '{a}' AND \"timestamp\" < '{b}')"))
+            conn.execute(text(f"LOCK TABLE silver.{part} IN ACCESS EXCLUSIVE MODE"))
+            if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM silver.{part})")).scalar():
+                raise _Occupied
+            conn.execute(text(f"DROP TABLE silver.{part}"))
+            # Builds the partition's unique + secondary indexes in one pass each.
+            conn.execute(text(f"ALTER TABLE silver.{target} ATTACH PARTITION silver.{bulk} "
+                              f"FOR VALUES FROM ('{a}') TO ('{b}')"))
+            conn.execute(text(f"ALTER TABLE silver.{bulk} RENAME TO {part}"))
+            conn.execute(text(f"ALTER TABLE silver.{part} DROP CONSTRAINT {bulk}_range"))
+            conn.execute(text(f'DELETE FROM {STAGING} WHERE "timestamp" >= :a AND "timestamp" < :b'), bounds)
+    except _Occupied:
+        return None
+    return n
+
+
+def _merge_month(engine, layout, month) -> int:
+    bounds = _month_bounds(month)
+    cols = ", ".join(f'"{c}"' for c in layout["columns"])
+    key = ", ".join(f'"{c}"' for c in layout["key"])
+    target = layout["target"]
+    update = ", ".join(f"{c} = EXCLUDED.{c}" for c in layout["update"])
+    # Unchanged rows are left alone (no dead tuple, no WAL).
+    changed = (f"({', '.join(f'{target}.{c}' for c in layout['update'])}) IS DISTINCT FROM "
+               f"({', '.join(f'EXCLUDED.{c}' for c in layout['update'])})")
+    with engine.begin() as conn:
+        n = conn.execute(text(
+            f"INSERT INTO silver.{target} ({cols}) {_dedupe_select(layout)} "
+            f"ON CONFLICT ({key}) DO UPDATE SET {update} WHERE {changed}"
+        ), bounds).rowcount
+        conn.execute(text(f'DELETE FROM {STAGING} WHERE "timestamp" >= :a AND "timestamp" < :b'), bounds)
+    return n
+
+
+def merge(engine, log):
+    """Merge everything staged into silver, month by month, then drop the
+    staging table and close the run."""
+    layout = _layout(engine)
+    target = layout["target"]
+    with engine.begin() as conn:
+        _set_phase(conn, "merging")
+        if not conn.execute(text(f"SELECT to_regclass('{STAGING}')")).scalar():
+            _set_phase(conn, "done")
+            return
+        # Staging created before seq existed: rows keep their physical order.
+        conn.execute(text(f"ALTER TABLE {STAGING} ADD COLUMN IF NOT EXISTS seq bigserial"))
+        # Tiny and cheap to build; keeps the per-month scans off the full table.
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS idx_sensor_events_staging_ts ON {STAGING} USING brin ("timestamp")'))
+        lo, hi = conn.execute(text(f'SELECT MIN("timestamp"), MAX("timestamp") FROM {STAGING}')).one()
+        partitioned = sensor_partitions.is_partitioned(conn, target)
+
+    if lo is not None:
+        sensor_partitions.ensure_range(engine, lo, hi, log=log, relname=target)
+        for month in sensor_partitions.months(lo, hi):
+            t0 = time.monotonic()
+            n = _attach_month(engine, layout, month) if partitioned else None
+            how = "attached"
+            if n is None:
+                n, how = _merge_month(engine, layout, month), "merged"
+            if n:
+                log.info(f"Bulk load: {month:%Y-%m} {how} {n:,} rows ({time.monotonic() - t0:.1f}s)")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {STAGING}"))
+        conn.execute(text(f"ANALYZE silver.{target}"))
+        _set_phase(conn, "done")
+    log.info("Bulk load: done")
@@ -0,0 +1,300 @@
+"""
+sensor_channels.py -- Compact, dictionary-encoded silver layout for sensors
+============================================================================
+Every silver.sensor_events row repeats apartment, room, sensor_type, field
+and unit as VARCHARs, carries a BIGSERIAL id nothing reads, and its unique
+index holds all five text columns again. The compact layout stores each
+distinct channel once and the readings as narrow fixed-width rows:
+
+    silver.sensor_channel   channel_id SMALLINT  <->  (apartment, room,
+                            sensor_type, field) + unit   -- a few hundred rows
+    silver.sensor_readings  (timestamp, value, channel_id, is_outlier)
+                            PRIMARY KEY (channel_id, timestamp),
+                            monthly partitions (sensor_partitions.py)
+    silver.sensor_events    VIEW joining the two back into the old column
+                            shape (minus id) for populate_sensors.py / KNIME
+
+A reading is ~24 bytes of data instead of ~80, and the unique index key is
+a smallint + timestamp instead of five strings.
+
+flatten_sensors.upsert() picks the layout from the catalog (is_compact():
+silver.sensor_events is a view). Channel ids are resolved -- and new
+channels inserted -- in a short transaction of their own before the data
+transaction, so a cached id always refers to a committed channel. A
+channel's unit follows the latest batch, as the wide layout's DO UPDATE
+SET unit did per row.
+
+Fresh installs choose with SENSOR_LAYOUT=wide|compact (create_silver.py);
+an existing wide table is converted with --migrate, which copies month by
+month, swaps in the view and keeps the old table as
+silver.sensor_events_wide until --drop-old.
+
+Usage:
+    python -m etl.bronze_to_silver.sensor_channels --status
+    python -m etl.bronze_to_silver.sensor_channels --migrate [--drop-old]
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from etl.bronze_to_silver import sensor_partitions
+
+LAYOUT   = os.getenv("SENSOR_LAYOUT", "wide").lower()   # fresh installs only
+OLD_WIDE = "sensor_events_wide"
+
+# Fixed-width columns first (8-byte aligned), so a row packs into 24 bytes.
+COMPACT_DDL = """
+    CREATE TABLE IF NOT EXISTS silver.sensor_channel (
+        channel_id   SMALLSERIAL  PRIMARY KEY,
+        apartment    VARCHAR(20)  NOT NULL,
+        room         VARCHAR(50)  NOT NULL,
+        sensor_type  VARCHAR(20)  NOT NULL,
+        field        VARCHAR(50)  NOT NULL,
+        unit         VARCHAR(10),
+        UNIQUE (apartment, room, sensor_type, field)
+    );
+    CREATE TABLE IF NOT EXISTS silver.sensor_readings (
+        timestamp    TIMESTAMPTZ  NOT NULL,
+        value        FLOAT,
+        channel_id   SMALLINT     NOT NULL,
+        is_outlier   BOOLEAN      NOT NULL DEFAULT FALSE,
+        PRIMARY KEY (channel_id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_sensor_readings_timestamp
+        ON silver.sensor_readings USING brin (timestamp);
+"""
+
+# Same columns and order as the wide table, without the unused id.
+VIEW_DDL = """
+    CREATE OR REPLACE VIEW silver.sensor_events AS
+    SELECT c.apartment, c.room, c.sensor_type, c.field,
+           r.value, c.unit, r.timestamp, r.is_outlier
+    FROM silver.sensor_readings r
+    JOIN silver.sensor_channel c ON c.channel_id = r.channel_id
+"""
+
+_UPSERT_CHANNELS = """
+    INSERT INTO silver.sensor_channel (apartment, room, sensor_type, field, unit)
+    SELECT DISTINCT ON (a, r, s, f) a, r, s, f, u
+    FROM unnest(CAST(:a AS text[]), CAST(:r AS text[]), CAST(:s AS text[]),
+                CAST(:f AS text[]), CAST(:u AS text[])) AS t(a, r, s, f, u)
+    ORDER BY a, r, s, f
+    ON CONFLICT (apartment, room, sensor_type, field)
+    DO UPDATE SET unit = EXCLUDED.unit
+    WHERE sensor_channel.unit IS DISTINCT FROM EXCLUDED.unit
+"""
+
+_TEMP_DDL = """
+    CREATE TEMP TABLE _tmp_sensor_readings (
+        channel_id  smallint,
+        "timestamp" timestamptz,
+        value       double precision,
+        is_outlier  boolean
+    ) ON COMMIT DROP
+"""
+
+_UPSERT_FROM_TMP = """
+    INSERT INTO silver.sensor_readings (channel_id, timestamp, value, is_outlier)
+    SELECT DISTINCT ON (channel_id, timestamp) channel_id, timestamp, value, is_outlier
+    FROM _tmp_sensor_readings
+    ORDER BY channel_id, timestamp
+    ON CONFLICT (channel_id, timestamp)
+    DO UPDATE SET value      = EXCLUDED.value,
+                  is_outlier = EXCLUDED.is_outlier
+    WHERE (sensor_readings.value, sensor_readings.is_outlier)
+          IS DISTINCT FROM (EXCLUDED.value, EXCLUDED.is_outlier)
+"""
+
+
+# -- LAYOUT --------------------------------------------------------------------
+
+_COMPACT = None
+_IDS = {}                      # (apartment, room, sensor_type, field) -> (channel_id, unit)
+_LOCK = threading.Lock()
+
+
+def is_compact(engine) -> bool:
+    """True once silver.sensor_events is the compact-layout view (checked
+    once per process)."""
+    global _COMPACT
+    if _COMPACT is None:
+        with engine.connect() as conn:
+            _COMPACT = sensor_partitions.relkind(conn) == "v"
+    return _COMPACT
+
+
+def ensure_schema(conn, layout: str = LAYOUT) -> str:
+    """Create (or re-assert) the sensor tables for whichever layout is in
+    place; a fresh database gets `layout`. Returns the table holding the
+    rows, for sensor_partitions.ensure_ahead()."""
+    kind = sensor_partitions.relkind(conn)
+    if kind == "v" or (kind is None and layout == "compact"):
+        conn.execute(text(COMPACT_DDL))
+        conn.execute(text(VIEW_DDL))
+        return "sensor_readings"
+    conn.execute(text(sensor_partitions.PARTITIONED_DDL))
+    return "sensor_events"
+
+
+# -- WRITE PATH ----------------------------------------------------------------
+
+def resolve(engine, keys) -> list:
+    """channel_id for each (apartment, room, sensor_type, field, unit) key.
+    Unknown channels (or a changed unit) are upserted and the whole --
+    tiny -- channel table re-read, in a transaction of its own."""
+    with _LOCK:
+        stale = [k for k in keys if k[:4] not in _IDS or _IDS[k[:4]][1] != k[4]]
+        if stale:
+            with engine.begin() as conn:
+                conn.execute(text(_UPSERT_CHANNELS), {
+                    name: [k[i] for k in stale] for i, name in enumerate("arsfu")
+                })
+                rows = conn.execute(text(
+                    "SELECT channel_id, apartment, room, sensor_type, field, unit FROM silver.sensor_channel"
+                )).fetchall()
+            _IDS.clear()
+            _IDS.update({(a, r, s, f): (cid, u) for cid, a, r, s, f, u in rows})
+        return [_IDS[k[:4]][0] for k in keys]
+
+
+def channel_ids(engine, batch) -> np.ndarray:
+    """Per-row channel_id array for a finished SensorBatch."""
+    keys, inverse = batch.channel_keys()
+    return np.asarray(resolve(engine, keys), dtype=np.int16)[inverse]
+
+
+def copy_into(cur, table, batch, channel_id):
+    """COPY (channel_id, timestamp, value, is_outlier) rows into `table`."""
+    cur.copy_expert(
+        f"COPY {table} (channel_id, \"timestamp\", value, is_outlier) "
+        "FROM STDIN WITH (FORMAT CSV, NULL '')",
+        batch.to_readings_csv(channel_id),
+    )
+
+
+def copy_and_merge(cur, batch, channel_id):
+    """COPY the batch into a temp table and merge it into
+    silver.sensor_readings (inside the caller's transaction)."""
+    cur.execute(_TEMP_DDL)
+    copy_into(cur, "_tmp_sensor_readings", batch, channel_id)
+    cur.execute(_UPSERT_FROM_TMP)
+
+
+def copy_append(cur, batch, channel_id):
+    """COPY a deduplicated batch straight into silver.sensor_readings --
+    flatten_sensors' append-only path, for rows newer than anything stored."""
+    copy_into(cur, "silver.sensor_readings", batch, channel_id)
+
+
+# -- MIGRATION -----------------------------------------------------------------
+
+def _size(conn, relname: str) -> int:
+    return conn.execute(text(
+        "SELECT COALESCE(SUM(pg_total_relation_size(relid)), 0) FROM pg_partition_tree(:r)"
+    ), {"r": f"silver.{relname}"}).scalar()
+
+
+def migrate(engine, drop_old: bool = False, log=print):
+    """Convert the wide silver.sensor_events table to the compact layout:
+
+      1. create sensor_channel + sensor_readings, fill the channels
+      2. copy month by month, each month its own transaction (resumable:
+         ON CONFLICT DO NOTHING skips what a previous attempt copied)
+      3. rename the table to sensor_events_wide and create the view
+      4. optionally drop the wide table
+
+    Writers must be stopped (watcher off) while this runs."""
+    with engine.begin() as conn:
+        kind = sensor_partitions.relkind(conn)
+        if kind == "v":
+            log("  silver.sensor_events is already the compact view")
+            if drop_old and sensor_partitions.relkind(conn, OLD_WIDE):
+                conn.execute(text(f"DROP TABLE silver.{OLD_WIDE}"))
+                log(f"  dropped silver.{OLD_WIDE}")
+            return
+        conn.execute(text(COMPACT_DDL))
+        if kind is None:
+            conn.execute(text(VIEW_DDL))
+            log("  sensor_events did not exist -- created the compact layout")
+            return
+        n = conn.execute(text("""
+            INSERT INTO silver.sensor_channel (apartment, room, sensor_type, field, unit)
+            SELECT apartment, room, sensor_type, field, MAX(unit)
+            FROM silver.sensor_events
+            GROUP BY apartment, room, sensor_type, field
+            ON CONFLICT DO NOTHING
+        """)).rowcount
+        log(f"  sensor_channel: {n:,} new channel(s)")
+        lo, hi = conn.execute(text("SELECT MIN(timestamp), MAX(timestamp) FROM silver.sensor_events")).one()
+
+    if lo is not None:
+        sensor_partitions.ensure_range(engine, lo, hi, relname="sensor_readings")
+        for month in sensor_partitions.months(lo, hi):
+            t0 = time.monotonic()
+            bounds = {"a": f"{month.isoformat()} 00:00:00+00",
+                      "b": f"{sensor_partitions.next_month(month).isoformat()} 00:00:00+00"}
+            with engine.begin() as conn:
+                n = conn.execute(text("""
+                    INSERT INTO silver.sensor_readings (channel_id, timestamp, value, is_outlier)
+                    SELECT c.channel_id, e.timestamp, e.value, COALESCE(e.is_outlier, FALSE)
+                    FROM silver.sensor_events e
+                    JOIN silver.sensor_channel c
+                      ON c.apartment = e.apartment AND c.room = e.room
+                     AND c.sensor_type = e.sensor_type AND c.field = e.field
+                    WHERE e.timestamp >= :a AND e.timestamp < :b
+                    ON CONFLICT DO NOTHING
+                """), bounds).rowcount
+            log(f"  {sensor_partitions.partition_name(month, 'sensor_readings')}: {n:,} rows "
+                f"({time.monotonic() - t0:.1f}s)")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE silver.sensor_events RENAME TO {OLD_WIDE}"))
+        conn.execute(text(VIEW_DDL))
+        conn.execute(text("ANALYZE silver.sensor_channel"))
+        conn.execute(text("ANALYZE silver.sensor_readings"))
+        log(f"  silver.sensor_events is now a view; old table kept as silver.{OLD_WIDE}")
+        log(f"  size: {_size(conn, OLD_WIDE) / 2**20:,.0f} MB wide -> "
+            f"{_size(conn, 'sensor_readings') / 2**20:,.0f} MB compact")
+        if drop_old:
+            conn.execute(text(f"DROP TABLE silver.{OLD_WIDE}"))
+            log(f"  dropped silver.{OLD_WIDE}")
+
+
+def status(engine, log=print):
+    with engine.connect() as conn:
+        if sensor_partitions.relkind(conn) != "v":
+            log(f"  wide layout: silver.sensor_events {_size(conn, 'sensor_events') / 2**20:,.0f} MB")
+            return
+        n = conn.execute(text("SELECT COUNT(*) FROM silver.sensor_channel")).scalar()
+        log(f"  compact layout: {n:,} channels, silver.sensor_readings "
+            f"{_size(conn, 'sensor_readings') / 2**20:,.0f} MB")
+        if sensor_partitions.relkind(conn, OLD_WIDE):
+            log(f"  silver.{OLD_WIDE} still present ({_size(conn, OLD_WIDE) / 2**20:,.0f} MB) -- --migrate --drop-old")
+
+
+def main():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv()
+    db_url = os.getenv("DB_URL")
+    if not db_url:
+        sys.exit("DB_URL not set in .env")
+    engine = create_engine(db_url)
+    if "--migrate" in sys.argv:
+        migrate(engine, drop_old="--drop-old" in sys.argv)
+    elif "--status" in sys.argv:
+        status(engine)
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
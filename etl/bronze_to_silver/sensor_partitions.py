@@ -0,0 +1,377 @@
+"""
+sensor_partitions.py -- Monthly range partitions for silver.sensor_events
+==========================================================================
+A single sensor_events heap carries one global unique B-tree on
+(apartment, room, sensor_type, field, timestamp). Once that index outgrows
+shared_buffers every upsert probe is a random read -- the "unique-index
+slowdown wall" fast_silver_backfill.py works around. Partitioned by month
+on `timestamp`, each partition has its own small unique index, the one the
+current month's upserts touch stays cache-resident, and an old month can
+be detached (archived) or dropped as one cheap DDL statement.
+
+    silver.sensor_events                PARTITION BY RANGE (timestamp)
+    silver.sensor_events_y2024m01       [2024-01-01, 2024-02-01) UTC
+    silver.sensor_events_y2024m02       ...
+
+Partitions are created on demand: flatten_sensors.upsert() calls
+ensure_range() with each batch's time span, which also creates
+MONTHS_AHEAD months past it so the live flow never waits on DDL. The
+unique constraint includes the partition key, so INSERT ... ON CONFLICT
+works unchanged and each row is routed to (and checked in) one partition.
+
+Fresh installs get the partitioned table from create_silver.py. An existing
+heap is converted with --migrate (copies month by month, keeps the old
+table as silver.sensor_events_unpartitioned until --drop-old). The compact
+layout's silver.sensor_readings (sensor_channels.py) is partitioned the
+same way; --status / --ensure / --explain / --detach-before act on
+whichever of the two holds the rows.
+
+Usage:
+    python -m etl.bronze_to_silver.sensor_partitions --status
+    python -m etl.bronze_to_silver.sensor_partitions --migrate [--drop-old]
+    python -m etl.bronze_to_silver.sensor_partitions --ensure
+    python -m etl.bronze_to_silver.sensor_partitions --explain
+    python -m etl.bronze_to_silver.sensor_partitions --detach-before 2024-01
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, timezone
+
+from sqlalchemy import text
+
+TABLE        = "silver.sensor_events"
+OLD_TABLE    = "sensor_events_unpartitioned"
+SEQUENCE     = "silver.sensor_events_id_seq"
+MONTHS_AHEAD = int(os.getenv("SENSOR_PARTITION_MONTHS_AHEAD", "2"))
+
+# Partitioned parent. The primary key must contain the partition key, so it
+# becomes (id, timestamp); indexes declared here cascade to every partition.
+PARTITIONED_DDL = f"""
+    CREATE SEQUENCE IF NOT EXISTS {SEQUENCE};
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        id           BIGINT       NOT NULL DEFAULT nextval('{SEQUENCE}'),
+        apartment    VARCHAR(20)  NOT NULL,
+        room         VARCHAR(50)  NOT NULL,
+        sensor_type  VARCHAR(20)  NOT NULL,
+        field        VARCHAR(50)  NOT NULL,
+        value        FLOAT,
+        unit         VARCHAR(10),
+        timestamp    TIMESTAMPTZ  NOT NULL,
+        is_outlier   BOOLEAN      DEFAULT FALSE,
+        PRIMARY KEY (id, timestamp),
+        UNIQUE (apartment, room, sensor_type, field, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+    ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id;
+    CREATE INDEX IF NOT EXISTS idx_sensor_events_timestamp   ON {TABLE} (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_sensor_events_apartment   ON {TABLE} (apartment);
+    CREATE INDEX IF NOT EXISTS idx_sensor_events_sensor_type ON {TABLE} (sensor_type);
+"""
+
+
+# -- MONTHS --------------------------------------------------------------------
+
+def month_start(dt) -> date:
+    """First day of dt's month; aware datetimes are taken in UTC (partition
+    bounds are UTC, the session time zone may not be)."""
+    if isinstance(dt, datetime) and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return date(dt.year, dt.month, 1)
+
+
+def next_month(d: date) -> date:
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+def months(first: date, last: date):
+    """Month starts from first's month through last's month, inclusive."""
+    m, last = month_start(first), month_start(last)
+    while m <= last:
+        yield m
+        m = next_month(m)
+
+
+def partition_name(month: date, relname: str = "sensor_events") -> str:
+    return f"{relname}_y{month.year:04d}m{month.month:02d}"
+
+
+def _create_partition_sql(month: date, relname: str) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS silver.{partition_name(month, relname)} PARTITION OF silver.{relname} "
+        f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{next_month(month).isoformat()} 00:00:00+00')"
+    )
+
+
+# -- STATE ---------------------------------------------------------------------
+
+def relkind(conn, relname: str = "sensor_events"):
+    """pg_class.relkind of silver.<relname> ('r' table, 'p' partitioned,
+    'v' view) or None if it doesn't exist."""
+    return conn.execute(text(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = 'silver' AND c.relname = :r"
+    ), {"r": relname}).scalar()
+
+
+def is_partitioned(conn, relname: str = "sensor_events") -> bool:
+    return relkind(conn, relname) == "p"
+
+
+def fact_table(conn) -> str:
+    """Table holding the sensor rows: sensor_readings once the compact
+    layout has turned silver.sensor_events into a view."""
+    return "sensor_readings" if relkind(conn) == "v" else "sensor_events"
+
+
+def existing_months(conn, relname: str = "sensor_events") -> set:
+    """Month starts of every attached partition."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent "
+        "JOIN pg_namespace n ON n.oid = p.relnamespace "
+        "WHERE n.nspname = 'silver' AND p.relname = :r"
+    ), {"r": relname}).fetchall()
+    out = set()
+    for (name,) in rows:
+        try:
+            out.add(date(int(name[-7:-3]), int(name[-2:]), 1))
+        except ValueError:
+            continue
+    return out
+
+
+# Per-process cache, per table: False = table isn't partitioned, else the
+# set of months known to exist.
+_KNOWN = {}
+_KNOWN_LOCK = threading.Lock()
+
+
+def ensure_months(engine, wanted, log=None, relname: str = "sensor_events") -> int:
+    """Create any missing partitions of silver.<relname> for `wanted` month
+    starts. Runs in its own short transaction (CREATE ... PARTITION OF locks
+    the parent) and under an advisory lock so concurrent writers don't race.
+    Returns the number created; a no-op on an unpartitioned table."""
+    wanted = set(wanted)
+    with _KNOWN_LOCK:
+        known = _KNOWN.get(relname)
+        if known is False or (known is not None and wanted <= known):
+            return 0
+        created = 0
+        with engine.begin() as conn:
+            if not is_partitioned(conn, relname):
+                _KNOWN[relname] = False
+                return 0
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:k))"), {"k": f"silver.{relname} partitions"})
+            have = existing_months(conn, relname)
+            for month in sorted(wanted - have):
+                conn.execute(text(_create_partition_sql(month, relname)))
+                have.add(month)
+                created += 1
+        _KNOWN[relname] = have
+    if created and log:
+        log.info(f"{relname}: created {created} monthly partition(s)")
+    return created
+
+
+def ensure_range(engine, first: datetime, last: datetime, log=None, relname: str = "sensor_events") -> int:
+    """Partitions for every month in [first, last] plus MONTHS_AHEAD more."""
+    ahead = month_start(last)
+    for _ in range(MONTHS_AHEAD):
+        ahead = next_month(ahead)
+    return ensure_months(engine, months(first, ahead), log, relname)
+
+
+def ensure_ahead(engine, log=None, relname: str = "sensor_events") -> int:
+    now = datetime.now(tz=timezone.utc)
+    return ensure_range(engine, now, now, log, relname)
+
+
+# -- MIGRATION -----------------------------------------------------------------
+
+def migrate(engine, drop_old: bool = False, log=print):
+    """Convert an unpartitioned silver.sensor_events in place:
+
+      1. rename it (and its indexes/constraints) to sensor_events_unpartitioned
+      2. create the partitioned parent + one partition per month of data
+      3. copy month by month, each month its own transaction (resumable:
+         ON CONFLICT DO NOTHING skips what a previous attempt copied)
+      4. re-own the id sequence, optionally drop the old table
+
+    Writers must be stopped (watcher off) while this runs."""
+    with engine.begin() as conn:
+        if relkind(conn) == "v":
+            log("  silver.sensor_events is the compact-layout view -- sensor_readings is already partitioned")
+            return
+        partitioned = is_partitioned(conn)
+        old_exists = conn.execute(text(f"SELECT to_regclass('silver.{OLD_TABLE}')")).scalar()
+        if not partitioned and not old_exists:
+            if not conn.execute(text(f"SELECT to_regclass('{TABLE}')")).scalar():
+                conn.execute(text(PARTITIONED_DDL))
+                log("  sensor_events did not exist -- created partitioned")
+                return
+            conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}"))
+            # Index and constraint names are schema-wide: free them for the
+            # new table (renaming an index renames its constraint too).
+            conn.execute(text(f"""
+                DO $$ DECLARE r RECORD;
+                BEGIN
+                  FOR r IN SELECT indexname FROM pg_indexes
+                           WHERE schemaname = 'silver' AND tablename = '{OLD_TABLE}' LOOP
+                    EXECUTE 'ALTER INDEX silver.' || quote_ident(r.indexname)
+                            || ' RENAME TO ' || quote_ident(left(r.indexname, 50) || '_unpart');
+                  END LOOP;
+                END $$;
+            """))
+            # The BIGSERIAL sequence belongs to the old id column; detach it
+            # so dropping the old table later doesn't take it along.
+            conn.execute(text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY NONE"))
+            log(f"  renamed {TABLE} -> silver.{OLD_TABLE}")
+        if not partitioned:
+            conn.execute(text(PARTITIONED_DDL))
+            log("  created partitioned silver.sensor_events")
+
+    with engine.connect() as conn:
+        if not conn.execute(text(f"SELECT to_regclass('silver.{OLD_TABLE}')")).scalar():
+            log("  nothing to copy (no silver.sensor_events_unpartitioned)")
+            return
+        lo, hi = conn.execute(text(f"SELECT MIN(timestamp), MAX(timestamp) FROM silver.{OLD_TABLE}")).one()
+    if lo is None:
+        log("  old table is empty")
+    else:
+        ensure_range(engine, lo, hi)
+        for month in months(lo, hi):
+            t0 = time.monotonic()
+            with engine.begin() as conn:
+                n = conn.execute(text(f"""
+                    INSERT INTO {TABLE}
+                        (id, apartment, room, sensor_type, field, value, unit, timestamp, is_outlier)
+                    SELECT id, apartment, room, sensor_type, field, value, unit, timestamp, is_outlier
+                    FROM silver.{OLD_TABLE}
+                    WHERE timestamp >= :a AND timestamp < :b
+                    ON CONFLICT DO NOTHING
+                """), {"a": f"{month.isoformat()} 00:00:00+00", "b": f"{next_month(month).isoformat()} 00:00:00+00"}).rowcount
+            log(f"  {partition_name(month)}: {n:,} rows ({time.monotonic() - t0:.1f}s)")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"SELECT setval('{SEQUENCE}', GREATEST((SELECT MAX(id) FROM {TABLE}), 1))"))
+        conn.execute(text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id"))
+        conn.execute(text(f"ANALYZE {TABLE}"))
+        if drop_old:
+            conn.execute(text(f"DROP TABLE silver.{OLD_TABLE}"))
+            log(f"  dropped silver.{OLD_TABLE}")
+        else:
+            log(f"  kept silver.{OLD_TABLE} -- re-run with --drop-old once verified")
+
+
+def detach_before(engine, month: date, log=print) -> list:
+    """Detach (not drop) every partition older than `month`. The detached
+    tables stay queryable for archiving (pg_dump -t) and can be dropped or
+    re-attached later."""
+    detached = []
+    with engine.begin() as conn:
+        relname = fact_table(conn)
+        for m in sorted(existing_months(conn, relname)):
+            if m < month:
+                conn.execute(text(f"ALTER TABLE silver.{relname} DETACH PARTITION silver.{partition_name(m, relname)}"))
+                detached.append(partition_name(m, relname))
+    for name in detached:
+        log(f"  detached silver.{name}")
+    return detached
+
+
+# -- PRUNING CHECK -------------------------------------------------------------
+
+def _scanned_partitions(conn, sql: str, params: dict, relname: str) -> set:
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params).scalar()
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    found = set()
+
+    def walk(node):
+        name = node.get("Relation Name", "")
+        if name.startswith(f"{relname}_y"):
+            found.add(name)
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return found
+
+
+def explain(engine, log=print):
+    """Show how many partitions the upsert probe and a one-day gold-style
+    aggregate touch. Both should touch exactly one."""
+    day = datetime.now(tz=timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    with engine.connect() as conn:
+        relname = fact_table(conn)
+    if relname == "sensor_readings":
+        probe = "SELECT 1 FROM silver.sensor_readings WHERE channel_id = 1 AND timestamp = :ts"
+    else:
+        probe = (f"SELECT 1 FROM {TABLE} WHERE apartment = 'jimmy' AND room = 'Office' "
+                 "AND sensor_type = 'meteo' AND field = 'co2_ppm' AND timestamp = :ts")
+    checks = {
+        "upsert conflict probe": (probe, {"ts": day}),
+        "one-day aggregate": (
+            f"SELECT date_trunc('minute', timestamp), MAX(value) FROM {TABLE} "
+            "WHERE timestamp >= :a AND timestamp < :a + INTERVAL '1 day' GROUP BY 1",
+            {"a": day},
+        ),
+    }
+    with engine.connect() as conn:
+        if not is_partitioned(conn, relname):
+            log(f"  silver.{relname} is not partitioned (run --migrate)")
+            return
+        total = len(existing_months(conn, relname))
+        for label, (sql, params) in checks.items():
+            scanned = _scanned_partitions(conn, sql, params, relname)
+            log(f"  {label:<24} {len(scanned)} of {total} partitions  {sorted(scanned)}")
+
+
+def status(engine, log=print):
+    with engine.connect() as conn:
+        relname = fact_table(conn)
+        if not is_partitioned(conn, relname):
+            log(f"  silver.{relname}: single table (not partitioned)")
+            return
+        rows = conn.execute(text(
+            "SELECT c.relname, c.reltuples::BIGINT, pg_total_relation_size(c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            f"WHERE i.inhparent = 'silver.{relname}'::regclass ORDER BY c.relname"
+        )).fetchall()
+    for name, tuples, size in rows:
+        log(f"  {name:<26} ~{max(tuples, 0):>12,} rows  {size / 2**20:>9,.1f} MB")
+
+
+def main():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv()
+    db_url = os.getenv("DB_URL")
+    if not db_url:
+        sys.exit("DB_URL not set in .env")
+    engine = create_engine(db_url)
+    if "--migrate" in sys.argv:
+        migrate(engine, drop_old="--drop-old" in sys.argv)
+    elif "--ensure" in sys.argv:
+        with engine.connect() as conn:
+            relname = fact_table(conn)
+        print(f"  created {ensure_ahead(engine, relname=relname)} partition(s)")
+    elif "--explain" in sys.argv:
+        explain(engine)
+    elif "--detach-before" in sys.argv:
+        y, m = sys.argv[sys.argv.index("--detach-before") + 1].split("-")
+        detach_before(engine, date(int(y), int(m), 1))
+    elif "--status" in sys.argv:
+        status(engine)
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+"""
+sensor_watermark.py -- Range-compressed watermark for sensor files
+===================================================================
+Sensor files are one per apartment per minute, so "which files are in
+silver" is really "which minutes are in silver". Instead of one VARCHAR
+primary-key row per file (a million-plus rows per year, all re-read every
+run), the watermark is stored as contiguous minute ranges:
+
+    silver.etl_watermark_ranges
+        apartment | first_minute | last_minute | processed_on | processed_at
+
+    silver.etl_watermark_exceptions
+        filename | processed_at     -- names that don't parse to (apt, minute)
+
+A range only ever grows from minutes that were actually marked done, so
+every minute inside it had a file. Ranges are split by `processed_on` (the
+day they were written) so cleanup_bronze's retention rule -- "processed
+more than N days ago" -- still holds per range without per-file stamps.
+Steady state is one range per apartment per day; loading is O(ranges).
+
+The legacy per-filename table (silver.etl_watermark) is migrated on first
+use and renamed to silver.etl_watermark_legacy (kept, never read again).
+
+Alongside the ranges, silver.sensor_file_digests keeps a content digest per
+ingested file, written in the same transaction as its watermark. A file
+that turns up again (a .json.gz replay, a re-copy from SMB) with an
+unchanged digest is post-processed without being parsed or upserted --
+but only while the watermark still covers it. Once the watermark has
+been reset (e.g. for a silver rebuild) the digest alone proves nothing
+and the file is parsed again.
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import hashlib
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from psycopg2 import extras as _pg_extras
+from sqlalchemy import text
+
+APARTMENT_MAP  = {"jimmyloup": "jimmy", "jeremievianin": "jeremie"}
+SMB_APARTMENTS = {"jimmy": "JimmyLoup", "jeremie": "JeremieVianin"}
+
+RANGES_DDL = """
+    CREATE TABLE IF NOT EXISTS silver.etl_watermark_ranges (
+        apartment     VARCHAR(20) NOT NULL,
+        first_minute  TIMESTAMPTZ NOT NULL,
+        last_minute   TIMESTAMPTZ NOT NULL,
+        processed_on  DATE        NOT NULL DEFAULT CURRENT_DATE,
+        processed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (apartment, processed_on, first_minute),
+        CHECK (last_minute >= first_minute)
+    );
+    CREATE INDEX IF NOT EXISTS idx_etl_watermark_ranges_processed_at
+        ON silver.etl_watermark_ranges (processed_at);
+    CREATE TABLE IF NOT EXISTS silver.etl_watermark_exceptions (
+        filename     VARCHAR(200) PRIMARY KEY,
+        processed_at TIMESTAMPTZ DEFAULT NOW()
+    );
+"""
+
+DIGESTS_DDL = """
+    CREATE TABLE IF NOT EXISTS silver.sensor_file_digests (
+        filename     VARCHAR(200) PRIMARY KEY,
+        digest       BYTEA        NOT NULL,
+        processed_at TIMESTAMPTZ  NOT NULL DEFAULT NOW()
+    );
+"""
+
+# Merge one run of new minutes into today's ranges: delete every range of
+# today that overlaps or touches [a-1min, b+1min] and re-insert their union.
+# LEAST/GREATEST ignore the NULL aggregates when nothing was touched.
+_MERGE_RUN = """
+    WITH gone AS (
+        DELETE FROM silver.etl_watermark_ranges
+        WHERE apartment = %(apt)s
+          AND processed_on = CURRENT_DATE
+          AND first_minute <= %(b)s + INTERVAL '1 minute'
+          AND last_minute  >= %(a)s - INTERVAL '1 minute'
+        RETURNING first_minute, last_minute
+    )
+    INSERT INTO silver.etl_watermark_ranges (apartment, first_minute, last_minute)
+    SELECT %(apt)s, LEAST(%(a)s, MIN(first_minute)), GREATEST(%(b)s, MAX(last_minute))
+    FROM gone
+"""
+
+
+# -- KEYS ----------------------------------------------------------------------
+
+def parse_key(filename: str):
+    """'31.08.2023 2144_JimmyLoup_received.json' -> ('jimmy', epoch_minute),
+    or None for names outside the sensor naming scheme."""
+    lower = filename.lower()
+    apartment = next((v for k, v in APARTMENT_MAP.items() if k in lower), None)
+    if apartment is None or not lower.endswith("_received.json"):
+        return None
+    try:
+        dt = datetime.strptime(filename.split("_")[0].strip(), "%d.%m.%Y %H%M")
+    except ValueError:
+        return None
+    return apartment, int(dt.replace(tzinfo=timezone.utc).timestamp()) // 60
+
+
+def minute_to_dt(minute: int) -> datetime:
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc)
+
+
+def dt_to_minute(dt: datetime) -> int:
+    return int(dt.timestamp()) // 60
+
+
+def minute_to_filename(apartment: str, minute: int) -> str:
+    """Inverse of parse_key(): ('jimmy', m) -> '<dd.mm.yyyy HHMM>_JimmyLoup_received.json'."""
+    return f"{minute_to_dt(minute).strftime('%d.%m.%Y %H%M')}_{SMB_APARTMENTS[apartment]}_received.json"
+
+
+def runs(minutes):
+    """Sorted, deduplicated minutes -> list of contiguous (first, last) runs."""
+    out = []
+    for m in sorted(set(minutes)):
+        if out and m == out[-1][1] + 1:
+            out[-1][1] = m
+        else:
+            out.append([m, m])
+    return [tuple(r) for r in out]
+
+
+# -- IN-MEMORY INTERVAL SET ----------------------------------------------------
+
+class MinuteWatermark:
+    """Per-apartment sorted, non-overlapping minute intervals + a set of
+    exception filenames. Drop-in for the old `set` of filenames:
+    `name in wm`, `len(wm)`, `wm.update(names)`."""
+
+    def __init__(self):
+        self._starts = defaultdict(list)
+        self._ends = defaultdict(list)
+        self.exceptions = set()
+
+    def add_range(self, apartment: str, first: int, last: int):
+        starts, ends = self._starts[apartment], self._ends[apartment]
+        i = bisect_left(ends, first - 1)
+        j = i
+        while j < len(starts) and starts[j] <= last + 1:
+            first = min(first, starts[j])
+            last = max(last, ends[j])
+            j += 1
+        starts[i:j] = [first]
+        ends[i:j] = [last]
+
+    def covers(self, apartment: str, first: int, last: int | None = None) -> bool:
+        """True if every minute in [first, last] is watermarked."""
+        last = first if last is None else last
+        starts = self._starts.get(apartment)
+        if not starts:
+            return False
+        i = bisect_right(starts, first) - 1
+        return i >= 0 and self._ends[apartment][i] >= last
+
+    def update(self, filenames):
+        for name in filenames:
+            key = parse_key(name)
+            if key is None:
+                self.exceptions.add(name)
+            else:
+                self.add_range(key[0], key[1], key[1])
+
+    def range_count(self) -> int:
+        return sum(len(v) for v in self._starts.values())
+
+    def __contains__(self, filename) -> bool:
+        key = parse_key(filename)
+        if key is None:
+            return filename in self.exceptions
+        return self.covers(key[0], key[1])
+
+    def __len__(self) -> int:
+        minutes = sum(
+            e - s + 1
+            for apt in self._starts
+            for s, e in zip(self._starts[apt], self._ends[apt])
+        )
+        return minutes + len(self.exceptions)
+
+
+# -- SCHEMA + MIGRATION --------------------------------------------------------
+
+def ensure_schema(engine, log=None):
+    """Create the range tables and migrate the legacy per-filename table
+    if it is still there."""
+    with engine.begin() as conn:
+        conn.execute(text(RANGES_DDL))
+        conn.execute(text(DIGESTS_DDL))
+        legacy = conn.execute(text("SELECT to_regclass('silver.etl_watermark')")).scalar()
+    if legacy:
+        migrate_legacy(engine, log)
+
+
+def migrate_legacy(engine, log=None):
+    """Fold silver.etl_watermark (one row per file) into ranges, in one
+    transaction, then rename it to silver.etl_watermark_legacy. Streams the
+    legacy rows with a server-side cursor so a million-row table doesn't
+    have to fit in one fetch."""
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor(name="etl_watermark_migrate")
+        cur.itersize = 50_000
+        cur.execute("SELECT filename, processed_at FROM silver.etl_watermark")
+
+        by_day = defaultdict(list)   # (apartment, processed_on) -> minutes
+        stamp = {}                   # (apartment, processed_on) -> max processed_at
+        exceptions = []
+        n = 0
+        for filename, processed_at in cur:
+            n += 1
+            key = parse_key(filename)
+            if key is None:
+                exceptions.append((filename, processed_at))
+                continue
+            day = processed_at.date()
+            by_day[(key[0], day)].append(key[1])
+            if (key[0], day) not in stamp or processed_at > stamp[(key[0], day)]:
+                stamp[(key[0], day)] = processed_at
+        cur.close()
+
+        rows = [
+            (apt, minute_to_dt(a), minute_to_dt(b), day, stamp[(apt, day)])
+            for (apt, day), minutes in by_day.items()
+            for a, b in runs(minutes)
+        ]
+        cur = raw.cursor()
+        _pg_extras.execute_values(
+            cur,
+            "INSERT INTO silver.etl_watermark_ranges "
+            "(apartment, first_minute, last_minute, processed_on, processed_at) VALUES %s "
+            "ON CONFLICT DO NOTHING",
+            rows, page_size=5000,
+        )
+        _pg_extras.execute_values(
+            cur,
+            "INSERT INTO silver.etl_watermark_exceptions (filename, processed_at) VALUES %s "
+            "ON CONFLICT DO NOTHING",
+            exceptions, page_size=5000,
+        )
+        # Keep the old table for audit. If a previous migration already left
+        # a legacy table (old code recreated etl_watermark since), fold into it.
+        cur.execute("SELECT to_regclass('silver.etl_watermark_legacy')")
+        if cur.fetchone()[0]:
+            cur.execute("INSERT INTO silver.etl_watermark_legacy SELECT * FROM silver.etl_watermark "
+                        "ON CONFLICT DO NOTHING")
+            cur.execute("DROP TABLE silver.etl_watermark")
+        else:
+            cur.execute("ALTER TABLE silver.etl_watermark RENAME TO etl_watermark_legacy")
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    if log:
+        log.info(f"Watermark migrated: {n:,} file rows -> {len(rows):,} ranges "
+                 f"+ {len(exceptions):,} exceptions (old table kept as silver.etl_watermark_legacy)")
+
+
+# -- READ ----------------------------------------------------------------------
+
+def load(engine, since=None) -> MinuteWatermark:
+    """Load the whole watermark (O(ranges)), or only ranges/exceptions
+    stamped at or after `since` when refreshing a warm copy."""
+    wm = MinuteWatermark()
+    load_into(engine, wm, since)
+    return wm
+
+
+def load_into(engine, wm: MinuteWatermark, since=None):
+    where, params = "", {}
+    if since is not None:
+        where, params = "WHERE processed_at >= :since", {"since": since}
+    with engine.begin() as conn:
+        for apt, first, last in conn.execute(text(
+            f"SELECT apartment, first_minute, last_minute FROM silver.etl_watermark_ranges {where}"
+        ), params):
+            wm.add_range(apt, dt_to_minute(first), dt_to_minute(last))
+        wm.exceptions.update(r[0] for r in conn.execute(text(
+            f"SELECT filename FROM silver.etl_watermark_exceptions {where}"
+        ), params))
+    return wm
+
+
+def count(engine) -> int:
+    """Number of watermarked files, without loading anything."""
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            SELECT COALESCE((SELECT SUM(EXTRACT(EPOCH FROM last_minute - first_minute) / 60 + 1)
+                             FROM silver.etl_watermark_ranges), 0)
+                 + (SELECT COUNT(*) FROM silver.etl_watermark_exceptions)
+        """)).scalar()
+
+
+def expired(engine, cutoff_days: int):
+    """(filename, processed_at) for every watermarked file processed more
+    than `cutoff_days` ago -- the rows cleanup_bronze used to read from the
+    per-filename table, expanded from ranges."""
+    with engine.connect() as conn:
+        ranges = conn.execute(text(
+            "SELECT apartment, first_minute, last_minute, processed_at "
+            "FROM silver.etl_watermark_ranges "
+            f"WHERE processed_at < NOW() - INTERVAL '{int(cutoff_days)} days' "
+            "ORDER BY apartment, first_minute"
+        )).fetchall()
+        exceptions = conn.execute(text(
+            "SELECT filename, processed_at FROM silver.etl_watermark_exceptions "
+            f"WHERE processed_at < NOW() - INTERVAL '{int(cutoff_days)} days'"
+        )).fetchall()
+    for apt, first, last, processed_at in ranges:
+        for m in range(dt_to_minute(first), dt_to_minute(last) + 1):
+            yield minute_to_filename(apt, m), processed_at
+    yield from ((r[0], r[1]) for r in exceptions)
+
+
+# -- WRITE ---------------------------------------------------------------------
+
+def mark_done(engine, filenames, cur=None):
+    """Record filenames as processed: one merge statement per contiguous
+    run of minutes (a 5,000-file batch is typically a single run per
+    apartment). Serialised with an advisory lock so concurrent writers
+    can't interleave their delete-and-reinsert merges.
+
+    Pass `cur` to write inside the caller's transaction (the caller
+    commits); otherwise a connection is borrowed and committed here."""
+    if not filenames:
+        return
+    by_apt = defaultdict(list)
+    exceptions = []
+    for name in filenames:
+        key = parse_key(name)
+        if key is None:
+            exceptions.append((name,))
+        else:
+            by_apt[key[0]].append(key[1])
+
+    raw = None
+    if cur is None:
+        raw = engine.raw_connection()
+        cur = raw.cursor()
+    try:
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext('silver.etl_watermark_ranges'))")
+        for apt, minutes in by_apt.items():
+            for a, b in runs(minutes):
+                cur.execute(_MERGE_RUN, {"apt": apt, "a": minute_to_dt(a), "b": minute_to_dt(b)})
+        if exceptions:
+            _pg_extras.execute_values(
+                cur,
+                "INSERT INTO silver.etl_watermark_exceptions (filename) VALUES %s ON CONFLICT DO NOTHING",
+                exceptions, page_size=5000,
+            )
+        if raw is not None:
+            raw.commit()
+    finally:
+        if raw is not None:
+            raw.close()
+
+
+# -- CONTENT DIGESTS -----------------------------------------------------------
+
+def digest(data) -> bytes:
+    """16-byte BLAKE2b of a file's decompressed content (str or bytes), so
+    a file and its .json.gz / .json.zst form have the same digest. Line
+    endings are normalised: text-mode reads already turned CRLF into LF,
+    raw bytes off the share have not."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.blake2b(data.replace(b"\r\n", b"\n"), digest_size=16).digest()
+
+
+_KNOWN_DIGESTS = """
+    SELECT d.filename, d.digest
+    FROM unnest(CAST(:names AS text[]), CAST(:apts AS text[]), CAST(:minutes AS timestamptz[]))
+         AS f(filename, apartment, minute)
+    JOIN silver.sensor_file_digests d USING (filename)
+    WHERE EXISTS (SELECT 1 FROM silver.etl_watermark_ranges r
+                  WHERE r.apartment = f.apartment
+                    AND f.minute BETWEEN r.first_minute AND r.last_minute)
+       OR EXISTS (SELECT 1 FROM silver.etl_watermark_exceptions e
+                  WHERE e.filename = f.filename)
+"""
+
+
+def known_digests(engine, filenames) -> dict:
+    """{filename: digest} for the given canonical names that have one and
+    are still watermarked. A digest without a watermark (the watermark was
+    reset since) is ignored, so the file gets parsed again."""
+    if not filenames:
+        return {}
+    names = list(filenames)
+    keys = [parse_key(n) for n in names]
+    params = {
+        "names": names,
+        "apts": [k[0] if k else None for k in keys],
+        "minutes": [minute_to_dt(k[1]) if k else None for k in keys],
+    }
+    with engine.connect() as conn:
+        return {name: bytes(d) for name, d in conn.execute(text(_KNOWN_DIGESTS), params)}
+
+
+def record_digests(cur, digests: dict):
+    """Upsert {filename: digest} inside the caller's transaction (the one
+    that watermarks the same files)."""
+    if not digests:
+        return
+    _pg_extras.execute_values(
+        cur,
+        "INSERT INTO silver.sensor_file_digests (filename, digest) VALUES %s "
+        "ON CONFLICT (filename) DO UPDATE SET digest = EXCLUDED.digest, processed_at = NOW() "
+        "WHERE sensor_file_digests.digest IS DISTINCT FROM EXCLUDED.digest",
+        list(digests.items()), page_size=5000,
+    )
@@ -0,0 +1,199 @@
+"""
+weather_partitions.py -- prediction_date partitions for silver.weather_forecasts
+================================================================================
+Every weather CSV (Pred_YYYY-MM-DD.csv) holds exactly one prediction_date,
+so a file is a slice of silver.weather_forecasts, not a set of rows to
+reconcile one by one. The table is partitioned by month of prediction_date:
+
+    silver.weather_forecasts                PARTITION BY RANGE (prediction_date)
+    silver.weather_forecasts_y2024m01       [2024-01-01, 2024-02-01)
+    silver.weather_forecasts_y2024m02       ...
+
+and clean_weather.py loads a file by replacing its slice -- COPY into a temp
+table, DELETE the prediction_date, INSERT the new rows, watermark, all in
+one transaction -- instead of INSERT ... ON CONFLICT DO UPDATE against the
+whole history. The DELETE is pruned to one partition and walks its
+prediction_date index, so re-processing a day costs O(file). (It works on
+an unpartitioned table too, through the same index.)
+
+Partitions are created on demand by clean_weather (ensure_month(), cached
+per process); the month helpers and ensure_months() are shared with
+sensor_partitions.py. Fresh installs get the partitioned table from
+create_silver.py; an existing table is converted with --migrate (copies
+month by month, keeps the old table as
+silver.weather_forecasts_unpartitioned until --drop-old).
+
+Usage:
+    python -m etl.bronze_to_silver.weather_partitions --status
+    python -m etl.bronze_to_silver.weather_partitions --migrate [--drop-old]
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import os
+import sys
+import time
+
+from sqlalchemy import text
+
+from etl.bronze_to_silver import sensor_partitions
+from etl.bronze_to_silver.sensor_partitions import month_start, months, next_month, partition_name
+
+RELNAME   = "weather_forecasts"
+TABLE     = f"silver.{RELNAME}"
+OLD_TABLE = "weather_forecasts_unpartitioned"
+SEQUENCE  = "silver.weather_forecasts_id_seq"
+COLUMNS   = ("timestamp", "site", "prediction", "prediction_date", "measurement", "value", "unit", "is_outlier")
+KEY       = ("timestamp", "site", "prediction", "prediction_date", "measurement")
+
+# Same columns as before; the primary key must contain the partition key,
+# so it becomes (id, prediction_date), and prediction_date is NOT NULL.
+PARTITIONED_DDL = f"""
+    CREATE SEQUENCE IF NOT EXISTS {SEQUENCE};
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+        id               BIGINT       NOT NULL DEFAULT nextval('{SEQUENCE}'),
+        timestamp        TIMESTAMPTZ  NOT NULL,
+        site             VARCHAR(100),
+        prediction       SMALLINT,
+        prediction_date  DATE         NOT NULL,
+        measurement      VARCHAR(50),
+        value            FLOAT,
+        unit             VARCHAR(20),
+        is_outlier       BOOLEAN      DEFAULT FALSE,
+        PRIMARY KEY (id, prediction_date),
+        UNIQUE (timestamp, site, prediction, prediction_date, measurement)
+    ) PARTITION BY RANGE (prediction_date);
+    ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id;
+    CREATE INDEX IF NOT EXISTS idx_weather_forecasts_timestamp ON {TABLE} (timestamp);
+    CREATE INDEX IF NOT EXISTS idx_weather_forecasts_pred_date ON {TABLE} (prediction_date);
+"""
+
+# Slice replace, inside the caller's transaction. DISTINCT ON keeps one row
+# per key should a file repeat one (ON CONFLICT used to reject that).
+_cols = ", ".join(COLUMNS)
+_key = ", ".join(KEY)
+DELETE_SLICE_SQL = f"DELETE FROM {TABLE} WHERE prediction_date = %(d)s"
+DELETE_SITES_SQL = f"DELETE FROM {TABLE} WHERE prediction_date = %(d)s AND site = ANY(%(sites)s)"
+INSERT_SLICE_SQL = (f"INSERT INTO {TABLE} ({_cols}) "
+                    f"SELECT DISTINCT ON ({_key}) {_cols} FROM _tmp_weather ORDER BY {_key}")
+
+
+def ensure_schema(conn):
+    """Create the partitioned table on a fresh database; an existing
+    (unpartitioned) table is left as it is until --migrate."""
+    conn.execute(text(PARTITIONED_DDL))
+
+
+def ensure_month(engine, prediction_date, log=None) -> int:
+    """The partition holding `prediction_date` (own short transaction;
+    a no-op once known, or on an unpartitioned table)."""
+    return sensor_partitions.ensure_months(engine, [month_start(prediction_date)], log, RELNAME)
+
+
+# -- MIGRATION -----------------------------------------------------------------
+
+def migrate(engine, drop_old: bool = False, log=print):
+    """Convert an unpartitioned silver.weather_forecasts in place:
+
+      1. rename it (and its indexes/constraints) to weather_forecasts_unpartitioned
+      2. create the partitioned parent + one partition per prediction month
+      3. copy month by month, each month its own transaction (resumable:
+         ON CONFLICT DO NOTHING skips what a previous attempt copied)
+      4. re-own the id sequence, optionally drop the old table
+
+    clean_weather must not run while this runs."""
+    with engine.begin() as conn:
+        partitioned = sensor_partitions.is_partitioned(conn, RELNAME)
+        old_exists = sensor_partitions.relkind(conn, OLD_TABLE)
+        if not partitioned and not old_exists:
+            if not sensor_partitions.relkind(conn, RELNAME):
+                conn.execute(text(PARTITIONED_DDL))
+                log("  weather_forecasts did not exist -- created partitioned")
+                return
+            conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {OLD_TABLE}"))
+            # Free the schema-wide index/constraint names for the new table.
+            conn.execute(text(f"""
+                DO $$ DECLARE r RECORD;
+                BEGIN
+                  FOR r IN SELECT indexname FROM pg_indexes
+                           WHERE schemaname = 'silver' AND tablename = '{OLD_TABLE}' LOOP
+                    EXECUTE 'ALTER INDEX silver.' || quote_ident(r.indexname)
+                            || ' RENAME TO ' || quote_ident(left(r.indexname, 50) || '_unpart');
+                  END LOOP;
+                END $$;
+            """))
+            conn.execute(text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY NONE"))
+            log(f"  renamed {TABLE} -> silver.{OLD_TABLE}")
+        if not partitioned:
+            conn.execute(text(PARTITIONED_DDL))
+            log("  created partitioned silver.weather_forecasts")
+
+    with engine.connect() as conn:
+        if not sensor_partitions.relkind(conn, OLD_TABLE):
+            log(f"  nothing to copy (no silver.{OLD_TABLE})")
+            return
+        lo, hi, orphans = conn.execute(text(
+            f"SELECT MIN(prediction_date), MAX(prediction_date), COUNT(*) FILTER (WHERE prediction_date IS NULL) "
+            f"FROM silver.{OLD_TABLE}"
+        )).one()
+    if orphans:
+        log(f"  {orphans:,} rows without prediction_date stay behind in silver.{OLD_TABLE}")
+    if lo is None:
+        log("  old table is empty")
+    else:
+        sensor_partitions.ensure_months(engine, months(lo, hi), relname=RELNAME)
+        for month in months(lo, hi):
+            t0 = time.monotonic()
+            with engine.begin() as conn:
+                n = conn.execute(text(f"""
+                    INSERT INTO {TABLE} (id, {_cols})
+                    SELECT id, {_cols} FROM silver.{OLD_TABLE}
+                    WHERE prediction_date >= :a AND prediction_date < :b
+                    ON CONFLICT DO NOTHING
+                """), {"a": month, "b": next_month(month)}).rowcount
+            log(f"  {partition_name(month, RELNAME)}: {n:,} rows ({time.monotonic() - t0:.1f}s)")
+
+    with engine.begin() as conn:
+        conn.execute(text(f"SELECT setval('{SEQUENCE}', GREATEST((SELECT MAX(id) FROM {TABLE}), 1))"))
+        conn.execute(text(f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id"))
+        conn.execute(text(f"ANALYZE {TABLE}"))
+        if drop_old:
+            conn.execute(text(f"DROP TABLE silver.{OLD_TABLE}"))
+            log(f"  dropped silver.{OLD_TABLE}")
+        else:
+            log(f"  kept silver.{OLD_TABLE} -- re-run with --drop-old once verified")
+
+
+def status(engine, log=print):
+    with engine.connect() as conn:
+        if not sensor_partitions.is_partitioned(conn, RELNAME):
+            log(f"  {TABLE}: single table (not partitioned)")
+            return
+        rows = conn.execute(text(
+            "SELECT c.relname, c.reltuples::BIGINT, pg_total_relation_size(c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            f"WHERE i.inhparent = '{TABLE}'::regclass ORDER BY c.relname"
+        )).fetchall()
+    for name, tuples, size in rows:
+        log(f"  {name:<30} ~{max(tuples, 0):>12,} rows  {size / 2**20:>9,.1f} MB")
+
+
+def main():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv()
+    db_url = os.getenv("DB_URL")
+    if not db_url:
+        sys.exit("DB_URL not set in .env")
+    engine = create_engine(db_url)
+    if "--migrate" in sys.argv:
+        migrate(engine, drop_old="--drop-old" in sys.argv)
+    elif "--status" in sys.argv:
+        status(engine)
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+async_copier.py -- Adaptive-concurrency SMB probe + copy engine
+================================================================
+asyncio front-end for bulk_to_bronze (COPY_ENGINE=async). File operations
+are still blocking calls (os.stat, shutil.copy2) offloaded to threads; what
+asyncio adds is scheduling:
+
+  - Pipelining: minute probes run ahead concurrently, and each file found is
+    queued for copy immediately instead of after the whole probe pass.
+  - AIMD concurrency: every operation is timed. While the median latency of
+    a window stays within LATENCY_TOLERANCE x the best median seen so far
+    (the share's unloaded latency), the limit grows by one; as soon as it
+    rises above -- requests queueing at the share -- or an operation fails,
+    the limit halves. The engine settles at the throughput knee instead of a
+    fixed 16 threads that under-use a fast share or saturate a slow one.
+
+The baseline creeps up slowly (BASELINE_DRIFT per window) so a share that
+has become permanently slower is re-learned instead of starving the engine.
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import asyncio
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+MIN_CONCURRENCY     = int(os.getenv("ASYNC_MIN_CONCURRENCY", "2"))
+MAX_CONCURRENCY     = int(os.getenv("ASYNC_MAX_CONCURRENCY", "64"))
+INITIAL_CONCURRENCY = int(os.getenv("ASYNC_INITIAL_CONCURRENCY", "8"))
+LATENCY_TOLERANCE   = float(os.getenv("ASYNC_LATENCY_TOLERANCE", "2.0"))
+WINDOW              = 16     # operations per AIMD decision
+BASELINE_DRIFT      = 1.02   # per window; lets the baseline follow a slower share
+
+
+class AimdLimiter:
+    """Concurrency limit driven by per-operation latency (additive
+    increase, multiplicative decrease)."""
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY,
+                 maximum=MAX_CONCURRENCY, tolerance=LATENCY_TOLERANCE):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baseline = None
+        self.peak = self.limit
+        self.ops = 0
+        self.errors = 0
+        self._window: list[float] = []
+        self._window_errors = 0
+        self._cond = asyncio.Condition()
+
+    def _adjust(self):
+        median = statistics.median(self._window)
+        self.baseline = median if self.baseline is None else min(self.baseline * BASELINE_DRIFT, median)
+        if self._window_errors or median > self.baseline * self.tolerance:
+            self.limit = max(self.minimum, self.limit // 2)
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+        self.peak = max(self.peak, self.limit)
+        self._window = []
+        self._window_errors = 0
+
+    async def run(self, fn, *args):
+        """Run blocking fn(*args) in a thread once a slot is free; time it
+        and feed the limiter. Exceptions propagate to the caller."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        t0 = time.monotonic()
+        failed = False
+        try:
+            return await asyncio.to_thread(fn, *args)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self.ops += 1
+                self.errors += failed
+                self._window_errors += failed
+                self._window.append(time.monotonic() - t0)
+                if len(self._window) >= WINDOW:
+                    self._adjust()
+                self._cond.notify_all()
+
+    def summary(self) -> str:
+        base = f"{self.baseline * 1000:.0f} ms" if self.baseline is not None else "n/a"
+        return (f"{self.ops:,} ops, concurrency {self.limit} (peak {self.peak}), "
+                f"baseline latency {base}, {self.errors} errors")
+
+
+def _use_engine_executor():
+    """to_thread() runs on the loop's default executor, capped at ~32
+    threads; size it to MAX_CONCURRENCY so the limiter -- not the pool --
+    decides how many operations hit the share."""
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=MAX_CONCURRENCY))
+
+
+async def _copy_one(limiter, copy_fn, pair):
+    try:
+        return pair, await limiter.run(copy_fn, *pair)
+    except Exception:
+        return pair, "error"
+
+
+async def _predict_and_copy(start_dt, probe_minute, copy_fn, max_empty):
+    _use_engine_executor()
+    limiter = AimdLimiter()
+    result = {"new_files": [], "seen": [], "already": [], "copied": [], "minutes": 0,
+              "probe_errors": 0, "first_probe_error": None}
+    copies = set()
+    probes = {}
+    last_hit = start_dt
+    failed_at = None   # earliest minute whose probe raised
+    next_dt = start_dt + timedelta(minutes=1)
+
+    while True:
+        # Keep the probe pipeline full up to the frontier: MAX_EMPTY minutes
+        # past the newest hit -- the sequential stop rule, evaluated on the
+        # fly as out-of-order probe results extend the frontier. Probing
+        # pauses while too many copies are queued (multi-day catch-up). A
+        # failed probe is "unknown", not "empty": nothing past it is
+        # probed, so an SMB outage can't pass for a run of empty minutes.
+        frontier = last_hit + timedelta(minutes=max_empty)
+        if failed_at is not None:
+            frontier = min(frontier, failed_at - timedelta(minutes=1))
+        while next_dt <= frontier and len(probes) < limiter.limit * 2 and len(copies) < limiter.limit * 4:
+            probes[asyncio.create_task(limiter.run(probe_minute, next_dt))] = next_dt
+            next_dt += timedelta(minutes=1)
+        if not probes and not (copies and next_dt <= frontier):
+            break
+        done, _ = await asyncio.wait(set(probes) | copies, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task in copies:
+                copies.discard(task)
+                result["copied"].append(task.result())
+                continue
+            dt = probes.pop(task)
+            result["minutes"] += 1
+            try:
+                found, pairs, seen, already = task.result()
+            except Exception as e:
+                result["probe_errors"] += 1
+                if failed_at is None or dt < failed_at:
+                    failed_at = dt
+                    result["first_probe_error"] = (dt, str(e))
+                continue
+            result["seen"].extend(seen)
+            result["already"].extend(already)
+            result["new_files"].extend(pairs)
+            if found and dt > last_hit:
+                last_hit = dt
+            if copy_fn is not None:
+                copies.update(asyncio.create_task(_copy_one(limiter, copy_fn, p)) for p in pairs)
+
+    result["copied"].extend(await asyncio.gather(*copies))
+    result["new_files"].sort(key=lambda pair: pair[0].name)
+    result["limiter"] = limiter.summary()
+    return result
+
+
+def predict_and_copy(start_dt, probe_minute, copy_fn=None, max_empty=10) -> dict:
+    """Probe minutes after `start_dt` concurrently and, if `copy_fn` is
+    given, copy every new file as soon as its minute is probed.
+
+    probe_minute(dt) -> (found, [(src, dst) to copy], [seen on SMB],
+    [already in bronze]); copy_fn(src, dst) -> "copied" | "error".
+    Returns a dict with new_files, seen, already, copied [(pair, result)],
+    minutes, probe_errors (+ first_probe_error: (minute, message)) and a
+    limiter summary. Probing stops before the first minute that failed."""
+    return asyncio.run(_predict_and_copy(start_dt, probe_minute, copy_fn, max_empty))
+
+
+async def _copy_all(pairs, copy_fn):
+    _use_engine_executor()
+    limiter = AimdLimiter()
+    copied, pending = [], set()
+    for pair in pairs:
+        # Bounded feed: a full catch-up can be hundreds of thousands of
+        # files; only ~2x the current limit are scheduled at any time.
+        while len(pending) >= limiter.limit * 2:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            copied.extend(t.result() for t in done)
+        pending.add(asyncio.create_task(_copy_one(limiter, copy_fn, pair)))
+    if pending:
+        done, _ = await asyncio.wait(pending)
+        copied.extend(t.result() for t in done)
+    return copied, limiter.summary()
+
+
+def copy_all(pairs, copy_fn):
+    """Copy (src, dst) pairs with adaptive concurrency. Returns
+    ([(pair, result)], limiter summary)."""
+    return asyncio.run(_copy_all(pairs, copy_fn))
@@ -0,0 +1,364 @@
+"""
+bronze_catalog.py -- Persistent index of the bronze sensor tree
+================================================================
+One row per apartment per minute, stored in a local SQLite file next to
+bronze (storage/bronze_catalog.sqlite):
+
+    apartment  minute (epoch minutes, UTC)  filename  state  silvered
+
+    state    raw     -- <file>.json in bronze (just copied)
+             gz      -- <file>.json.gz (compressed after silver)
+             zst     -- <file>.json.zst (BRONZE_CODEC=zstd / zstd+dict)
+             seg     -- member of the hourly HH.seg segment (bronze_segments.py)
+             deleted -- removed by DELETE_BRONZE=1 or cleanup_bronze.py
+    silvered 1 once flatten_sensors has committed the file to silver
+
+Writers:  bulk_to_bronze (raw on copy), flatten_sensors (silvered, gz or
+          deleted), cleanup_bronze (deleted).
+Readers:  flatten_sensors.find_new_files_fast(), count_bronze_files(),
+          get_newest_bronze_filename() in bulk_to_bronze and watcher.
+
+Discovery becomes an indexed query instead of an rglob over every
+apartment tree. The first open after an upgrade walks bronze once to
+bootstrap the index; `flatten_sensors.py --rescan` rebuilds it from disk
+at any time (e.g. after restoring bronze from a backup), and the nightly
+gap-repair run does so too. A write that fails (e.g. "database is locked")
+is logged and leaves a bronze_catalog.resync marker; the next open
+rebuilds from disk so the file isn't left out of silver.
+
+Set BRONZE_CATALOG=0 to disable and fall back to filesystem walks.
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+try:
+    from ingestion.fast_flow import bronze_codec, bronze_segments
+except ImportError:
+    import bronze_codec
+    import bronze_segments
+
+load_dotenv()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
+if not BRONZE_ROOT.is_absolute():
+    BRONZE_ROOT = PROJECT_ROOT / BRONZE_ROOT
+
+ENABLED      = os.getenv("BRONZE_CATALOG", "1") != "0"
+CATALOG_PATH = BRONZE_ROOT.parent / "bronze_catalog.sqlite"
+RESYNC_MARKER = BRONZE_ROOT.parent / "bronze_catalog.resync"
+
+APARTMENT_MAP = {"jimmyloup": "jimmy", "jeremievianin": "jeremie"}
+APARTMENTS    = ["jimmy", "jeremie"]
+STATES        = ("raw", "gz", "zst", "seg", "deleted")
+
+log = logging.getLogger("bronze_catalog")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS bronze_files (
+    apartment  TEXT    NOT NULL,
+    minute     INTEGER NOT NULL,
+    filename   TEXT    NOT NULL,
+    state      TEXT    NOT NULL CHECK (state IN ('raw', 'gz', 'zst', 'seg', 'deleted')),
+    silvered   INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT    NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%SZ', 'now')),
+    PRIMARY KEY (apartment, minute)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_bronze_files_filename ON bronze_files (filename);
+CREATE INDEX IF NOT EXISTS idx_bronze_files_pending
+    ON bronze_files (apartment, minute) WHERE silvered = 0 AND state != 'deleted';
+CREATE TABLE IF NOT EXISTS catalog_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+# -- KEYS ----------------------------------------------------------------------
+
+def canonical_name(name: str) -> str:
+    """'<file>.json.gz' / '.json.zst' -> '<file>.json' (same key as the
+    silver watermark)."""
+    return bronze_codec.strip_suffix(name)
+
+
+def parse_key(filename: str):
+    """'31.08.2023 2144_JimmyLoup_received.json[.gz]' -> ('jimmy', epoch_minute).
+    Returns None for names that aren't sensor files (e.g. weather CSVs)."""
+    lower = filename.lower()
+    apartment = next((v for k, v in APARTMENT_MAP.items() if k in lower), None)
+    if apartment is None:
+        return None
+    try:
+        dt = datetime.strptime(filename.split("_")[0].strip(), "%d.%m.%Y %H%M")
+    except ValueError:
+        return None
+    return apartment, int(dt.replace(tzinfo=timezone.utc).timestamp()) // 60
+
+
+def minute_to_dt(minute: int) -> datetime:
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc)
+
+
+def bronze_path(apartment: str, minute: int, filename: str, state: str) -> Path:
+    """Where a catalogued file lives on disk for its state (a member
+    address inside HH.seg for segmented files)."""
+    dt = minute_to_dt(minute)
+    if state == "seg":
+        return bronze_segments.member_path(bronze_segments.segment_path(apartment, dt), canonical_name(filename))
+    folder = BRONZE_ROOT / apartment / dt.strftime("%Y") / dt.strftime("%m") / dt.strftime("%d") / dt.strftime("%H")
+    name = canonical_name(filename)
+    return folder / (name + "." + state if state in ("gz", "zst") else name)
+
+
+# -- CONNECTION ----------------------------------------------------------------
+
+def connect() -> sqlite3.Connection:
+    """Open the catalog (WAL, so the watcher, bulk_to_bronze and
+    flatten_sensors can read and write concurrently)."""
+    CATALOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(CATALOG_PATH), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _migrate_states(conn)
+    conn.executescript(_DDL)
+    return conn
+
+
+def _migrate_states(conn):
+    """Catalogs created by an older version have a CHECK constraint missing
+    newer states ('zst', 'seg'). SQLite can't alter a CHECK, so copy the
+    table once."""
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'bronze_files'").fetchone()
+    if row is None or all(f"'{state}'" in row[0] for state in STATES):
+        return
+    conn.executescript("""
+        BEGIN IMMEDIATE;
+        ALTER TABLE bronze_files RENAME TO bronze_files_old;
+        DROP INDEX IF EXISTS idx_bronze_files_filename;
+        DROP INDEX IF EXISTS idx_bronze_files_pending;
+    """ + _DDL + """
+        INSERT INTO bronze_files SELECT * FROM bronze_files_old;
+        DROP TABLE bronze_files_old;
+        COMMIT;
+    """)
+
+
+def is_bootstrapped(conn) -> bool:
+    row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'bootstrapped_at'").fetchone()
+    return row is not None
+
+
+def rebuild_from_disk(conn, log=None) -> int:
+    """Walk bronze once and (re)record every sensor file with its on-disk
+    state. Keeps existing `silvered` flags; rows whose file is gone are
+    left alone (their state is still the best information we have)."""
+    n = 0
+    rows = []
+    for apt in APARTMENTS:
+        apt_root = BRONZE_ROOT / apt
+        if not apt_root.exists():
+            continue
+        for f in apt_root.rglob("*.json*"):
+            key = parse_key(f.name)
+            if key is None:
+                continue
+            state = bronze_codec.SUFFIX_STATES.get(f.suffix, "raw")
+            rows.append((key[0], key[1], canonical_name(f.name), state))
+            n += 1
+            if len(rows) >= 50_000:
+                _upsert_rows(conn, rows)
+                rows = []
+        for seg in apt_root.rglob("*" + bronze_segments.SEGMENT_SUFFIX):
+            for name in bronze_segments.members(seg):
+                key = parse_key(name)
+                if key is not None:
+                    rows.append((key[0], key[1], name, "seg"))
+                    n += 1
+    _upsert_rows(conn, rows)
+    conn.execute(
+        "INSERT INTO catalog_meta (key, value) VALUES ('bootstrapped_at', strftime('%Y-%m-%dT%H:%M:%SZ', 'now')) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+    )
+    conn.commit()
+    RESYNC_MARKER.unlink(missing_ok=True)
+    if log:
+        log.info(f"Bronze catalog: indexed {n:,} files from disk")
+    return n
+
+
+def open_catalog(log=None):
+    """Connect, bootstrapping from disk on first use. Returns None when the
+    catalog is disabled or unusable -- callers then fall back to walks."""
+    if not ENABLED:
+        return None
+    try:
+        conn = connect()
+        if not is_bootstrapped(conn):
+            if log:
+                log.info("Bronze catalog: first use -- indexing existing bronze files (one-time)")
+            rebuild_from_disk(conn, log)
+        elif RESYNC_MARKER.exists():
+            if log:
+                log.info("Bronze catalog: an earlier write failed -- re-indexing bronze files from disk")
+            rebuild_from_disk(conn, log)
+        return conn
+    except sqlite3.Error as e:
+        if log:
+            log.warning(f"Bronze catalog unavailable ({e}) -- falling back to filesystem scan")
+        return None
+
+
+# -- WRITES --------------------------------------------------------------------
+
+def _write_failed(what: str, n: int, e: Exception):
+    """Log a failed catalog write and flag the catalog for a rebuild on the
+    next open_catalog()."""
+    log.warning(f"Bronze catalog: {what} failed for {n:,} files ({e}) -- "
+                f"re-indexing from disk on next open")
+    try:
+        RESYNC_MARKER.parent.mkdir(parents=True, exist_ok=True)
+        RESYNC_MARKER.touch()
+    except OSError:
+        pass
+
+
+def _upsert_rows(conn, rows):
+    """rows: (apartment, minute, filename, state). Never clears `silvered`."""
+    if not rows:
+        return
+    conn.executemany(
+        """
+        INSERT INTO bronze_files (apartment, minute, filename, state)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (apartment, minute) DO UPDATE SET
+            filename   = excluded.filename,
+            state      = excluded.state,
+            updated_at = excluded.updated_at
+        """,
+        rows,
+    )
+
+
+def record(filenames, state: str):
+    """Record sensor files in `state`. Best-effort: the catalog is an index,
+    not the source of truth, so a failure here never fails the pipeline --
+    it is logged and the next open_catalog() resyncs from disk."""
+    if not ENABLED or not filenames:
+        return
+    assert state in STATES
+    rows = []
+    for name in filenames:
+        key = parse_key(name)
+        if key is not None:
+            rows.append((key[0], key[1], canonical_name(name), state))
+    if not rows:
+        return
+    try:
+        conn = connect()
+        try:
+            _upsert_rows(conn, rows)
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        _write_failed(f"record({state})", len(rows), e)
+
+
+def mark_silvered(filenames, conn=None):
+    """Flag files as committed to silver (removes them from pending())."""
+    if not ENABLED or not filenames:
+        return
+    keys = [k for k in (parse_key(n) for n in filenames) if k is not None]
+    if not keys:
+        return
+    try:
+        own = conn is None
+        conn = conn or connect()
+        try:
+            conn.executemany(
+                "UPDATE bronze_files SET silvered = 1 WHERE apartment = ? AND minute = ?", keys
+            )
+            conn.commit()
+        finally:
+            if own:
+                conn.close()
+    except sqlite3.Error as e:
+        _write_failed("mark_silvered", len(keys), e)
+
+
+def resync_silvered(conn, watermark) -> int:
+    """Clear `silvered` on rows whose filename is no longer in the silver
+    watermark (watermark truncated for a silver rebuild). Returns the
+    number of rows reset."""
+    stale = [
+        (apt, minute)
+        for apt, minute, name in conn.execute(
+            "SELECT apartment, minute, filename FROM bronze_files WHERE silvered = 1"
+        )
+        if name not in watermark
+    ]
+    conn.executemany(
+        "UPDATE bronze_files SET silvered = 0 WHERE apartment = ? AND minute = ?", stale
+    )
+    conn.commit()
+    return len(stale)
+
+
+# -- READS ---------------------------------------------------------------------
+
+def pending(conn, apartment: str):
+    """Files present in bronze (raw or gz) not yet flagged as silvered,
+    oldest first. Yields (path, filename)."""
+    for minute, filename, state in conn.execute(
+        "SELECT minute, filename, state FROM bronze_files "
+        "WHERE apartment = ? AND silvered = 0 AND state != 'deleted' ORDER BY minute",
+        (apartment,),
+    ):
+        yield bronze_path(apartment, minute, filename, state), filename
+
+
+def count(conn, apartment: str) -> int:
+    """Files currently on disk (raw + gz) for one apartment."""
+    return conn.execute(
+        "SELECT COUNT(*) FROM bronze_files WHERE apartment = ? AND state != 'deleted'",
+        (apartment,),
+    ).fetchone()[0]
+
+
+def silvered_count(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM bronze_files WHERE silvered = 1").fetchone()[0]
+
+
+def newest_filename(conn=None):
+    """Newest catalogued filename across apartments (any state -- a deleted
+    file was still copied, so prediction can resume after it)."""
+    own = conn is None
+    try:
+        conn = conn or connect()
+        try:
+            # One PK range probe per apartment instead of a sort over all rows
+            rows = [
+                conn.execute(
+                    "SELECT minute, filename FROM bronze_files WHERE apartment = ? "
+                    "ORDER BY minute DESC LIMIT 1",
+                    (apt,),
+                ).fetchone()
+                for apt in APARTMENTS
+            ]
+        finally:
+            if own:
+                conn.close()
+    except sqlite3.Error:
+        return None
+    rows = [r for r in rows if r is not None]
+    return max(rows)[1] if rows else None
@@ -0,0 +1,286 @@
+"""
+bronze_codec.py -- Pluggable compression for bronze files
+==========================================================
+BRONZE_CODEC picks how bronze is compressed after silver (and how segment
+members are written):
+
+    gzip       -- level 6, the historical default (.gz)
+    zstd       -- Zstandard, no dictionary (.zst)
+    zstd+dict  -- Zstandard with a dictionary trained on our own sensor
+                  JSON (.zst). Minute payloads are ~6 KB and structurally
+                  identical, so the dictionary carries the shared keys and
+                  the per-file ratio roughly doubles vs gzip, while
+                  decompression -- the bottleneck of a silver replay -- is
+                  several times faster.
+
+Reading never depends on the current setting: decompress() sniffs the
+magic bytes and a zstd frame names its dictionary ID, so gzip, zstd and
+every dictionary version can sit side by side in the same tree.
+
+Dictionaries are versioned next to bronze and must never be deleted while
+files compressed with them exist:
+
+    storage/bronze/_dictionaries/sensor-v001.zdict
+    storage/bronze/_dictionaries/sensor-v002.zdict   <- newest = used to write
+
+zstandard is optional (pip install zstandard). Without it the zstd codecs
+fall back to gzip with a warning; reading a .zst then raises a clear error.
+
+Usage:
+    python ingestion/fast_flow/bronze_codec.py --train [--samples 2000] [--size 112640]
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import gzip
+import io
+import logging
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
+if not BRONZE_ROOT.is_absolute():
+    BRONZE_ROOT = PROJECT_ROOT / BRONZE_ROOT
+
+BRONZE_CODEC = os.getenv("BRONZE_CODEC", "gzip").lower()
+ZSTD_LEVEL   = int(os.getenv("BRONZE_ZSTD_LEVEL", "9"))
+GZIP_LEVEL   = 6
+DICT_DIR     = BRONZE_ROOT / "_dictionaries"
+DICT_PREFIX  = "sensor-v"
+DICT_SUFFIX  = ".zdict"
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Compressed suffix -> catalog state
+SUFFIX_STATES = {".gz": "gz", ".zst": "zst"}
+
+log = logging.getLogger("bronze_codec")
+
+
+# -- NAMES ---------------------------------------------------------------------
+
+def strip_suffix(name: str) -> str:
+    """'<file>.json.gz' / '<file>.json.zst' -> '<file>.json'."""
+    for suffix in SUFFIX_STATES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_compressed(path: Path) -> bool:
+    return Path(path).suffix in SUFFIX_STATES
+
+
+# -- DICTIONARIES --------------------------------------------------------------
+
+_DICTS = None  # {dict_id: ZstdCompressionDict}, newest last
+
+
+def _dict_files() -> list[Path]:
+    if not DICT_DIR.exists():
+        return []
+    return sorted(DICT_DIR.glob(f"{DICT_PREFIX}*{DICT_SUFFIX}"))
+
+
+def _load_dicts() -> dict:
+    global _DICTS
+    if _DICTS is None:
+        _DICTS = {}
+        if zstandard is not None:
+            for path in _dict_files():
+                d = zstandard.ZstdCompressionDict(path.read_bytes())
+                _DICTS[d.dict_id()] = d
+    return _DICTS
+
+
+def current_dict():
+    """Newest dictionary version, or None if none has been trained."""
+    dicts = _load_dicts()
+    return list(dicts.values())[-1] if dicts else None
+
+
+# -- CODEC ---------------------------------------------------------------------
+
+_warned = False
+
+
+def active_codec() -> str:
+    """The codec actually used for writing (after optional-dependency and
+    missing-dictionary fallbacks)."""
+    global _warned
+    codec = BRONZE_CODEC
+    if codec.startswith("zstd") and zstandard is None:
+        if not _warned:
+            log.warning("BRONZE_CODEC=%s but zstandard is not installed -- using gzip", codec)
+            _warned = True
+        return "gzip"
+    if codec == "zstd+dict" and current_dict() is None:
+        if not _warned:
+            log.warning("BRONZE_CODEC=zstd+dict but no dictionary in %s -- using plain zstd "
+                        "(run bronze_codec.py --train)", DICT_DIR)
+            _warned = True
+        return "zstd"
+    return codec if codec in ("zstd", "zstd+dict") else "gzip"
+
+
+def suffix() -> str:
+    return ".gz" if active_codec() == "gzip" else ".zst"
+
+
+# zstandard (de)compressor objects must not be shared between threads
+# (flatten_sensors compresses bronze from a thread pool), so each thread
+# keeps its own.
+_LOCAL = threading.local()
+
+
+def _compressor(use_dict: bool):
+    cache = _LOCAL.__dict__.setdefault("compressors", {})
+    if use_dict not in cache:
+        d = current_dict() if use_dict else None
+        cache[use_dict] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=d, write_content_size=True)
+    return cache[use_dict]
+
+
+def compress(data: bytes, use_dict: bool = True) -> bytes:
+    """Compress with the active codec. use_dict=False for non-sensor
+    payloads (weather CSVs) that the sensor dictionary would only hurt."""
+    codec = active_codec()
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return _compressor(use_dict and codec == "zstd+dict").compress(data)
+
+
+def _decompressor(dict_id: int):
+    cache = _LOCAL.__dict__.setdefault("decompressors", {})
+    if dict_id not in cache:
+        d = None
+        if dict_id:
+            d = _load_dicts().get(dict_id)
+            if d is None:
+                raise FileNotFoundError(f"zstd dictionary {dict_id} not found in {DICT_DIR}")
+        cache[dict_id] = zstandard.ZstdDecompressor(dict_data=d)
+    return cache[dict_id]
+
+
+def decompress(data: bytes) -> bytes:
+    """Decode gzip, zstd or zstd+dict by sniffing the frame magic. Plain
+    bytes (an uncompressed .json) are returned unchanged."""
+    if data[:2] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    if data[:4] == ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError("bronze file is zstd-compressed but zstandard is not installed")
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        return _decompressor(dict_id).decompress(data)
+    return data
+
+
+def open_text(path: Path):
+    """Text stream over a bronze file in any codec (or uncompressed)."""
+    return io.StringIO(decompress(Path(path).read_bytes()).decode("utf-8"))
+
+
+def compress_file(src: Path, use_dict: bool = True) -> Path:
+    """Compress `src` in place with the active codec (file.json ->
+    file.json.gz|.zst, original removed). Returns the new path."""
+    codec = active_codec()
+    dst = src.with_name(src.name + suffix())
+    if codec == "gzip":
+        with src.open("rb") as f_in, gzip.open(dst, "wb", compresslevel=GZIP_LEVEL) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    else:
+        dst.write_bytes(compress(src.read_bytes(), use_dict))
+    src.unlink()
+    return dst
+
+
+# -- TRAINING ------------------------------------------------------------------
+
+def _sample_payloads(n: int) -> list[bytes]:
+    """Up to n decompressed sensor payloads, sampled across the whole tree
+    (files of every codec and segment members)."""
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+    from ingestion.fast_flow import bronze_catalog, bronze_segments
+
+    paths = []
+    for apt in bronze_catalog.APARTMENTS:
+        apt_root = BRONZE_ROOT / apt
+        if not apt_root.exists():
+            continue
+        paths.extend(apt_root.rglob("*.json*"))
+        for seg in apt_root.rglob("*" + bronze_segments.SEGMENT_SUFFIX):
+            paths.extend(bronze_segments.member_path(seg, m) for m in bronze_segments.members(seg))
+    random.shuffle(paths)
+
+    samples = []
+    for p in paths[:n]:
+        try:
+            if bronze_segments.is_member(p):
+                samples.append(bronze_segments.read_member(p))
+            else:
+                samples.append(decompress(p.read_bytes()))
+        except Exception:
+            continue
+    return samples
+
+
+def train(n_samples: int = 2000, dict_size: int = 112_640) -> Path:
+    """Train a new dictionary version from existing bronze and report the
+    ratio vs gzip on a held-out slice. Returns the dictionary path."""
+    if zstandard is None:
+        raise RuntimeError("zstandard is not installed (pip install zstandard)")
+    samples = _sample_payloads(n_samples)
+    if len(samples) < 100:
+        raise RuntimeError(f"need at least 100 bronze files to train, found {len(samples)}")
+
+    holdout, training = samples[: len(samples) // 10], samples[len(samples) // 10:]
+    t0 = time.monotonic()
+    d = zstandard.train_dictionary(dict_size, training, level=ZSTD_LEVEL)
+
+    existing = _dict_files()
+    version = int(existing[-1].stem[len(DICT_PREFIX):]) + 1 if existing else 1
+    DICT_DIR.mkdir(parents=True, exist_ok=True)
+    path = DICT_DIR / f"{DICT_PREFIX}{version:03d}{DICT_SUFFIX}"
+    path.write_bytes(d.as_bytes())
+
+    raw = sum(len(s) for s in holdout)
+    gz = sum(len(gzip.compress(s, compresslevel=GZIP_LEVEL)) for s in holdout)
+    zs = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    zd = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=d)
+    plain = sum(len(zs.compress(s)) for s in holdout)
+    dicted = sum(len(zd.compress(s)) for s in holdout)
+    print(f"Trained {path.name} (dict id {d.dict_id()}) on {len(training):,} files in {time.monotonic() - t0:.1f}s")
+    print(f"Held-out ratio ({len(holdout)} files): gzip {raw / gz:.1f}x  zstd {raw / plain:.1f}x  "
+          f"zstd+dict {raw / dicted:.1f}x")
+    return path
+
+
+def _arg(flag: str, default: int) -> int:
+    if flag in sys.argv:
+        return int(sys.argv[sys.argv.index(flag) + 1])
+    return default
+
+
+if __name__ == "__main__":
+    if "--train" not in sys.argv:
+        print(__doc__)
+    else:
+        train(_arg("--samples", 2000), _arg("--size", 112_640))
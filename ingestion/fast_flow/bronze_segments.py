@@ -0,0 +1,306 @@
+"""
+bronze_segments.py -- Packed hourly bronze segments
+====================================================
+Instead of one ~6 KB JSON (later one .json.gz) per apartment per minute,
+BRONZE_FORMAT=segments stores each apartment-hour as two files next to the
+day folder:
+
+    bronze/<apt>/YYYY/MM/DD/HH.seg   concatenated compressed frames, one per minute
+    bronze/<apt>/YYYY/MM/DD/HH.idx   "<filename>\\t<offset>\\t<length>" per member
+
+Frames use BRONZE_CODEC (bronze_codec.py). With gzip a .seg is itself a
+valid gzip stream (`gzip -dc HH.seg` prints every JSON back to back); with
+zstd, `zstd -dc [-D dict]` does the same. Any single minute is one seek +
+read via the index.
+Replays, backups and status walks touch ~720 files per apartment-month
+instead of ~43 000.
+
+Append-only and crash-safe: members are written and fsync'd before their
+index lines, and bytes past the last indexed member (a torn append) are
+truncated on the next append. Readers only trust what the index lists.
+
+A member is addressed as a path *inside* its segment --
+`.../DD/HH.seg/<filename>` -- so `path.name` is still the bronze filename
+(watermark key) and flatten_sensors.open_bronze() can tell the two layouts
+apart from the path alone.
+
+Convert an existing per-file bronze tree:
+    python ingestion/fast_flow/bronze_segments.py --pack [--dry-run]
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import io
+import os
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+try:
+    from ingestion.fast_flow import bronze_codec
+except ImportError:
+    import bronze_codec
+
+load_dotenv()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
+if not BRONZE_ROOT.is_absolute():
+    BRONZE_ROOT = PROJECT_ROOT / BRONZE_ROOT
+
+# files    -- one .json per minute, gzipped in place after silver (default)
+# segments -- hourly .seg/.idx pairs written directly by bulk_to_bronze
+BRONZE_FORMAT = os.getenv("BRONZE_FORMAT", "files").lower()
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX   = ".idx"
+LOCK_SUFFIX    = ".lock"
+LOCK_STALE_SECS = 120
+
+
+# -- PATHS ---------------------------------------------------------------------
+
+def enabled() -> bool:
+    return BRONZE_FORMAT == "segments"
+
+
+def segment_path(apartment: str, dt) -> Path:
+    """bronze/<apt>/YYYY/MM/DD/HH.seg for a timestamp."""
+    return (BRONZE_ROOT / apartment / dt.strftime("%Y") / dt.strftime("%m")
+            / dt.strftime("%d") / (dt.strftime("%H") + SEGMENT_SUFFIX))
+
+
+def segment_for_folder(hour_folder: Path) -> Path:
+    """.../DD/HH (per-file layout) -> .../DD/HH.seg."""
+    return hour_folder.with_name(hour_folder.name + SEGMENT_SUFFIX)
+
+
+def index_path(seg: Path) -> Path:
+    return seg.with_suffix(INDEX_SUFFIX)
+
+
+def member_path(seg: Path, filename: str) -> Path:
+    return seg / filename
+
+
+def is_member(path: Path) -> bool:
+    """True for a `.../HH.seg/<filename>` member address."""
+    return Path(path).parent.suffix == SEGMENT_SUFFIX
+
+
+# -- INDEX ---------------------------------------------------------------------
+
+# Per-process cache: seg -> ((idx size, idx mtime_ns), {name: (offset, length)})
+_INDEX_CACHE: dict = {}
+
+
+def _parse_index(data: bytes, seg_size: int) -> dict:
+    """Index bytes -> {filename: (offset, length)}. A trailing partial line
+    or an entry pointing past the end of the segment (crash between the two
+    writes) is ignored."""
+    entries = {}
+    end = data.rfind(b"\n") + 1
+    for line in data[:end].decode("utf-8", errors="replace").splitlines():
+        try:
+            name, offset, length = line.split("\t")
+            offset, length = int(offset), int(length)
+        except ValueError:
+            continue
+        if offset + length <= seg_size:
+            entries[name] = (offset, length)
+    return entries
+
+
+def read_index(seg: Path) -> dict:
+    """{filename: (offset, length)} for a segment ({} if it doesn't exist)."""
+    idx = index_path(seg)
+    try:
+        st = idx.stat()
+        seg_size = seg.stat().st_size
+    except OSError:
+        _INDEX_CACHE.pop(seg, None)
+        return {}
+    key = (st.st_size, st.st_mtime_ns, seg_size)
+    cached = _INDEX_CACHE.get(seg)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    entries = _parse_index(idx.read_bytes(), seg_size)
+    _INDEX_CACHE[seg] = (key, entries)
+    return entries
+
+
+def members(seg: Path) -> list[str]:
+    """Filenames stored in a segment, in append order."""
+    index = read_index(seg)
+    return sorted(index, key=lambda n: index[n][0])
+
+
+def contains(seg: Path, filename: str) -> bool:
+    return filename in read_index(seg)
+
+
+# -- WRITE ---------------------------------------------------------------------
+
+class _SegmentLock:
+    """Cross-process lock for one segment: an O_EXCL lock file (works on
+    Windows shares too, unlike fcntl). A lock older than LOCK_STALE_SECS is
+    assumed to belong to a crashed writer and taken over."""
+
+    def __init__(self, seg: Path):
+        self.path = seg.with_suffix(SEGMENT_SUFFIX + LOCK_SUFFIX)
+
+    def __enter__(self):
+        while True:
+            try:
+                os.close(os.open(str(self.path), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - self.path.stat().st_mtime > LOCK_STALE_SECS:
+                        self.path.unlink(missing_ok=True)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        self.path.unlink(missing_ok=True)
+
+
+def append(seg: Path, items) -> list[str]:
+    """Append (filename, raw_bytes) pairs to a segment. Names already in
+    the index are skipped. Returns the filenames actually written."""
+    seg.parent.mkdir(parents=True, exist_ok=True)
+    with _SegmentLock(seg):
+        index = read_index(seg) if seg.exists() else {}
+        committed = max((o + n for o, n in index.values()), default=0)
+        written, lines = [], []
+        with open(seg, "ab") as f:
+            f.truncate(committed)  # drop a torn tail from a crashed append
+            f.seek(committed)
+            offset = committed
+            for name, data in items:
+                if name in index or name in written:
+                    continue
+                member = bronze_codec.compress(data)
+                f.write(member)
+                lines.append(f"{name}\t{offset}\t{len(member)}\n")
+                written.append(name)
+                offset += len(member)
+            f.flush()
+            os.fsync(f.fileno())
+        if lines:
+            with open(index_path(seg), "a", encoding="utf-8", newline="\n") as f:
+                f.write("".join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+    return written
+
+
+# -- READ ----------------------------------------------------------------------
+
+# The segment last read in full. Consecutive members of one hour (the normal
+# case: tasks are ordered by minute) are then served from memory -- one
+# sequential read per segment instead of one open+seek per minute.
+_LAST_SEGMENT = (None, None, b"")
+
+
+def _segment_bytes(seg: Path) -> bytes:
+    global _LAST_SEGMENT
+    st = seg.stat()
+    key = (st.st_size, st.st_mtime_ns)
+    if _LAST_SEGMENT[0] == seg and _LAST_SEGMENT[1] == key:
+        return _LAST_SEGMENT[2]
+    data = seg.read_bytes()
+    _LAST_SEGMENT = (seg, key, data)
+    return data
+
+
+def read_member(path: Path) -> bytes:
+    """Raw JSON bytes of a `.../HH.seg/<filename>` member."""
+    path = Path(path)
+    seg, name = path.parent, path.name
+    entry = read_index(seg).get(name)
+    if entry is None:
+        raise FileNotFoundError(f"{name} not in segment {seg}")
+    offset, length = entry
+    return bronze_codec.decompress(_segment_bytes(seg)[offset:offset + length])
+
+
+def open_member(path: Path):
+    """Text stream over one member (same contract as open() on a .json)."""
+    return io.StringIO(read_member(path).decode("utf-8"))
+
+
+def iter_segment(seg: Path):
+    """Yield (filename, raw_bytes) for every indexed member, in order."""
+    data = _segment_bytes(seg)
+    for name, (offset, length) in sorted(read_index(seg).items(), key=lambda kv: kv[1][0]):
+        yield name, bronze_codec.decompress(data[offset:offset + length])
+
+
+def delete_segment(seg: Path):
+    _INDEX_CACHE.pop(seg, None)
+    seg.unlink(missing_ok=True)
+    index_path(seg).unlink(missing_ok=True)
+
+
+# -- PACK (per-file tree -> segments) ------------------------------------------
+
+def pack_hour_folder(folder: Path, dry_run: bool = False) -> list[str]:
+    """Fold every .json / .json.gz of an hour folder into its segment, then
+    remove the originals and the (now empty) folder. Returns canonical
+    filenames packed."""
+    files = sorted(folder.glob("*.json*"))
+    items = []
+    for f in files:
+        items.append((bronze_codec.strip_suffix(f.name), bronze_codec.decompress(f.read_bytes())))
+    if dry_run or not items:
+        return [n for n, _ in items]
+
+    seg = segment_for_folder(folder)
+    append(seg, items)
+    stored = read_index(seg)
+    for f in files:
+        if bronze_codec.strip_suffix(f.name) in stored:
+            f.unlink()
+    try:
+        folder.rmdir()
+    except OSError:
+        pass
+    return [n for n, _ in items]
+
+
+def main():
+    """--pack: convert every hour folder under bronze/<apt>/ to a segment."""
+    if "--pack" not in sys.argv:
+        print(__doc__)
+        return
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+    from ingestion.fast_flow import bronze_catalog
+
+    dry_run = "--dry-run" in sys.argv
+    t0 = time.monotonic()
+    total = folders = 0
+    for apt in bronze_catalog.APARTMENTS:
+        apt_root = BRONZE_ROOT / apt
+        if not apt_root.exists():
+            continue
+        for folder in sorted(apt_root.glob("*/*/*/*")):
+            if not folder.is_dir():
+                continue
+            names = pack_hour_folder(folder, dry_run)
+            if names and not dry_run:
+                bronze_catalog.record(names, "seg")
+            total += len(names)
+            folders += bool(names)
+    label = "would pack" if dry_run else "packed"
+    print(f"{label} {total:,} files from {folders:,} hour folders in {time.monotonic() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,32 @@ don't exist (= caught up).
 
 Full mode (--full): scans everything for first run or gaps.
 
+Gap mode (--gaps): asks the minute-coverage bitmap (coverage.py) which
+minutes of the last GAP_DAYS days are in neither bronze nor silver and
+probes exactly those names with .exists() -- no share listing.
+
 Resume-capable -- skips files already in Bronze.
 Source files NEVER touched.
 
+BRONZE_FORMAT=segments appends each minute to its hourly HH.seg segment
+(bronze_segments.py) instead of writing one file per minute.
+
+Streaming (--stream / STREAM_SILVER=1): each file is read from the share
+once and teed into bronze (already in its final compressed form) and into
+the silver COPY, watermark in the same transaction -- no re-read from
+bronze, no second read to compress it. Anything the stream can't commit
+stays in bronze unsilvered and flatten_sensors picks it up as usual.
+
+COPY_ENGINE=async (or --async) replaces the fixed 16-thread pool with
+async_copier.py: concurrent, pipelined probes and copies whose concurrency
+adapts to the share's latency (AIMD).
+
 Usage:
-  python ingestion/fast_flow/bulk_to_bronze.py         # fast prediction
+  python ingestion/fast_flow/bulk_to_bronze.py          # fast prediction
   python ingestion/fast_flow/bulk_to_bronze.py --full   # full scan
+  python ingestion/fast_flow/bulk_to_bronze.py --gaps   # targeted gap repair
+  python ingestion/fast_flow/bulk_to_bronze.py --stream # also write silver
+  python ingestion/fast_flow/bulk_to_bronze.py --async  # adaptive asyncio engine
 
 Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
 """
@@ -32,28 +52,34 @@ from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 
+try:
+    from ingestion.fast_flow import async_copier, bronze_catalog, bronze_codec, bronze_segments, coverage, skip_list
+except ImportError:
+    import async_copier
+    import bronze_catalog
+    import bronze_codec
+    import bronze_segments
+    import coverage
+    import skip_list
+
 SMB_PATH    = Path(os.getenv("SMB_PATH",    r"Z:\\"))
 BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
 WORKERS     = 16
 
-# Files in this log were already imported to silver and intentionally deleted
-# from bronze (by scripts/cleanup_bronze.py). Skip them on every scan so the
-# nightly full-scan doesn't re-copy them from SMB.
-PROCESSED_LOG = BRONZE_ROOT.parent / "processed.log"
+# Files already imported to silver and intentionally deleted from bronze (by
+# scripts/cleanup_bronze.py or DELETE_BRONZE_ON_SILVER). Skipped on every scan
+# so the nightly full-scan doesn't re-copy them from SMB. See skip_list.py.
+PROCESSED = skip_list.SkipList()
 
 
-def load_processed_filenames():
-    """Load the set of bronze filenames already processed + cleaned up."""
-    if not PROCESSED_LOG.exists():
-        return set()
+def refresh_processed():
+    """Fold skip-list entries added since the last read into PROCESSED. Lets
+    a long-lived caller (watcher --daemon) keep it warm without reloading
+    every minute."""
     try:
-        with PROCESSED_LOG.open(encoding="utf-8") as f:
-            return {line.strip() for line in f if line.strip()}
+        PROCESSED.refresh()
     except Exception:
-        return set()
-
-
-PROCESSED = load_processed_filenames()
+        pass
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%H:%M:%S")
@@ -65,6 +91,17 @@ APARTMENT_MAP = {"jimmyloup": "jimmy", "jeremievianin": "jeremie"}
 APARTMENTS_SMB = ["JimmyLoup", "JeremieVianin"]
 MAX_EMPTY_MINUTES = 10  # stop after this many consecutive minutes with no files
 
+# Gap repair window and grace period: minutes younger than GAP_GRACE_MIN are
+# left to the normal predictive flow (the file may simply not be there yet).
+GAP_DAYS      = int(os.getenv("GAP_DAYS", "7"))
+GAP_GRACE_MIN = int(os.getenv("GAP_GRACE_MIN", "60"))
+
+STREAM_SILVER = os.getenv("STREAM_SILVER", "0") == "1"
+
+# threads -- fixed ThreadPoolExecutor(WORKERS) copy, sequential probes (default)
+# async   -- async_copier: pipelined probes + copies, AIMD concurrency
+COPY_ENGINE = "async" if "--async" in sys.argv else os.getenv("COPY_ENGINE", "threads").lower()
+
 
 def identify_apartment(filename):
     lower = filename.lower()
@@ -83,17 +120,23 @@ def parse_filename_timestamp(filename):
 
 
 def bronze_dest(apartment, ts, filename):
+    """Destination in bronze: the hour folder, or -- in segment mode -- the
+    member address inside the hour's segment (.../DD/HH.seg/<filename>)."""
     folder = BRONZE_ROOT / apartment / ts.strftime("%Y") / ts.strftime("%m") / ts.strftime("%d") / ts.strftime("%H")
+    if bronze_segments.enabled():
+        return bronze_segments.member_path(bronze_segments.segment_for_folder(folder), filename)
     folder.mkdir(parents=True, exist_ok=True)
     return folder / filename
 
 
 def bronze_already_present(apartment, ts, filename):
-    """True if either the raw .json or its compressed .json.gz exists in
-    bronze for this filename. Used to avoid re-copying files we already
-    have (in either form)."""
+    """True if the raw .json, a compressed .json.gz / .json.zst or a segment
+    member exists in bronze for this filename. Used to avoid re-copying
+    files we already have (in any form)."""
     folder = BRONZE_ROOT / apartment / ts.strftime("%Y") / ts.strftime("%m") / ts.strftime("%d") / ts.strftime("%H")
-    return (folder / filename).exists() or (folder / (filename + ".gz")).exists()
+    return ((folder / filename).exists()
+            or any((folder / (filename + sfx)).exists() for sfx in bronze_codec.SUFFIX_STATES)
+            or bronze_segments.contains(bronze_segments.segment_for_folder(folder), filename))
 
 
 def copy_file(src, dst):
@@ -106,8 +149,153 @@ def copy_file(src, dst):
         return "error"
 
 
+def copy_to_segment(seg, srcs):
+    """Read SMB files and append them to one hourly segment. Returns
+    (copied filenames, error count)."""
+    items, errors = [], 0
+    for src in srcs:
+        try:
+            items.append((src.name, src.read_bytes()))
+        except Exception as e:
+            log.error(f"Read failed -- {src.name}: {e}")
+            errors += 1
+    try:
+        return bronze_segments.append(seg, items), errors
+    except Exception as e:
+        log.error(f"Segment append failed -- {seg}: {e}")
+        return [], errors + len(items)
+
+
+# -- STREAMING (SMB -> bronze + silver) ----------------------------------------
+
+def _load_flatten():
+    """Import flatten_sensors lazily: only the streaming path needs the
+    database stack."""
+    project_root = Path(__file__).resolve().parent.parent.parent
+    if str(project_root) not in sys.path:
+        sys.path.insert(0, str(project_root))
+    from etl.bronze_to_silver import flatten_sensors
+    return flatten_sensors
+
+
+def _read_source(src):
+    try:
+        return src.read_bytes()
+    except Exception as e:
+        log.error(f"Read failed -- {src.name}: {e}")
+        return None
+
+
+def write_bronze_bytes(dst, data, compressed):
+    """Write a file's bytes to bronze in the form flatten_sensors would
+    leave it in after silver: compressed with the bronze codec, or raw
+    (KEEP_BRONZE / DELETE_BRONZE). Written to a .part file and renamed into
+    place, so a crash never leaves a truncated file that looks complete.
+    Returns the path written."""
+    if compressed:
+        dst = dst.with_name(dst.name + bronze_codec.suffix())
+        data = bronze_codec.compress(data)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    # No ".json" in the temp name: bronze walks (*.json*) never pick up a leftover.
+    tmp = dst.with_name(dst.name.partition(".json")[0] + ".part")
+    tmp.write_bytes(data)
+    os.replace(tmp, dst)
+    return dst
+
+
+def _stream_chunk(flatten_sensors, engine, executor, chunk, compressed):
+    """stream_files() for one chunk of at most BATCH_SIZE files: read,
+    write bronze, upsert silver. Returns (copied names, errors, silvered)."""
+    blobs = list(executor.map(_read_source, [src for src, _ in chunk]))
+    errors = sum(1 for b in blobs if b is None)
+    read = [(src, dst, data) for (src, dst), data in zip(chunk, blobs) if data is not None]
+
+    # (a) bronze -- first, so a failed silver commit loses nothing
+    copied_names, bronze_paths = [], {}
+    if bronze_segments.enabled():
+        by_segment = {}
+        for src, dst, data in read:
+            by_segment.setdefault(dst.parent, []).append((src.name, data))
+        for seg, items in by_segment.items():
+            try:
+                names = bronze_segments.append(seg, items)
+            except Exception as e:
+                log.error(f"Segment append failed -- {seg}: {e}")
+                errors += len(items)
+                continue
+            copied_names.extend(names)
+            bronze_paths.update((n, str(bronze_segments.member_path(seg, n))) for n in names)
+        state = "seg"
+    else:
+        for src, dst, data in read:
+            try:
+                bronze_paths[src.name] = str(write_bronze_bytes(dst, data, compressed))
+                copied_names.append(src.name)
+            except Exception as e:
+                log.error(f"Bronze write failed -- {src.name}: {e}")
+                errors += 1
+        state = bronze_codec.SUFFIX_STATES[bronze_codec.suffix()] if compressed else "raw"
+    bronze_catalog.record(copied_names, state)
+    coverage.mark("smb", copied_names)
+    coverage.mark("bronze", copied_names)
+
+    # (b) silver -- same bytes, no re-read; rows + watermark in one transaction
+    in_bronze = set(copied_names)
+    items = [(src.name, identify_apartment(src.name), data) for src, _, data in read if src.name in in_bronze]
+    if not items:
+        return copied_names, errors, 0
+    result = flatten_sensors.process_payloads(items)
+    try:
+        flatten_sensors.upsert(engine, result["rows"], result["processed"], digests=result["digests"])
+    except Exception as e:
+        log.warning(f"Silver stream failed ({e}) -- {len(result['processed'])} files left for flatten_sensors")
+        return copied_names, errors, 0
+    bronze_catalog.mark_silvered(result["processed"])
+    coverage.mark("silver", result["processed"])
+    if flatten_sensors.DELETE_BRONZE_ON_SILVER:
+        flatten_sensors.delete_bronze_files([bronze_paths[n] for n in result["processed"]], result["processed"])
+    elif compressed or bronze_segments.enabled():
+        flatten_sensors._append_processed_log(result["processed"])
+    return copied_names, errors, len(result["processed"])
+
+
+def stream_files(new_files):
+    """Read each (src, dst) from SMB once, write bronze, then parse and
+    upsert the same bytes into silver -- BATCH_SIZE files at a time, so
+    memory stays bounded and silver fills in as the run goes. Returns
+    (copied names, errors, files committed to silver)."""
+    flatten_sensors = _load_flatten()
+    if not flatten_sensors.DB_URL:
+        raise EnvironmentError("DB_URL not set in .env (required by --stream)")
+    compressed = flatten_sensors.COMPRESS_BRONZE_ON_SILVER
+    engine = flatten_sensors.get_engine()
+    flatten_sensors.sensor_watermark.ensure_schema(engine)  # digests table on older installs
+
+    copied_names, errors, silvered = [], 0, 0
+    step = flatten_sensors.BATCH_SIZE
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        for i in range(0, len(new_files), step):
+            names, n_err, n_silver = _stream_chunk(
+                flatten_sensors, engine, executor, new_files[i:i + step], compressed)
+            copied_names.extend(names)
+            errors += n_err
+            silvered += n_silver
+    return copied_names, errors, silvered
+
+
 def get_newest_bronze_filename():
-    """Find the newest filename in Bronze by checking newest folders."""
+    """Find the newest filename in Bronze. Asks the bronze catalog first
+    (one index probe per apartment); walks the newest folders only if the
+    catalog is disabled or empty."""
+    catalog = bronze_catalog.open_catalog(log)
+    if catalog is not None:
+        try:
+            newest = bronze_catalog.newest_filename(catalog)
+        finally:
+            catalog.close()
+        if newest:
+            return newest
+
     newest = None
     for apt in ["jimmy", "jeremie"]:
         apt_path = BRONZE_ROOT / apt
@@ -115,19 +303,68 @@ def get_newest_bronze_filename():
             continue
         hour_folders = sorted(apt_path.glob("*/*/*/*"), reverse=True)
         for folder in hour_folders:
-            if not folder.is_dir():
+            if folder.suffix == bronze_segments.SEGMENT_SUFFIX:
+                names = sorted(bronze_segments.members(folder), reverse=True)
+            elif folder.is_dir():
+                # Match both raw .json and compressed .json.gz so the "newest"
+                # check survives compress-after-silver runs.
+                names = [f.name for f in sorted(folder.glob("*.json*"), reverse=True)]
+            else:
                 continue
-            # Match both raw .json and compressed .json.gz so the "newest"
-            # check survives compress-after-silver runs.
-            files = sorted(folder.glob("*.json*"), reverse=True)
-            if files:
-                name = files[0].name
+            if names:
+                name = names[0]
                 if newest is None or name > newest:
                     newest = name
                 break
     return newest
 
 
+def probe_minute(current_dt):
+    """Probe SMB for every apartment's file of one minute. Returns
+    (found_any, [(src, dst) to copy], [seen on SMB], [already in bronze])."""
+    found_this_minute = False
+    new_files, seen, already = [], [], []
+    for apt_smb in APARTMENTS_SMB:
+        filename = f"{current_dt.strftime('%d.%m.%Y %H%M')}_{apt_smb}_received.json"
+        smb_file = SMB_PATH / filename
+
+        if smb_file.exists():
+            seen.append(filename)
+            apt_local = identify_apartment(filename)
+            if apt_local:
+                # Skip if this file was already imported + cleaned up.
+                if filename in PROCESSED:
+                    found_this_minute = True
+                    continue
+                dst = bronze_dest(apt_local, current_dt, filename)
+                # Check both raw and compressed (.json + .json.gz)
+                if not bronze_already_present(apt_local, current_dt, filename):
+                    new_files.append((smb_file, dst))
+                else:
+                    already.append(filename)
+            found_this_minute = True
+    return found_this_minute, new_files, seen, already
+
+
+def find_and_copy_async(after_filename, copy):
+    """COPY_ENGINE=async predictive mode: probes run concurrently ahead of
+    the newest hit and, with `copy`, each new file is copied as soon as its
+    minute is probed. Returns (new_files, [(pair, result)] or None)."""
+    start_dt = parse_filename_timestamp(after_filename)
+    result = async_copier.predict_and_copy(
+        start_dt, probe_minute, copy_fn=copy_file if copy else None, max_empty=MAX_EMPTY_MINUTES,
+    )
+    coverage.mark("smb", result["seen"])
+    coverage.mark("bronze", result["already"])
+    log.info(f"Predicted {result['minutes']} minutes, found {len(result['new_files'])} new files "
+             f"(async: {result['limiter']})")
+    if result["probe_errors"]:
+        dt, err = result["first_probe_error"]
+        log.warning(f"{result['probe_errors']} minute probes failed -- stopped before "
+                    f"{dt:%d.%m.%Y %H:%M}: {err}")
+    return result["new_files"], (result["copied"] if copy else None)
+
+
 def find_new_files_predict(after_filename):
     """
     Predict filenames from after_filename forward, minute by minute.
@@ -139,29 +376,17 @@ def find_new_files_predict(after_filename):
         return []
 
     new_files = []
+    seen_on_smb = []
+    already_in_bronze = []
     empty_streak = 0
     current_dt = start_dt + timedelta(minutes=1)
     minutes_checked = 0
 
     while empty_streak < MAX_EMPTY_MINUTES:
-        found_this_minute = False
-
-        for apt_smb in APARTMENTS_SMB:
-            filename = f"{current_dt.strftime('%d.%m.%Y %H%M')}_{apt_smb}_received.json"
-            smb_file = SMB_PATH / filename
-
-            if smb_file.exists():
-                apt_local = identify_apartment(filename)
-                if apt_local:
-                    # Skip if this file was already imported + cleaned up.
-                    if filename in PROCESSED:
-                        found_this_minute = True
-                        continue
-                    dst = bronze_dest(apt_local, current_dt, filename)
-                    # Check both raw and compressed (.json + .json.gz)
-                    if not bronze_already_present(apt_local, current_dt, filename):
-                        new_files.append((smb_file, dst))
-                found_this_minute = True
+        found_this_minute, pairs, seen, already = probe_minute(current_dt)
+        new_files.extend(pairs)
+        seen_on_smb.extend(seen)
+        already_in_bronze.extend(already)
 
         if found_this_minute:
             empty_streak = 0
@@ -171,6 +396,8 @@ def find_new_files_predict(after_filename):
         current_dt += timedelta(minutes=1)
         minutes_checked += 1
 
+    coverage.mark("smb", seen_on_smb)
+    coverage.mark("bronze", already_in_bronze)
     log.info(f"Predicted {minutes_checked} minutes, found {len(new_files)} new files (stopped after {MAX_EMPTY_MINUTES} empty minutes)")
     return new_files
 
@@ -188,6 +415,7 @@ def find_new_files_full():
     all_files.sort()
     scan_time = time.monotonic() - t0
     log.info(f"Found {len(all_files):,} files in {scan_time:.1f}s")
+    coverage.mark("smb", all_files)
 
     if not all_files:
         return []
@@ -207,40 +435,90 @@ def find_new_files_full():
             if consecutive_existing >= 50:
                 break
             continue
-        ts  = parse_filename_timestamp(name)
-        dst = BRONZE_ROOT / apt / ts.strftime("%Y") / ts.strftime("%m") / ts.strftime("%d") / ts.strftime("%H") / name
-        src = SMB_PATH / name
+        ts = parse_filename_timestamp(name)
 
-        # Skip if either raw or compressed copy exists in bronze
-        if dst.exists() or dst.with_suffix(dst.suffix + ".gz").exists():
+        # Skip if a raw, compressed or segment-packed copy exists in bronze
+        if bronze_already_present(apt, ts, name):
             consecutive_existing += 1
             if consecutive_existing >= 50:
                 break
         else:
             consecutive_existing = 0
-            new_files.append((src, dst))
+            new_files.append((SMB_PATH / name, bronze_dest(apt, ts, name)))
 
     log.info(f"{len(new_files):,} new files found")
     return new_files
 
 
-def run():
+def find_new_files_gaps(days=GAP_DAYS):
+    """Targeted gap repair. For each apartment, take the minutes of the last
+    `days` days (minus the grace period) that the coverage bitmap has in
+    neither bronze, silver nor the "probed absent" layer, and probe exactly
+    those names on SMB. Hits are queued for copy; misses are recorded as
+    absent so the next run doesn't probe them again."""
+    conn = coverage.open_coverage(log)
+    if conn is None:
+        log.info("Coverage bitmap unavailable -- falling back to full scan")
+        return find_new_files_full()
+
+    first_day = (datetime.now(tz=timezone.utc) - timedelta(days=days)).date()
+    last_minute = coverage.now_minute() - GAP_GRACE_MIN
+    t0 = time.monotonic()
+    new_files, seen, absent = [], [], []
+    probed = 0
+    try:
+        for apt_smb in APARTMENTS_SMB:
+            for minute in coverage.gaps(conn, identify_apartment(apt_smb), first_day, last_minute):
+                dt = datetime.fromtimestamp(minute * 60, tz=timezone.utc)
+                filename = f"{dt.strftime('%d.%m.%Y %H%M')}_{apt_smb}_received.json"
+                probed += 1
+                if not (SMB_PATH / filename).exists():
+                    absent.append(filename)
+                    continue
+                seen.append(filename)
+                apt_local = identify_apartment(filename)
+                if filename not in PROCESSED and not bronze_already_present(apt_local, dt, filename):
+                    new_files.append((SMB_PATH / filename, bronze_dest(apt_local, dt, filename)))
+    finally:
+        conn.close()
+
+    coverage.mark("smb", seen)
+    coverage.mark("absent", absent)
+    log.info(f"Gap repair: probed {probed:,} uncovered minutes since {first_day} in "
+             f"{time.monotonic() - t0:.1f}s -- {len(new_files):,} to copy, {len(absent):,} absent on SMB")
+    return new_files
+
+
+def run(full=None, gaps=None, stream=None):
+    """Copy new SMB files to bronze. `full` / `gaps` / `stream` override the
+    --full / --gaps / --stream flags so the watcher can call this in-process
+    (daemon mode) without touching argv."""
     if not SMB_PATH.exists():
         raise FileNotFoundError(f"SMB path not found: {SMB_PATH}\nIs Z: mounted?")
 
     BRONZE_ROOT.mkdir(parents=True, exist_ok=True)
-    full_mode = "--full" in sys.argv
+    full_mode = ("--full" in sys.argv) if full is None else full
+    gap_mode  = ("--gaps" in sys.argv) if gaps is None else gaps
+    stream_mode = (STREAM_SILVER or "--stream" in sys.argv) if stream is None else stream
+    refresh_processed()
 
     print(f"\n{B}bulk_to_bronze -- SMB -> Bronze{R}")
     print(f"{D}Source  : {SMB_PATH}{R}")
     print(f"{D}Bronze  : {BRONZE_ROOT.resolve()}{R}")
-    print(f"{D}Workers : {WORKERS} parallel threads{R}")
-    print(f"{D}Mode    : {'full scan' if full_mode else 'prediction'}{R}\n")
+    if COPY_ENGINE == "async":
+        print(f"{D}Workers : adaptive ({async_copier.MIN_CONCURRENCY}-{async_copier.MAX_CONCURRENCY}, AIMD){R}")
+    else:
+        print(f"{D}Workers : {WORKERS} parallel threads{R}")
+    mode = "full scan" if full_mode else ("gap repair" if gap_mode else "prediction")
+    print(f"{D}Mode    : {mode}{' + stream to silver' if stream_mode else ''}{R}\n")
 
     t0 = time.monotonic()
+    copy_results = None  # (pair, result) list when the async engine already copied
 
     if full_mode:
         new_files = find_new_files_full()
+    elif gap_mode:
+        new_files = find_new_files_gaps()
     else:
         newest_bronze = get_newest_bronze_filename()
         if newest_bronze is None:
@@ -248,7 +526,11 @@ def run():
             new_files = find_new_files_full()
         else:
             log.info(f"Newest in Bronze: {newest_bronze}")
-            new_files = find_new_files_predict(newest_bronze)
+            if COPY_ENGINE == "async":
+                plain_copy = not (stream_mode or bronze_segments.enabled())
+                new_files, copy_results = find_and_copy_async(newest_bronze, copy=plain_copy)
+            else:
+                new_files = find_new_files_predict(newest_bronze)
 
     if not new_files:
         total = time.monotonic() - t0
@@ -259,16 +541,53 @@ def run():
     copied = errors = 0
     t_copy = time.monotonic()
 
-    print(f"{D}Copying {len(new_files):,} files ({WORKERS} threads)...{R}\n")
-
-    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
-        futures = {executor.submit(copy_file, src, dst): src for src, dst in new_files}
-        for future in as_completed(futures):
-            result = future.result()
+    if copy_results is None:
+        engine = "adaptive async" if COPY_ENGINE == "async" else f"{WORKERS} threads"
+        print(f"{D}Copying {len(new_files):,} files ({engine})...{R}\n")
+
+    copied_names = []
+    silvered = None
+    if stream_mode:
+        copied_names, errors, silvered = stream_files(new_files)
+        copied = len(copied_names)
+    elif bronze_segments.enabled():
+        # One task per segment: appends to a segment are serialised anyway,
+        # and grouping keeps each hour a single sequential write.
+        by_segment = {}
+        for src, dst in new_files:
+            by_segment.setdefault(dst.parent, []).append(src)
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            futures = [executor.submit(copy_to_segment, seg, srcs) for seg, srcs in by_segment.items()]
+            for future in as_completed(futures):
+                names, failed = future.result()
+                copied += len(names)
+                errors += failed
+                copied_names.extend(names)
+    elif COPY_ENGINE == "async":
+        if copy_results is None:
+            copy_results, summary = async_copier.copy_all(new_files, copy_file)
+            log.info(f"Async copy: {summary}")
+        for (src, _dst), result in copy_results:
             if result == "copied":
                 copied += 1
+                copied_names.append(src.name)
             elif result == "error":
                 errors += 1
+    else:
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            futures = {executor.submit(copy_file, src, dst): src for src, dst in new_files}
+            for future in as_completed(futures):
+                result = future.result()
+                if result == "copied":
+                    copied += 1
+                    copied_names.append(futures[future].name)
+                elif result == "error":
+                    errors += 1
+
+    if not stream_mode:
+        bronze_catalog.record(copied_names, "seg" if bronze_segments.enabled() else "raw")
+        coverage.mark("smb", copied_names)
+        coverage.mark("bronze", copied_names)
 
     copy_time = time.monotonic() - t_copy
     total_time = time.monotonic() - t0
@@ -276,6 +595,8 @@ def run():
     print(f"\n{B}{'-'*48}{R}")
     print(f"{GR}{B}  Done in {total_time:.1f}s{R}")
     print(f"  {GR}v {copied:,} copied{R}")
+    if silvered is not None:
+        print(f"  {GR}v {silvered:,} streamed to silver{R}")
     if errors:
         print(f"  {RE}x {errors} errors{R}")
     print(f"\n{D}Bronze: {BRONZE_ROOT.resolve()}{R}\n")
@@ -0,0 +1,193 @@
+"""
+coverage.py -- Per-day minute-coverage bitmaps for sensor files
+================================================================
+One row per apartment per day in the bronze catalog database, holding four
+1440-bit (180-byte) bitmaps -- bit N = minute N of the UTC day:
+
+    smb     file seen on the SMB share
+    bronze  file copied to bronze (raw, gz or since deleted)
+    silver  file committed to silver
+    absent  probed on SMB by gap repair and NOT there (sensor outage)
+
+Maintained incrementally: bulk_to_bronze sets smb/bronze on every probe and
+copy, flatten_sensors sets silver after each batch. gaps() then yields
+exactly the minutes that are in none of bronze/silver/absent -- the only
+names gap repair has to probe with .exists(), instead of a multi-minute
+os.scandir of the whole share.
+
+Bootstrapped once from the bronze catalog (every catalogued minute counts as
+bronze, silvered ones as silver).
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import sqlite3
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+try:
+    from ingestion.fast_flow import bronze_catalog
+except ImportError:
+    import bronze_catalog
+
+DAY_MINUTES = 1440
+DAY_BYTES   = DAY_MINUTES // 8
+LAYERS      = ("smb", "bronze", "silver", "absent")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS minute_coverage (
+    apartment TEXT NOT NULL,
+    day       TEXT NOT NULL,            -- YYYY-MM-DD (UTC)
+    smb       BLOB NOT NULL,
+    bronze    BLOB NOT NULL,
+    silver    BLOB NOT NULL,
+    absent    BLOB NOT NULL,
+    PRIMARY KEY (apartment, day)
+) WITHOUT ROWID;
+"""
+
+
+def _empty() -> bytes:
+    return bytes(DAY_BYTES)
+
+
+def _split(minute: int):
+    """Epoch minute -> ('YYYY-MM-DD', minute-of-day)."""
+    day, mod = divmod(minute, DAY_MINUTES)
+    return (date(1970, 1, 1) + timedelta(days=day)).isoformat(), mod
+
+
+def _test(bitmap: bytes, mod: int) -> bool:
+    return bool(bitmap[mod >> 3] & (1 << (mod & 7)))
+
+
+def connect():
+    conn = bronze_catalog.connect()
+    conn.executescript(_DDL)
+    return conn
+
+
+def open_coverage(log=None):
+    """Connect, bootstrapping from the bronze catalog on first use. Returns
+    None when the catalog is disabled or unusable."""
+    catalog = bronze_catalog.open_catalog(log)
+    if catalog is None:
+        return None
+    catalog.close()
+    try:
+        conn = connect()
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'coverage_bootstrapped_at'").fetchone()
+        if row is None:
+            bootstrap_from_catalog(conn, log)
+        return conn
+    except sqlite3.Error as e:
+        if log:
+            log.warning(f"Coverage bitmap unavailable ({e})")
+        return None
+
+
+def bootstrap_from_catalog(conn, log=None):
+    by_layer = {"bronze": [], "silver": []}
+    for apt, minute, silvered in conn.execute("SELECT apartment, minute, silvered FROM bronze_files"):
+        by_layer["bronze"].append((apt, minute))
+        if silvered:
+            by_layer["silver"].append((apt, minute))
+    for layer, keys in by_layer.items():
+        _set_keys(conn, layer, keys)
+    conn.execute(
+        "INSERT INTO catalog_meta (key, value) VALUES ('coverage_bootstrapped_at', strftime('%Y-%m-%dT%H:%M:%SZ', 'now')) "
+        "ON CONFLICT (key) DO UPDATE SET value = excluded.value"
+    )
+    conn.commit()
+    if log:
+        log.info(f"Coverage bitmap: bootstrapped {len(by_layer['bronze']):,} bronze minutes from catalog")
+
+
+# -- WRITES --------------------------------------------------------------------
+
+def _set_keys(conn, layer, keys):
+    """Set bits for (apartment, epoch_minute) keys. Read-modify-write per
+    day row; caller commits."""
+    if layer not in LAYERS:
+        raise ValueError(f"unknown coverage layer: {layer}")
+    by_day = defaultdict(list)
+    for apt, minute in keys:
+        day, mod = _split(minute)
+        by_day[(apt, day)].append(mod)
+    for (apt, day), mods in by_day.items():
+        conn.execute(
+            "INSERT INTO minute_coverage (apartment, day, smb, bronze, silver, absent) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (apartment, day) DO NOTHING",
+            (apt, day, _empty(), _empty(), _empty(), _empty()),
+        )
+        row = conn.execute(
+            f"SELECT {layer} FROM minute_coverage WHERE apartment = ? AND day = ?", (apt, day)
+        ).fetchone()
+        bitmap = bytearray(row[0])
+        for mod in mods:
+            bitmap[mod >> 3] |= 1 << (mod & 7)
+        conn.execute(
+            f"UPDATE minute_coverage SET {layer} = ? WHERE apartment = ? AND day = ?",
+            (bytes(bitmap), apt, day),
+        )
+
+
+def mark(layer: str, filenames):
+    """Set `layer` bits for sensor filenames. Best-effort, like the catalog:
+    a failure never fails the pipeline."""
+    if not bronze_catalog.ENABLED or not filenames:
+        return
+    keys = [k for k in (bronze_catalog.parse_key(n) for n in filenames) if k is not None]
+    if not keys:
+        return
+    try:
+        conn = connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # serialise read-modify-write across processes
+            _set_keys(conn, layer, keys)
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+
+
+# -- READS ---------------------------------------------------------------------
+
+def gaps(conn, apartment: str, first_day: date, last_minute: int):
+    """Yield every epoch minute from `first_day` 00:00 UTC up to and
+    including `last_minute` that is in none of bronze / silver / absent."""
+    start = (first_day - date(1970, 1, 1)).days * DAY_MINUTES
+    rows = {
+        day: (bronze, silver, absent)
+        for day, bronze, silver, absent in conn.execute(
+            "SELECT day, bronze, silver, absent FROM minute_coverage "
+            "WHERE apartment = ? AND day >= ?",
+            (apartment, first_day.isoformat()),
+        )
+    }
+    for day_start in range(start, last_minute + 1, DAY_MINUTES):
+        day, _ = _split(day_start)
+        maps = rows.get(day)
+        if maps is None:
+            yield from range(day_start, min(day_start + DAY_MINUTES, last_minute + 1))
+            continue
+        known = bytes(b | s | a for b, s, a in zip(*maps))
+        for mod in range(min(DAY_MINUTES, last_minute + 1 - day_start)):
+            if not _test(known, mod):
+                yield day_start + mod
+
+
+def day_summary(conn, apartment: str, day: date) -> dict:
+    """Bit counts per layer for one apartment/day (status reporting)."""
+    row = conn.execute(
+        "SELECT smb, bronze, silver, absent FROM minute_coverage WHERE apartment = ? AND day = ?",
+        (apartment, day.isoformat()),
+    ).fetchone()
+    if row is None:
+        return {layer: 0 for layer in LAYERS}
+    return {layer: sum(bin(b).count("1") for b in bitmap) for layer, bitmap in zip(LAYERS, row)}
+
+
+def now_minute() -> int:
+    return int(datetime.now(tz=timezone.utc).timestamp()) // 60
@@ -0,0 +1,349 @@
+"""
+skip_list.py -- Compact "already imported, do not re-copy" list
+================================================================
+Replaces the flat storage/processed.log, which grew forever and was parsed
+into a Python set by every per-minute subprocess. Lives in storage/skiplist/:
+
+    <apt>.bits       one bit per minute since BASE (2020-01-01 UTC) per
+                     apartment -- ~64 KB per apartment-year
+    weather.bits     one bit per day for Pred_YYYY-MM-DD.csv
+    other.txt        sorted, deduplicated names that fit neither scheme
+    journal.txt      append-only names added since the last compaction
+    generation       compaction counter, bumped before each compaction
+
+Writers only append to the journal (safe from several processes at once).
+Once the journal passes COMPACT_BYTES, the next writer folds it into the
+bitsets under a lock file: journal -> journal.compacting (rename), bitsets
+rewritten via tmp + os.replace, then journal.compacting deleted. Readers
+load journal, journal.compacting, then the bitsets -- in that order, so a
+name is never missed while a compaction runs. (An append racing the rename
+is re-read before journal.compacting is deleted; in the worst case a name is
+lost, which costs one redundant, idempotent re-copy.) Long-lived readers
+remember the generation and reload when it changes: a journal recreated
+after a compaction may already be longer than the offset they stopped at.
+
+Bitsets are read into memory rather than mmap'd: on Windows a mapped file
+can't be replaced, which would block compaction while the watcher runs.
+
+The legacy processed.log is folded in automatically on first use and kept
+as processed.log.migrated.
+
+Usage:
+    python ingestion/fast_flow/skip_list.py --stats
+    python ingestion/fast_flow/skip_list.py --compact
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import os
+import re
+import struct
+import sys
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
+if not BRONZE_ROOT.is_absolute():
+    BRONZE_ROOT = PROJECT_ROOT / BRONZE_ROOT
+
+SKIP_DIR      = BRONZE_ROOT.parent / "skiplist"
+LEGACY_LOG    = BRONZE_ROOT.parent / "processed.log"
+JOURNAL       = SKIP_DIR / "journal.txt"
+COMPACTING    = SKIP_DIR / "journal.compacting"
+OTHER         = SKIP_DIR / "other.txt"
+LOCK          = SKIP_DIR / "compact.lock"
+GENERATION    = SKIP_DIR / "generation"
+COMPACT_BYTES = int(os.getenv("SKIPLIST_COMPACT_BYTES", str(256 * 1024)))
+LOCK_STALE_SECS = 600
+
+APARTMENT_MAP = {"jimmyloup": "jimmy", "jeremievianin": "jeremie"}
+BASE_MINUTE   = int(datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp()) // 60
+BASE_DAY      = date(2020, 1, 1)
+
+_HEADER  = struct.Struct("<4sq")   # magic, base index
+_MAGIC   = b"SKP1"
+_WEATHER = re.compile(r"^Pred_(\d{4})-(\d{2})-(\d{2})\.csv$")
+
+
+# -- KEYS ----------------------------------------------------------------------
+
+def _strip(name: str) -> str:
+    for suffix in (".gz", ".zst"):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def key(name: str):
+    """Filename -> (bitset, bit index), or None if it belongs in other.txt.
+    '31.08.2023 2144_JimmyLoup_received.json' -> ('jimmy', minutes since BASE)
+    'Pred_2024-03-01.csv'                     -> ('weather', days since BASE)"""
+    name = _strip(name)
+    m = _WEATHER.match(name)
+    if m:
+        days = (date(int(m[1]), int(m[2]), int(m[3])) - BASE_DAY).days
+        return ("weather", days) if days >= 0 else None
+    lower = name.lower()
+    apartment = next((v for k, v in APARTMENT_MAP.items() if k in lower), None)
+    if apartment is None or len(name) < 15 or name[2] != "." or name[5] != "." or name[10] != " ":
+        return None
+    try:
+        # Slicing instead of strptime: a full SMB scan checks ~250k names.
+        dt = datetime(int(name[6:10]), int(name[3:5]), int(name[0:2]),
+                      int(name[11:13]), int(name[13:15]), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    minute = int(dt.timestamp()) // 60 - BASE_MINUTE
+    return (apartment, minute) if minute >= 0 else None
+
+
+# -- BITSET FILES --------------------------------------------------------------
+
+def _bits_path(bitset: str) -> Path:
+    return SKIP_DIR / f"{bitset}.bits"
+
+
+def _read_bits(bitset: str) -> bytearray:
+    try:
+        data = _bits_path(bitset).read_bytes()
+    except OSError:
+        return bytearray()
+    if len(data) < _HEADER.size or data[:4] != _MAGIC:
+        return bytearray()
+    return bytearray(data[_HEADER.size:])
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _set_bit(bits: bytearray, index: int):
+    byte = index >> 3
+    if byte >= len(bits):
+        bits.extend(bytes(byte + 1 - len(bits)))
+    bits[byte] |= 1 << (index & 7)
+
+
+def _test_bit(bits: bytearray, index: int) -> bool:
+    byte = index >> 3
+    return byte < len(bits) and bool(bits[byte] & (1 << (index & 7)))
+
+
+def _read_lines(path: Path, offset: int = 0):
+    """Complete lines of a text file from `offset`. Returns (names, new
+    offset); a trailing partial line (concurrent appender) is left."""
+    try:
+        with path.open("rb") as f:
+            f.seek(offset)
+            data = f.read()
+    except OSError:
+        return [], offset
+    end = data.rfind(b"\n") + 1
+    names = [n.strip() for n in data[:end].decode("utf-8", errors="replace").splitlines()]
+    return [n for n in names if n], offset + end
+
+
+def _generation() -> int:
+    try:
+        return int(GENERATION.read_text())
+    except (OSError, ValueError):
+        return 0
+
+
+def _popcount(bits) -> int:
+    return int.from_bytes(bits, "little").bit_count()
+
+
+# -- READER --------------------------------------------------------------------
+
+class SkipList:
+    """In-memory view: bitsets + other names + un-compacted journal.
+    Supports `name in skip` and refresh() for long-lived callers."""
+
+    def __init__(self):
+        migrate_legacy_log()
+        self._load()
+
+    def _load(self):
+        # Order matters -- see module docstring.
+        self._generation = _generation()
+        journal, self._journal_offset = _read_lines(JOURNAL)
+        compacting, _ = _read_lines(COMPACTING)
+        self._bits = {}
+        self._extra = set(_read_lines(OTHER)[0])
+        for name in compacting + journal:
+            self._add_local(name)
+
+    def _bitset(self, name: str) -> bytearray:
+        if name not in self._bits:
+            self._bits[name] = _read_bits(name)
+        return self._bits[name]
+
+    def _add_local(self, name: str):
+        k = key(name)
+        if k is None:
+            self._extra.add(_strip(name))
+        else:
+            _set_bit(self._bitset(k[0]), k[1])
+
+    def __contains__(self, name: str) -> bool:
+        k = key(name)
+        if k is None:
+            return _strip(name) in self._extra
+        return _test_bit(self._bitset(k[0]), k[1])
+
+    def __len__(self) -> int:
+        if SKIP_DIR.exists():
+            for path in SKIP_DIR.glob("*.bits"):
+                self._bitset(path.stem)
+        return sum(_popcount(b) for b in self._bits.values()) + len(self._extra)
+
+    def refresh(self):
+        """Fold journal lines appended since the last read. Reloads
+        everything if a compaction started meanwhile (generation changed),
+        even one that finished before this read -- the offset then points
+        into a different journal file."""
+        generation = _generation()
+        try:
+            size = JOURNAL.stat().st_size
+        except OSError:
+            size = 0
+        if generation != self._generation or size < self._journal_offset:
+            self._load()
+            return
+        names, offset = _read_lines(JOURNAL, self._journal_offset)
+        if _generation() != generation:  # compacted while we were reading
+            self._load()
+            return
+        self._journal_offset = offset
+        for name in names:
+            self._add_local(name)
+
+
+# -- WRITER --------------------------------------------------------------------
+
+def add(names):
+    """Record names as imported (one journal append). Raises OSError if the
+    append fails; an opportunistic compaction afterwards never does."""
+    names = [n for n in names if n]
+    if not names:
+        return
+    SKIP_DIR.mkdir(parents=True, exist_ok=True)
+    with JOURNAL.open("a", encoding="utf-8") as f:
+        f.write("".join(n + "\n" for n in names))
+    try:
+        if JOURNAL.stat().st_size >= COMPACT_BYTES:
+            compact(blocking=False)
+    except OSError:
+        pass  # journal stays; the next writer or --compact retries
+
+
+def _try_lock(blocking: bool) -> bool:
+    while True:
+        try:
+            os.close(os.open(str(LOCK), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - LOCK.stat().st_mtime > LOCK_STALE_SECS:
+                    LOCK.unlink(missing_ok=True)
+                    continue
+            except OSError:
+                continue
+            if not blocking:
+                return False
+            time.sleep(0.1)
+
+
+def _fold(names) -> int:
+    """Merge names into the on-disk bitsets / other.txt. Returns count."""
+    by_bitset, other = {}, set()
+    for name in names:
+        k = key(name)
+        if k is None:
+            other.add(_strip(name))
+        else:
+            by_bitset.setdefault(k[0], []).append(k[1])
+    for bitset, indexes in by_bitset.items():
+        bits = _read_bits(bitset)
+        for i in indexes:
+            _set_bit(bits, i)
+        _write_atomic(_bits_path(bitset), _HEADER.pack(_MAGIC, 0) + bytes(bits))
+    if other:
+        merged = sorted(set(_read_lines(OTHER)[0]) | other)
+        _write_atomic(OTHER, "".join(n + "\n" for n in merged).encode("utf-8"))
+    return len(names)
+
+
+def compact(blocking: bool = True) -> int:
+    """Fold the journal into the bitsets. Returns the number of names
+    folded (0 if another process holds the lock and blocking=False)."""
+    SKIP_DIR.mkdir(parents=True, exist_ok=True)
+    if not _try_lock(blocking):
+        return 0
+    try:
+        # Bumped before the journal moves, so a reader that sees the new
+        # journal also sees the new generation and reloads.
+        _write_atomic(GENERATION, str(_generation() + 1).encode("ascii"))
+        # A crash mid-compaction leaves journal.compacting behind: fold it
+        # first (re-setting bits is idempotent).
+        if not COMPACTING.exists() and JOURNAL.exists():
+            os.replace(JOURNAL, COMPACTING)
+        names, _ = _read_lines(COMPACTING)
+        n = _fold(names)
+        # An appender that opened the journal just before the rename writes
+        # into journal.compacting; pick up anything that landed meanwhile.
+        late, _ = _read_lines(COMPACTING)
+        n += _fold(late[len(names):])
+        COMPACTING.unlink(missing_ok=True)
+        return n
+    finally:
+        LOCK.unlink(missing_ok=True)
+
+
+def migrate_legacy_log():
+    """One-time: fold storage/processed.log into the skip list and keep it
+    as processed.log.migrated."""
+    if not LEGACY_LOG.exists():
+        return
+    SKIP_DIR.mkdir(parents=True, exist_ok=True)
+    if not _try_lock(blocking=True):
+        return
+    try:
+        if not LEGACY_LOG.exists():  # another process migrated meanwhile
+            return
+        names, _ = _read_lines(LEGACY_LOG)
+        _fold(names)
+        os.replace(LEGACY_LOG, LEGACY_LOG.with_name(LEGACY_LOG.name + ".migrated"))
+    finally:
+        LOCK.unlink(missing_ok=True)
+
+
+def stats() -> dict:
+    """Entry count per bitset plus other/journal sizes (status reporting)."""
+    migrate_legacy_log()
+    out = {}
+    for path in sorted(SKIP_DIR.glob("*.bits")) if SKIP_DIR.exists() else []:
+        out[path.stem] = _popcount(_read_bits(path.stem))
+    out["other"] = len(_read_lines(OTHER)[0])
+    out["journal"] = len(_read_lines(JOURNAL)[0])
+    return out
+
+
+if __name__ == "__main__":
+    if "--compact" in sys.argv:
+        print(f"compacted {compact():,} journal entries")
+    elif "--stats" in sys.argv:
+        for name, n in stats().items():
+            print(f"{name:<10} {n:>12,}")
+    else:
+        print(__doc__)
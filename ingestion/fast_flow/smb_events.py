@@ -0,0 +1,181 @@
+"""
+smb_events.py -- Event-driven file discovery for the watcher
+=============================================================
+Wakes the watcher as soon as a new sensor JSON lands on the share instead
+of waiting for the next 60-second tick.
+
+Two sources, used together:
+  - inotify (Linux only, via ctypes -- no extra dependency). Fires within
+    milliseconds for files written through the local kernel (local disks,
+    NFS/CIFS mounts written from this host, bind mounts).
+  - predictive .exists() probe every NOTIFY_PROBE_SECS. Network shares
+    (CIFS/SMB) often do not forward remote writes as inotify events, and
+    Windows has no inotify at all, so the probe is always running as a
+    fallback. It only checks the next expected filenames -- a handful of
+    stat calls, not a scan.
+
+Bursts (e.g. both apartments landing in the same second, or a catch-up
+after an outage) are coalesced: after the first hit we keep listening
+until the share has been quiet for NOTIFY_SETTLE_SECS, then return every
+name seen so the pipeline runs once.
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from pathlib import Path
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+IN_NONBLOCK    = os.O_NONBLOCK
+IN_CLOEXEC     = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+_READ_BYTES   = 64 * 1024
+
+# Upper bound on how long a burst can keep extending the settle window,
+# so a continuous stream of files can't starve the pipeline.
+MAX_SETTLE_FACTOR = 10
+
+
+class InotifyDirectory:
+    """Minimal inotify wrapper watching one directory for completed files.
+
+    Only IN_CLOSE_WRITE and IN_MOVED_TO are watched: a copy in progress
+    fires IN_CREATE long before the JSON is complete, and bulk_to_bronze
+    must never pick up a half-written file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.fd = -1
+        if not sys.platform.startswith("linux"):
+            return
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        try:
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+            wd = libc.inotify_add_watch(
+                fd, str(self.path).encode(), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            if wd < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = -1
+
+    @property
+    def available(self) -> bool:
+        return self.fd >= 0
+
+    def read(self, timeout: float) -> tuple[list[str], bool]:
+        """Block up to `timeout` seconds. Returns (filenames, overflowed).
+        `overflowed` means the kernel queue dropped events -- the caller
+        should fall back to a probe/scan rather than trust the list."""
+        if not self.available:
+            time.sleep(max(timeout, 0))
+            return [], False
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return [], False
+        try:
+            data = os.read(self.fd, _READ_BYTES)
+        except BlockingIOError:
+            return [], False
+
+        names, overflowed = [], False
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw = data[offset:offset + length]
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            name = raw.rstrip(b"\0").decode("utf-8", errors="replace")
+            if name:
+                names.append(name)
+        return names, overflowed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class SmbEventSource:
+    """Combines inotify with the predictive .exists() probe.
+
+    `probe` is a callable returning the list of predicted filenames that
+    exist right now (watcher.check_predicted + predict_next_files); it is
+    called every `probe_secs` so remote writes that inotify can't see are
+    still picked up within a few seconds instead of a full minute.
+    """
+
+    def __init__(self, path: Path, probe, probe_secs: float = 5.0, settle_secs: float = 0.5):
+        self.probe = probe
+        self.probe_secs = probe_secs
+        self.settle_secs = settle_secs
+        self.inotify = InotifyDirectory(path)
+
+    @property
+    def mode(self) -> str:
+        return "inotify + probe" if self.inotify.available else "probe only"
+
+    def _wanted(self, name: str) -> bool:
+        return name.endswith(".json")
+
+    def _settle(self, first: list[str]) -> list[str]:
+        """Keep collecting names until the share has been quiet for
+        settle_secs (capped at MAX_SETTLE_FACTOR x settle_secs total)."""
+        seen = list(dict.fromkeys(first))
+        hard_stop = time.monotonic() + self.settle_secs * MAX_SETTLE_FACTOR
+        while time.monotonic() < hard_stop:
+            names, _ = self.inotify.read(self.settle_secs)
+            names = [n for n in names if self._wanted(n)]
+            if not names:
+                break
+            for n in names:
+                if n not in seen:
+                    seen.append(n)
+        return seen
+
+    def wait(self, timeout: float, on_tick=None) -> list[str]:
+        """Block until new files are seen or `timeout` seconds elapse.
+        Returns the (coalesced) filenames, or [] on timeout. `on_tick(remaining)`
+        is called roughly once per second so the caller can redraw its
+        idle line."""
+        deadline = time.monotonic() + timeout
+        next_probe = time.monotonic() + self.probe_secs
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            if on_tick is not None:
+                on_tick(remaining)
+
+            names, overflowed = self.inotify.read(min(1.0, remaining))
+            names = [n for n in names if self._wanted(n)]
+            if names:
+                return self._settle(names)
+
+            if overflowed or time.monotonic() >= next_probe:
+                next_probe = time.monotonic() + self.probe_secs
+                found = self.probe()
+                if found:
+                    return found
+
+    def close(self):
+        self.inotify.close()
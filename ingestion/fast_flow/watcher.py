@@ -4,9 +4,18 @@ watcher.py -- Pipeline loop: SMB -> Bronze -> Silver + Weather
 Fast flow: Predicts the next expected filenames based on the last known file.
            Checks with a single .exists() call -- milliseconds, no scanning.
 Slow flow: Daily weather pipeline (sFTP download + Bronze -> Silver cleaning).
-Nightly:   Full os.scandir at midnight to catch missed files.
+Nightly:   Gap repair at midnight -- probes only the minutes the coverage
+           bitmap has in neither bronze nor silver (NIGHTLY_MODE=gaps, default),
+           or a full os.scandir of the share (NIGHTLY_MODE=scan).
+
+Discovery (WATCH_MODE):
+  poll   -- probe the predicted next filenames once per INTERVAL_SECS (default)
+  notify -- inotify on the share (Linux) + predictive probe every
+            NOTIFY_PROBE_SECS; fires the pipeline within ~1s of a file landing
 
 Usage: python ingestion/fast_flow/watcher.py
+       python ingestion/fast_flow/watcher.py --notify    (event-driven discovery)
+       python ingestion/fast_flow/watcher.py --daemon    (run fast-flow stages in-process)
        python ingestion/fast_flow/watcher.py --scan      (full SMB scan + pipeline, then exit)
        python ingestion/fast_flow/watcher.py --weather   (run weather once and exit)
 
@@ -22,6 +31,13 @@ from pathlib import Path
 
 from dotenv import load_dotenv
 
+try:
+    from ingestion.fast_flow import bronze_catalog, bronze_segments, smb_events
+except ImportError:
+    import bronze_catalog
+    import bronze_segments
+    import smb_events
+
 load_dotenv()
 
 # -- CONFIG --------------------------------------------------------------------
@@ -34,6 +50,37 @@ WEATHER_HOUR  = int(os.getenv("WEATHER_HOUR", "7"))   # hour to trigger weather
 WEATHER_MIN   = int(os.getenv("WEATHER_MIN", "30"))    # minute to trigger weather
 PREDICTIONS_DAY = int(os.getenv("PREDICTIONS_DAY", "1"))  # day-of-month to retrain ML (1 = first of each month)
 
+# Event-driven discovery. In notify mode the idle countdown is replaced by
+# a wait on smb_events.SmbEventSource: inotify wakes us immediately for
+# files written through this kernel, and the predictive .exists() probe runs
+# every NOTIFY_PROBE_SECS for remote writes inotify can't see (CIFS, Windows).
+# Scheduling (gold / daily / nightly) still ticks at least every INTERVAL_SECS.
+WATCH_MODE         = "notify" if "--notify" in sys.argv else os.getenv("WATCH_MODE", "poll").lower()
+NOTIFY_PROBE_SECS  = float(os.getenv("NOTIFY_PROBE_SECS", "5"))
+NOTIFY_SETTLE_SECS = float(os.getenv("NOTIFY_SETTLE_SECS", "0.5"))
+
+# How the fast flow runs:
+#   subprocess -- a fresh `python bulk_to_bronze.py` + `flatten_sensors.py`
+#                 per cycle (default; a crash in a stage can't take the
+#                 watcher down)
+#   inprocess  -- import both stages once and call their run() directly, so
+#                 imports, .env, the skip list, the DB pool and the watermark
+#                 set stay warm across cycles (--daemon)
+# Gold, weather, KNIME and cleanup always stay subprocesses: they run rarely
+# and are heavy enough that a clean process is worth the startup cost.
+PIPELINE_MODE = "inprocess" if "--daemon" in sys.argv else os.getenv("PIPELINE_MODE", "subprocess").lower()
+
+# Nightly safety net:
+#   gaps -- bulk_to_bronze --gaps: .exists() only on minutes of the last
+#           GAP_DAYS days missing from the coverage bitmap, then the normal
+#           pipeline (default; also catches holes *behind* the newest file)
+#   scan -- full os.scandir of the share, pipeline only if something newer
+#           than bronze shows up (legacy; used automatically when
+#           BRONZE_CATALOG=0 since the bitmap lives in the catalog)
+NIGHTLY_MODE = os.getenv("NIGHTLY_MODE", "gaps").lower()
+if not bronze_catalog.ENABLED:
+    NIGHTLY_MODE = "scan"
+
 # Gold ETL refresh cadence (sensor facts).
 # Every N minutes the watcher kicks off populate_gold --sensors as a
 # subprocess so dashboards stay within N minutes of fresh.
@@ -107,7 +154,18 @@ def check_predicted(predicted_files):
 
 
 def get_newest_bronze_filename():
-    """Find the newest filename in Bronze by parsed date (not string sort)."""
+    """Find the newest filename in Bronze by parsed date (not string sort).
+    Uses the bronze catalog when available; otherwise walks the newest
+    hour folder of each apartment."""
+    catalog = bronze_catalog.open_catalog()
+    if catalog is not None:
+        try:
+            newest = bronze_catalog.newest_filename(catalog)
+        finally:
+            catalog.close()
+        if newest:
+            return newest
+
     bronze = PROJECT_ROOT / BRONZE_ROOT
     if not bronze.exists():
         return None
@@ -120,13 +178,16 @@ def get_newest_bronze_filename():
         # Walk newest year/month/day/hour folders
         hour_folders = sorted(apt_path.glob("*/*/*/*"), reverse=True)
         for folder in hour_folders:
-            if not folder.is_dir():
+            if folder.suffix == bronze_segments.SEGMENT_SUFFIX:
+                names = bronze_segments.members(folder)
+            elif folder.is_dir():
+                names = [f.name for f in folder.glob("*.json")]
+            else:
                 continue
-            files = list(folder.glob("*.json"))
-            for f in files:
-                dt = parse_filename_to_dt(f.name)
+            for name in names:
+                dt = parse_filename_to_dt(name)
                 if dt is not None and (newest_dt is None or dt > newest_dt):
-                    newest = f.name
+                    newest = name
                     newest_dt = dt
             if newest_dt is not None:
                 break  # only check newest folder per apartment
@@ -149,14 +210,55 @@ def get_newest_smb_filename():
     return newest
 
 
-def run_pipeline():
-    """Run all pipeline steps in sequence. Returns elapsed seconds."""
+_STAGES = None
+
+
+def _load_stages():
+    """Import the fast-flow stages once (daemon mode). Mirrors the
+    subprocess environment: project root on sys.path and as cwd, so the
+    relative BRONZE_ROOT resolves the same way."""
+    global _STAGES
+    if _STAGES is None:
+        if str(PROJECT_ROOT) not in sys.path:
+            sys.path.insert(0, str(PROJECT_ROOT))
+        os.chdir(PROJECT_ROOT)
+        from ingestion.fast_flow import bulk_to_bronze
+        from etl.bronze_to_silver import flatten_sensors
+        _STAGES = [
+            ("bulk_to_bronze",  lambda gaps: bulk_to_bronze.run(full=False, gaps=gaps), "SMB -> Bronze"),
+            ("flatten_sensors", lambda gaps: flatten_sensors.run(rescan=gaps),          "Bronze -> Silver"),
+        ]
+    return _STAGES
+
+
+def run_pipeline_inprocess(gaps=False):
+    """Daemon-mode pipeline: same steps as run_pipeline(), called as
+    functions. A failing stage is reported and the loop carries on."""
+    t_start = time.monotonic()
+    for name, fn, desc in _load_stages():
+        print(f"  {YE}>{R} {name} -- {desc}")
+        try:
+            fn(gaps)
+            print(f"  {GR}v{R} {name} done\n")
+        except Exception as e:
+            print(f"  {RE}x {name} error: {e}{R}\n")
+    return time.monotonic() - t_start
+
+
+def run_pipeline(gaps=False):
+    """Run all pipeline steps in sequence. Returns elapsed seconds.
+    gaps=True runs bulk_to_bronze in gap-repair mode (nightly) and has
+    flatten_sensors reconcile the bronze catalog with disk first."""
+    if PIPELINE_MODE == "inprocess":
+        return run_pipeline_inprocess(gaps)
+
     t_start = time.monotonic()
 
     steps = [
         ("bulk_to_bronze",  PROJECT_ROOT / "ingestion" / "fast_flow" / "bulk_to_bronze.py",  "SMB -> Bronze"),
         ("flatten_sensors", PROJECT_ROOT / "etl" / "bronze_to_silver" / "flatten_sensors.py", "Bronze -> Silver"),
     ]
+    extra_args = {"bulk_to_bronze": ["--gaps"], "flatten_sensors": ["--rescan"]} if gaps else {}
 
     # No subprocess timeout for the silver pipeline.
     # The original 2-hour cap was meant to catch hangs in the continuous
@@ -172,7 +274,7 @@ def run_pipeline():
         print(f"  {YE}>{R} {name} -- {desc}")
         try:
             result = subprocess.run(
-                [sys.executable, "-u", str(script)],
+                [sys.executable, "-u", str(script), *extra_args.get(name, [])],
                 cwd=str(PROJECT_ROOT),
             )
             if result.returncode == 0:
@@ -305,12 +407,14 @@ def run():
     print(f"{D}SMB      : {SMB_PATH}{R}")
     print(f"{D}Bronze   : {(PROJECT_ROOT / BRONZE_ROOT).resolve()}{R}")
     print(f"{D}Interval : {INTERVAL_SECS}s{R}")
+    print(f"{D}Discovery: {WATCH_MODE}{R}")
+    print(f"{D}Pipeline : {PIPELINE_MODE}{R}")
     print(f"{D}Fast flow : bulk_to_bronze -> flatten_sensors (every {INTERVAL_SECS}s){R}")
     print(f"{D}Gold      : populate_gold --sensors (every {GOLD_INTERVAL_MIN} min){R}")
     print(f"{D}Daily    : weather + populate_gold --weather + cleanup at {WEATHER_HOUR:02d}:{WEATHER_MIN:02d}{R}")
     print(f"{D}Monthly  : KNIME ML retrain on day {PREDICTIONS_DAY:02d} at {WEATHER_HOUR:02d}:{WEATHER_MIN:02d}{R}")
-    print(f"{D}Nightly   : full scan at {NIGHTLY_HOUR:02d}:00{R}")
-    print(f"{D}Flags    : --scan (full scan + pipeline) | --weather (weather only){R}")
+    print(f"{D}Nightly   : {'gap repair' if NIGHTLY_MODE == 'gaps' else 'full scan'} at {NIGHTLY_HOUR:02d}:00{R}")
+    print(f"{D}Flags    : --scan (full scan + pipeline) | --weather (weather only) | --notify | --daemon{R}")
     print(f"{D}Ctrl+C to stop{R}\n")
 
     # Find starting point
@@ -351,6 +455,39 @@ def run():
     nightly_done_today = False
     weather_done_today = False
     last_gold_at = 0.0  # epoch seconds; 0 means "never run" -> first tick will fire
+    pending_found: list[str] = []  # files reported by the event source during idle
+
+    def print_idle(remaining):
+        mins, secs = divmod(int(remaining), 60)
+        print(
+            f"\r  {D}[{time.strftime('%H:%M:%S')}] idle -- next in {mins:02d}:{secs:02d}"
+            f"  |  pipelines: {pipeline_count}  weather: {weather_count}  skipped: {skip_count}"
+            f"  |  last: {last_run_str}{R}   ",
+            end="", flush=True,
+        )
+
+    events = None
+    if WATCH_MODE == "notify":
+        events = smb_events.SmbEventSource(
+            SMB_PATH,
+            probe=lambda: check_predicted(predict_next_files(last_known)) if last_known else [],
+            probe_secs=NOTIFY_PROBE_SECS,
+            settle_secs=NOTIFY_SETTLE_SECS,
+        )
+        print(f"  {D}Event source: {events.mode} (probe every {NOTIFY_PROBE_SECS:g}s){R}")
+
+    def idle() -> list[str]:
+        """Sleep until the next tick. In notify mode, return early with the
+        filenames the event source saw so the next cycle runs immediately."""
+        if events is None:
+            for remaining in range(INTERVAL_SECS, 0, -1):
+                print_idle(remaining)
+                time.sleep(1)
+            print()
+            return []
+        found = events.wait(INTERVAL_SECS, on_tick=print_idle)
+        print()
+        return found
 
     try:
         while True:
@@ -364,7 +501,29 @@ def run():
             if current_hour == WEATHER_HOUR + 1:
                 weather_done_today = False
 
-            # Nightly safety scan
+            # Nightly gap repair: always runs the pipeline -- holes can sit
+            # behind the newest file, so "nothing newer on SMB" proves nothing.
+            if current_hour == NIGHTLY_HOUR and not nightly_done_today and NIGHTLY_MODE == "gaps":
+                nightly_done_today = True
+                pipeline_count += 1
+                print(f"\n  {YE}[{now}] NIGHTLY GAP REPAIR -- probing uncovered minutes{R}")
+                print(f"\n{CY}{B}{'=' * 56}{R}")
+                print(f"{CY}{B}  PIPELINE #{pipeline_count} (nightly gaps) -- {now}{R}")
+                print(f"{CY}{B}{'=' * 56}{R}\n")
+
+                elapsed = run_pipeline(gaps=True)
+                total_time += elapsed
+                last_known = get_newest_bronze_filename()
+                last_run_str = f"{time.strftime('%H:%M:%S')} ({elapsed:.0f}s, nightly)"
+
+                print(f"{CY}{B}{'=' * 56}{R}")
+                print(f"{GR}{B}  PIPELINE #{pipeline_count} COMPLETE -- {elapsed:.0f}s{R}")
+                print(f"{CY}{B}{'=' * 56}{R}")
+
+                pending_found = idle()
+                continue
+
+            # Nightly safety scan (NIGHTLY_MODE=scan)
             if current_hour == NIGHTLY_HOUR and not nightly_done_today:
                 nightly_done_today = True
                 print(f"\n  {YE}[{now}] NIGHTLY SCAN -- full os.scandir check{R}", end=" ", flush=True)
@@ -392,16 +551,7 @@ def run():
                 else:
                     print(f"{D}all caught up ({check_time:.0f}s){R}")
 
-                for remaining in range(INTERVAL_SECS, 0, -1):
-                    mins, secs = divmod(remaining, 60)
-                    print(
-                        f"\r  {D}[{time.strftime('%H:%M:%S')}] idle -- next in {mins:02d}:{secs:02d}"
-                        f"  |  pipelines: {pipeline_count}  weather: {weather_count}  skipped: {skip_count}"
-                        f"  |  last: {last_run_str}{R}   ",
-                        end="", flush=True,
-                    )
-                    time.sleep(1)
-                print()
+                pending_found = idle()
                 continue
 
             # Daily ML batch:
@@ -467,7 +617,10 @@ def run():
                 predicted = predict_next_files(last_known)
                 print(f"\n  {D}[{now}] Checking {predicted[0][:20]}...{R}", end=" ", flush=True)
                 t_check = time.monotonic()
-                found = check_predicted(predicted)
+                # Files the event source already saw win over a fresh probe --
+                # they may be further ahead than the next predicted minute.
+                found = pending_found or check_predicted(predicted)
+                pending_found = []
                 check_time = time.monotonic() - t_check
 
                 if found:
@@ -493,19 +646,12 @@ def run():
                     skip_count += 1
                     print(f"{D}not yet ({check_time:.2f}s){R}")
 
-            # Countdown
-            for remaining in range(INTERVAL_SECS, 0, -1):
-                mins, secs = divmod(remaining, 60)
-                print(
-                    f"\r  {D}[{time.strftime('%H:%M:%S')}] idle -- next in {mins:02d}:{secs:02d}"
-                    f"  |  pipelines: {pipeline_count}  weather: {weather_count}  skipped: {skip_count}"
-                    f"  |  last: {last_run_str}{R}   ",
-                    end="", flush=True,
-                )
-                time.sleep(1)
-            print()
+            # Countdown (poll) or wait for the share to report a file (notify)
+            pending_found = idle()
 
     except KeyboardInterrupt:
+        if events is not None:
+            events.close()
         print(f"\n\n{B}{'-' * 56}{R}")
         print(f"{D}Stopped after {run_count} checks ({pipeline_count} pipelines, {weather_count} weather, {skip_count} skipped){R}")
         print(f"{D}Total pipeline time: {total_time / 60:.1f}min{R}")
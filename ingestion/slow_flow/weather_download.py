@@ -1,5 +1,7 @@
 import os
 import logging
+import queue
+import threading
 from datetime import datetime
 import paramiko
 import time
@@ -20,6 +22,16 @@ BRONZE_ROOT   = Path(os.getenv("BRONZE_ROOT", r"storage\bronze"))
 MAX_RETRIES   = int(os.getenv("SFTP_MAX_RETRIES", "3"))
 RETRY_DELAY   = int(os.getenv("SFTP_RETRY_DELAY", "600"))
 
+# Download tuning. Each worker thread holds its own SFTP session; the
+# default stays low because the server doesn't like many sessions from one
+# client (SFTP_WORKERS=1 = the old sequential download). Within a file,
+# reads are pipelined (paramiko prefetch) over a larger SSH window, so
+# one session is no longer one round trip per 32 KB block.
+SFTP_WORKERS   = max(1, int(os.getenv("SFTP_WORKERS", "2")))
+SFTP_WINDOW_MB = int(os.getenv("SFTP_WINDOW_MB", "16"))
+READ_SIZE      = 1 << 20  # bytes written to the .part file per read()
+PART_SUFFIX    = ".part"
+
 # ─── LOGGING ───
 LOG_DIR = Path(os.getenv("LOG_DIR", "logs"))
 LOG_DIR.mkdir(parents=True, exist_ok=True)
@@ -49,21 +61,89 @@ def bronze_path(filename):
     return path / filename
 
 
-def connect():
-    for attempt in range(1, MAX_RETRIES + 1):
+def connect(retries=MAX_RETRIES):
+    """Open an SFTP session, retrying `retries` times RETRY_DELAY apart."""
+    for attempt in range(1, retries + 1):
         try:
-            t = paramiko.Transport((SFTP_HOST, SFTP_PORT))
+            t = paramiko.Transport((SFTP_HOST, SFTP_PORT),
+                                   default_window_size=SFTP_WINDOW_MB * 2**20)
             t.connect(username=SFTP_USER, password=SFTP_PASSWORD)
             return paramiko.SFTPClient.from_transport(t), t
         except Exception as e:
-            if attempt == MAX_RETRIES:
-                log.error(f"SFTP failed after {MAX_RETRIES} attempts: {e}")
+            if attempt == retries:
+                log.error(f"SFTP failed after {retries} attempts: {e}")
                 raise
-            log.warning(f"SFTP error (attempt {attempt}/{MAX_RETRIES}) → retry in {RETRY_DELAY}s: {e}")
+            log.warning(f"SFTP error (attempt {attempt}/{retries}) → retry in {RETRY_DELAY}s: {e}")
             time.sleep(RETRY_DELAY)
 
 
 
+def _close(sftp, transport):
+    for c in (sftp, transport):
+        try:
+            if c is not None:
+                c.close()
+        except Exception:
+            pass
+
+
+def download_file(sftp, remote: str, local: Path) -> int:
+    """Download `remote` into `local` through `<local>.part`, resuming from
+    the bytes an earlier, interrupted attempt left there, then rename it
+    into place atomically -- bronze never holds a truncated CSV. Returns
+    the bytes transferred by this call."""
+    part = local.with_name(local.name + PART_SUFFIX)
+    size = sftp.stat(remote).st_size
+    offset = part.stat().st_size if part.exists() else 0
+    if offset > size:
+        offset = 0  # remote file changed -- start over
+    if offset < size:
+        with sftp.open(remote, "rb") as src, open(part, "ab" if offset else "wb") as dst:
+            if offset:
+                src.seek(offset)
+            src.prefetch(size)  # pipeline every remaining read request
+            while chunk := src.read(READ_SIZE):
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+    got = part.stat().st_size
+    if got != size:
+        raise IOError(f"{remote}: {got} of {size} bytes")
+    os.replace(part, local)
+    return size - offset
+
+
+def _worker(todo: queue.Queue, results: queue.Queue):
+    """Drain `todo` over this thread's own session. A failed file is retried
+    (resuming its .part) on a fresh connection, up to MAX_RETRIES times.
+    Reconnects are a single attempt each (no RETRY_DELAY wait): run() has
+    already waited for the server, so a dead server fails the file fast
+    instead of blocking the worker for MAX_RETRIES^2 delays."""
+    sftp = transport = None
+    try:
+        while True:
+            try:
+                filename, local = todo.get_nowait()
+            except queue.Empty:
+                return
+            for attempt in range(1, MAX_RETRIES + 1):
+                try:
+                    if sftp is None:
+                        sftp, transport = connect(retries=1)
+                    results.put((filename, download_file(sftp, f"{SFTP_PATH}/{filename}", local), None))
+                    break
+                except Exception as e:
+                    _close(sftp, transport)
+                    sftp = transport = None
+                    if attempt == MAX_RETRIES:
+                        results.put((filename, 0, str(e)))
+                    else:
+                        log.warning(f"  {filename}: {e} -- reconnecting, resuming from .part "
+                                    f"(attempt {attempt}/{MAX_RETRIES})")
+    finally:
+        _close(sftp, transport)
+
+
 def run():
 
     # 1. Connect to SFTP
@@ -74,61 +154,69 @@ def run():
     try:
         # 2. List all files on the server
         remote_files = sftp.listdir(SFTP_PATH)
-        csv_files = [f for f in remote_files if f.endswith('.csv')]
-        log.info(f"Found {len(csv_files)} CSV files on SFTP ({len(remote_files)} total)")
-
-        copied = 0
-        skipped = 0
-        failed = 0
-
-        # Pre-filter to only files we actually need to download. This makes the
-        # progress bar reflect real work, not "skipped" noise.
-        to_download = []
-        for filename in csv_files:
-            local = bronze_path(filename)
-            if local is None:
-                skipped += 1
-                continue
-            if local.exists():
-                skipped += 1
-                continue
-            to_download.append((filename, local))
-
-        if not to_download:
-            log.info(f"Bronze weather is up to date ({skipped} files already present)")
-        else:
-            log.info(f"{len(to_download)} new files to download "
-                     f"({skipped} already present in Bronze)")
-            import time as _t
-            t_start = _t.monotonic()
-
-            # Sequential download (sFTP server typically doesn't like concurrent
-            # sessions from the same client). Progress bar instead of per-file log.
-            for i, (filename, local) in enumerate(to_download, 1):
-                try:
-                    sftp.get(f"{SFTP_PATH}/{filename}", str(local))
-                    copied += 1
-                except Exception as e:
-                    log.error(f"  Failed to download {filename}: {e}")
-                    failed += 1
-                    continue
-
-                elapsed = _t.monotonic() - t_start
-                rate = i / elapsed if elapsed else 1
-                eta = (len(to_download) - i) / rate
-                pct = i / len(to_download) * 100
-                bar_w = 24
-                filled = int(bar_w * pct / 100)
-                bar = "█" * filled + "░" * (bar_w - filled)
-                # Single log line per file — no path spam
-                log.info(f"  [{bar}] {i:>3}/{len(to_download)}  {pct:5.1f}%  "
-                         f"{filename}  ETA {eta/60:.1f}min")
-
-        log.info(f"Done: {copied} downloaded, {skipped} skipped, {failed} failed")
-
     finally:
-        sftp.close()
-        transport.close()
+        _close(sftp, transport)
+    csv_files = [f for f in remote_files if f.endswith('.csv')]
+    log.info(f"Found {len(csv_files)} CSV files on SFTP ({len(remote_files)} total)")
+
+    copied = 0
+    skipped = 0
+    failed = 0
+
+    # Pre-filter to only files we actually need to download. This makes the
+    # progress bar reflect real work, not "skipped" noise.
+    to_download = []
+    for filename in csv_files:
+        local = bronze_path(filename)
+        if local is None:
+            skipped += 1
+            continue
+        if local.exists():
+            skipped += 1
+            continue
+        to_download.append((filename, local))
+
+    if not to_download:
+        log.info(f"Bronze weather is up to date ({skipped} files already present)")
+    else:
+        workers = min(SFTP_WORKERS, len(to_download))
+        log.info(f"{len(to_download)} new files to download "
+                 f"({skipped} already present in Bronze, {workers} parallel sessions)")
+        t_start = time.monotonic()
+
+        todo, results = queue.Queue(), queue.Queue()
+        for item in to_download:
+            todo.put(item)
+        threads = [threading.Thread(target=_worker, args=(todo, results), name=f"sftp-{i}", daemon=True)
+                   for i in range(workers)]
+        for t in threads:
+            t.start()
+
+        # Progress bar instead of per-file log, as files complete.
+        n_bytes = 0
+        for i in range(1, len(to_download) + 1):
+            filename, n, err = results.get()
+            if err:
+                log.error(f"  Failed to download {filename}: {err}")
+                failed += 1
+                continue
+            copied += 1
+            n_bytes += n
+
+            elapsed = time.monotonic() - t_start
+            rate = i / elapsed if elapsed else 1
+            eta = (len(to_download) - i) / rate
+            pct = i / len(to_download) * 100
+            bar_w = 24
+            filled = int(bar_w * pct / 100)
+            bar = "█" * filled + "░" * (bar_w - filled)
+            # Single log line per file — no path spam
+            log.info(f"  [{bar}] {i:>3}/{len(to_download)}  {pct:5.1f}%  "
+                     f"{filename}  {n_bytes / 2**20 / elapsed if elapsed else 0:.1f} MB/s  ETA {eta/60:.1f}min")
+        for t in threads:
+            t.join()
+
+    log.info(f"Done: {copied} downloaded, {skipped} skipped, {failed} failed")
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
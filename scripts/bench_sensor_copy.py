@@ -0,0 +1,135 @@
+"""
+bench_sensor_copy.py — CSV vs PGCOPY binary for the sensor_events COPY
+=======================================================================
+Compares the two SENSOR_COPY_FORMAT paths of flatten_sensors.upsert() on a
+synthetic SensorBatch shaped like real bronze (same channels per minute):
+
+  1. client side  — time to encode the batch (to_csv vs iter_binary) and
+                    payload size
+  2. server side  — with --db: COPY into _tmp_sensor_events on the real
+                    database, each format several times, in a transaction
+                    that is rolled back (silver is never touched)
+
+Usage:
+    python scripts/bench_sensor_copy.py                    # encode only
+    python scripts/bench_sensor_copy.py --db               # + COPY into Postgres
+    python scripts/bench_sensor_copy.py --files 5000 --repeat 3
+
+Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
+"""
+
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+load_dotenv(PROJECT_ROOT / ".env")
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from etl.bronze_to_silver import flatten_sensors
+from etl.bronze_to_silver.sensor_batch import SensorBatch
+
+
+# ── ANSI ──────────────────────────────────────────────────────────────────────
+RESET="\033[0m"; BOLD="\033[1m"; DIM="\033[2m"
+GREEN="\033[32m"; RED="\033[31m"; YELLOW="\033[33m"; BLUE="\033[36m"
+if not sys.stdout.isatty():
+    RESET = BOLD = DIM = GREEN = RED = YELLOW = BLUE = ""
+
+def header(m): print(f"\n{BOLD}{BLUE}== {m} =={RESET}")
+def ok(m):     print(f"  {GREEN}✓{RESET} {m}")
+
+
+# ── SYNTHETIC BATCH ───────────────────────────────────────────────────────────
+def _payload(i: int) -> dict:
+    """One minute of sensor JSON with the usual room/sensor spread."""
+    rooms = ["Kitchen", "Office", "Livingroom", "Bdroom", "Bhroom"]
+    return {
+        "plugs": {r: {"power": 10.0 + i % 50, "total": 1000 + i, "temperature": 21.5} for r in rooms[:3]},
+        "doorsWindows": {r: [{"type": "Window", "switch": "on" if i % 7 else "off", "battery": 90}] for r in rooms},
+        "motions": {r: {"motion": bool(i % 3), "light": i % 400, "temperature": 22.0} for r in rooms[:4]},
+        "meteos": {"meteo": {r: {"Temperature": 21.0 + (i % 10) / 10, "CO2": 400 + i % 900, "Humidity": 45,
+                                  "Noise": 35, "Pressure": 1010, "battery_percent": 80} for r in rooms[:3]}},
+        "humidities": {"Bhroom": {"temperature": 23.0, "humidity": 60, "devicePower": 70}},
+        "consumptions": {"House": {f: 1.0 + i % 5 for f in ("total_power", "power1", "power2", "power3",
+                                                            "current1", "current2", "current3",
+                                                            "voltage1", "voltage2", "voltage3")}},
+    }
+
+
+def build_batch(n_files: int) -> SensorBatch:
+    batch = SensorBatch()
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(n_files):
+        flatten_sensors.flatten_into(batch, ("jimmy", "jeremie")[i % 2], _payload(i), start + timedelta(minutes=i // 2))
+    return batch.finish(room_map=flatten_sensors.ROOM_MAP, bounds=flatten_sensors.BOUNDS)
+
+
+# ── BENCH ─────────────────────────────────────────────────────────────────────
+def _timed(fn, repeat: int):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times), result
+
+
+def bench_encode(batch: SensorBatch, repeat: int):
+    header("Client-side encode")
+    t_csv, size_csv = _timed(lambda: len(batch.to_csv().getvalue().encode("utf-8")), repeat)
+    t_bin, size_bin = _timed(lambda: sum(len(c) for c in batch.iter_binary()), repeat)
+    rate = lambda t: f"{len(batch) / t:,.0f} rows/s" if t > 0 else "n/a"
+    ok(f"csv    {t_csv * 1000:8.0f} ms  {size_csv / 2**20:7.1f} MB  {rate(t_csv)}")
+    ok(f"binary {t_bin * 1000:8.0f} ms  {size_bin / 2**20:7.1f} MB  {rate(t_bin)}")
+
+
+def bench_copy(batch: SensorBatch, repeat: int):
+    header("COPY into _tmp_sensor_events (rolled back)")
+    engine = flatten_sensors.get_engine()
+    raw = engine.raw_connection()
+    try:
+        cur = raw.cursor()
+        for fmt in ("csv", "binary"):
+            times = []
+            for _ in range(repeat):
+                cur.execute(flatten_sensors._TEMP_DDL)
+                t0 = time.perf_counter()
+                flatten_sensors.copy_rows(cur, batch, fmt=fmt)
+                times.append(time.perf_counter() - t0)
+                raw.rollback()
+            t = statistics.median(times)
+            ok(f"{fmt:<6} {t * 1000:8.0f} ms  {len(batch) / t:,.0f} rows/s  (median of {repeat})")
+    finally:
+        raw.rollback()
+        raw.close()
+
+
+def _arg(flag: str, default: int) -> int:
+    if flag in sys.argv:
+        return int(sys.argv[sys.argv.index(flag) + 1])
+    return default
+
+
+def main():
+    n_files = _arg("--files", flatten_sensors.BATCH_SIZE)
+    repeat = _arg("--repeat", 3)
+    t0 = time.perf_counter()
+    batch = build_batch(n_files)
+    print(f"{BOLD}Sensor COPY benchmark{RESET}  {DIM}{n_files:,} files -> {len(batch):,} rows "
+          f"(built in {time.perf_counter() - t0:.1f}s){RESET}")
+    bench_encode(batch, repeat)
+    if "--db" in sys.argv:
+        if not os.getenv("DB_URL"):
+            sys.exit("DB_URL not set in .env")
+        bench_copy(batch, repeat)
+
+
+if __name__ == "__main__":
+    main()
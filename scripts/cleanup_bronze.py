@@ -1,11 +1,14 @@
 """
 cleanup_bronze.py -- Delete bronze files already imported to silver
 ====================================================================
-Reads silver watermarks (silver.etl_watermark for sensor JSON,
+Reads silver watermarks (silver.etl_watermark_ranges for sensor JSON,
 silver.weather_watermark for weather CSV) and deletes the corresponding
 bronze files when they are older than BRONZE_RETENTION_DAYS.
 
 This makes bronze a bounded buffer instead of an immutable archive.
+Packed hourly segments (BRONZE_FORMAT=segments) are deleted as a whole,
+once every minute they hold is past the retention window.
+
 Trade-off: lose the ability to re-derive silver from bronze for files
 older than the retention window. Source data (SMB, sFTP, MySQL) is
 still available for full reprocessing if needed.
@@ -33,6 +36,11 @@ from sqlalchemy import create_engine, text
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 load_dotenv(PROJECT_ROOT / ".env")
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from etl.bronze_to_silver import sensor_watermark
+from ingestion.fast_flow import bronze_catalog, bronze_codec, bronze_segments, skip_list
 
 DB_URL      = os.getenv("DB_URL")
 BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", "storage/bronze"))
@@ -77,7 +85,16 @@ def find_bronze_path(filename: str) -> Path | None:
         candidate = (BRONZE_ROOT / apt
                      / dt.strftime("%Y") / dt.strftime("%m")
                      / dt.strftime("%d") / dt.strftime("%H") / filename)
-        return candidate if candidate.exists() else None
+        if candidate.exists():
+            return candidate
+        # Compress-after-silver leaves <file>.json.gz (or .zst) behind,
+        # keyed in the watermark under the plain .json name.
+        for sfx in bronze_codec.SUFFIX_STATES:
+            compressed = candidate.with_name(filename + sfx)
+            if compressed.exists():
+                return compressed
+        seg = bronze_segments.segment_for_folder(candidate.parent)
+        return bronze_segments.member_path(seg, filename) if bronze_segments.contains(seg, filename) else None
 
     if filename.endswith(".csv"):
         # Weather CSV: bronze/weather/YYYY/MM/DD/Pred_YYYY-MM-DD.csv
@@ -86,39 +103,41 @@ def find_bronze_path(filename: str) -> Path | None:
             base = filename.replace("Pred_", "").replace(".csv", "")
             yy, mm, dd = base.split("-")
             candidate = BRONZE_ROOT / "weather" / yy / mm / dd / filename
-            return candidate if candidate.exists() else None
+            for path in (candidate, *(candidate.with_name(filename + sfx) for sfx in bronze_codec.SUFFIX_STATES)):
+                if path.exists():
+                    return path
+            return None
         except Exception:
             return None
     return None
 
 
 # ── CLEANUP ───────────────────────────────────────────────────────────────────
-PROCESSED_LOG = BRONZE_ROOT.parent / "processed.log"
-
-
 def append_to_processed_log(filenames: list[str]):
-    """Append filenames to processed.log so the watcher knows not to re-copy
-    them on its next scan. Idempotent — duplicates are filtered later by
-    callers that read this file as a set."""
-    if not filenames:
-        return
-    PROCESSED_LOG.parent.mkdir(parents=True, exist_ok=True)
-    with PROCESSED_LOG.open("a", encoding="utf-8") as f:
-        for name in filenames:
-            f.write(f"{name}\n")
+    """Record filenames in the skip list (skip_list.py) so the watcher knows
+    not to re-copy them on its next scan. Idempotent — re-adding a name just
+    sets the same bit again."""
+    skip_list.add(filenames)
 
 
 def cleanup_from_watermark(engine, table: str, dry_run: bool, cutoff_days: int):
     """Delete bronze files listed in `silver.<table>` (filename, processed_at)
     when processed_at is older than `cutoff_days`. Also records each deleted
-    filename in processed.log so the next watcher scan doesn't re-copy it."""
+    filename in the skip list so the next watcher scan doesn't re-copy it.
+
+    The sensor watermark is range-compressed (etl_watermark_ranges); its
+    expired ranges are expanded back to filenames by sensor_watermark."""
     rows = []
     try:
-        with engine.connect() as conn:
-            rows = conn.execute(text(
-                f"SELECT filename, processed_at FROM silver.{table} "
-                f"WHERE processed_at < NOW() - INTERVAL '{cutoff_days} days'"
-            )).fetchall()
+        if table == "etl_watermark_ranges":
+            sensor_watermark.ensure_schema(engine)
+            rows = list(sensor_watermark.expired(engine, cutoff_days))
+        else:
+            with engine.connect() as conn:
+                rows = conn.execute(text(
+                    f"SELECT filename, processed_at FROM silver.{table} "
+                    f"WHERE processed_at < NOW() - INTERVAL '{cutoff_days} days'"
+                )).fetchall()
     except Exception as e:
         warn(f"silver.{table}: {str(e)[:80]}")
         return 0, 0, 0
@@ -129,14 +148,18 @@ def cleanup_from_watermark(engine, table: str, dry_run: bool, cutoff_days: int):
 
     deleted = missing = errors = 0
     deleted_names: list[str] = []
+    segments: dict[Path, list[str]] = {}
     for filename, _processed_at in rows:
         path = find_bronze_path(filename)
         if path is None:
-            # Already gone from bronze — still record in processed.log so
+            # Already gone from bronze — still record in the skip list so
             # the watcher's nightly full-scan doesn't think it's "new".
             missing += 1
             deleted_names.append(filename)
             continue
+        if bronze_segments.is_member(path):
+            segments.setdefault(path.parent, []).append(filename)
+            continue
         if dry_run:
             deleted += 1
             continue
@@ -148,13 +171,33 @@ def cleanup_from_watermark(engine, table: str, dry_run: bool, cutoff_days: int):
             errors += 1
             warn(f"  could not delete {path.name}: {str(e)[:60]}")
 
+    # A segment goes only when all of its minutes are eligible; a partly
+    # expired hour waits for the next run.
+    kept = 0
+    for seg, names in segments.items():
+        if set(bronze_segments.members(seg)) - set(names):
+            kept += len(names)
+            continue
+        if not dry_run:
+            try:
+                bronze_segments.delete_segment(seg)
+            except Exception as e:
+                errors += len(names)
+                warn(f"  could not delete {seg.name}: {str(e)[:60]}")
+                continue
+            deleted_names.extend(names)
+        deleted += len(names)
+    if kept:
+        ok(f"silver.{table}: {kept} files kept until their whole hour segment expires")
+
     if not dry_run:
         append_to_processed_log(deleted_names)
+        bronze_catalog.record(deleted_names, "deleted")
 
     label = "would delete" if dry_run else "deleted"
     ok(f"silver.{table}: {label} {deleted}, missing {missing}, errors {errors}  (of {len(rows)} eligible)")
     if not dry_run and deleted_names:
-        ok(f"  appended {len(deleted_names)} filenames to {PROCESSED_LOG.name}")
+        ok(f"  added {len(deleted_names)} filenames to the skip list")
     return deleted, missing, errors
 
 
@@ -194,13 +237,13 @@ def main():
 
     print(f"  Bronze root         : {BRONZE_ROOT}")
     print(f"  Retention window    : {RETENTION_DAYS} days")
-    print(f"  Source of truth     : silver.etl_watermark + silver.weather_watermark")
+    print(f"  Source of truth     : silver.etl_watermark_ranges + silver.weather_watermark")
 
     engine = create_engine(DB_URL)
     total_deleted = total_missing = total_errors = 0
 
-    header("Sensors (silver.etl_watermark)")
-    d, m, e = cleanup_from_watermark(engine, "etl_watermark", dry_run, RETENTION_DAYS)
+    header("Sensors (silver.etl_watermark_ranges)")
+    d, m, e = cleanup_from_watermark(engine, "etl_watermark_ranges", dry_run, RETENTION_DAYS)
     total_deleted += d; total_missing += m; total_errors += e
 
     header("Weather (silver.weather_watermark)")
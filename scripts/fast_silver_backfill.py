@@ -9,10 +9,22 @@ still works (every filename gets recorded), but rows in
 silver.sensor_events may briefly contain duplicates between phases 2
 and 3 — don't run anything that reads silver during that window.
 
+Two dedupe engines for phases 3-4:
+    join (default)  DELETE ... USING self-join, then re-add the constraint
+                    (on an unpartitioned table the index is built
+                    CONCURRENTLY and attached with ADD CONSTRAINT USING INDEX)
+    sort            SELECT DISTINCT ON (key) ... ORDER BY key, id -- one sort --
+                    into a fresh table (per partition when partitioned),
+                    build its indexes there with a large maintenance_work_mem,
+                    then swap it in atomically -- one sort instead of a
+                    20M x 20M join, and the live table is never locked while
+                    an index builds
+
 Usage:
     python scripts/fast_silver_backfill.py            # all 4 phases
     python scripts/fast_silver_backfill.py --dropped   # skip phase 1 (already dropped)
     python scripts/fast_silver_backfill.py --dedupe-only  # only run phases 3-4
+    python scripts/fast_silver_backfill.py --engine sort  # sort-based phases 3-4 (default: join)
 
 Author: Group 14 - Data Cycle Project - HES-SO Valais 2026
 """
@@ -28,6 +40,10 @@ from sqlalchemy import create_engine, text
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 load_dotenv(PROJECT_ROOT / ".env")
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from etl.bronze_to_silver import sensor_partitions
 
 DB_URL = os.getenv("DB_URL")
 if not DB_URL:
@@ -37,6 +53,10 @@ CONSTRAINT_NAME = "sensor_events_apartment_room_sensor_type_field_timestamp_key"
 TABLE = "silver.sensor_events"
 COLS = ("apartment", "room", "sensor_type", "field", "timestamp")
 
+# Session settings for the sort engine's DISTINCT ON sort and index builds.
+MAINTENANCE_WORK_MEM = os.getenv("BACKFILL_MAINTENANCE_WORK_MEM", "2GB")
+WORK_MEM             = os.getenv("BACKFILL_WORK_MEM", "512MB")
+
 
 # ── ANSI ──────────────────────────────────────────────────────────────────────
 RESET="\033[0m"; BOLD="\033[1m"; DIM="\033[2m"
@@ -67,6 +87,15 @@ def find_constraint(conn) -> str | None:
     return rows[0][0] if rows else None
 
 
+def is_compact_layout(conn) -> bool:
+    """silver.sensor_events is the compact-layout view (sensor_channels.py)."""
+    return conn.execute(text("""
+        SELECT c.relkind FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'silver' AND c.relname = 'sensor_events'
+    """)).scalar() == "v"
+
+
 def phase_1_drop_constraint(engine):
     header("Phase 1 — drop unique constraint")
     with engine.begin() as conn:
@@ -168,21 +197,173 @@ def phase_4_recreate_constraint(engine, original_name: str | None):
 
     print(f"  {DIM}No duplicates — safe to re-add constraint{RESET}")
     t0 = time.monotonic()
-    with engine.begin() as conn:
-        conn.execute(text(
-            f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} UNIQUE ({cols_csv})"
-        ))
+    with engine.connect() as conn:
+        partitioned = sensor_partitions.is_partitioned(conn)
+    if partitioned:
+        # CONCURRENTLY isn't available on a partitioned parent.
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} UNIQUE ({cols_csv})"
+            ))
+    else:
+        # Build without blocking readers/writers, then attach it as the
+        # constraint (a brief lock, no second build).
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS silver.{name}"))
+            conn.execute(text(f"SET maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'"))
+            conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY {name} ON {TABLE} ({cols_csv})"))
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}"))
     elapsed = time.monotonic() - t0
     ok(f"Constraint {name} re-added in {elapsed/60:.1f} min "
        f"(builds the unique index)")
 
 
+# ── SORT ENGINE ───────────────────────────────────────────────────────────────
+def _session_tuning(conn):
+    conn.execute(text(f"SET LOCAL maintenance_work_mem = '{MAINTENANCE_WORK_MEM}'"))
+    conn.execute(text(f"SET LOCAL work_mem = '{WORK_MEM}'"))
+
+
+def _sorted_copy(conn, source: str, target: str) -> tuple[int, int]:
+    """target = one row per key of source (lowest id wins, as with the
+    self-join). Returns (rows before, rows after)."""
+    cols_csv = ", ".join(COLS)
+    n_before = conn.execute(text(f"SELECT COUNT(*) FROM {source}")).scalar()
+    conn.execute(text(f"DROP TABLE IF EXISTS {target}"))
+    conn.execute(text(f"CREATE TABLE {target} (LIKE {source} INCLUDING DEFAULTS)"))
+    n_after = conn.execute(text(f"""
+        INSERT INTO {target}
+        SELECT DISTINCT ON ({cols_csv}) * FROM {source}
+        ORDER BY {cols_csv}, id
+    """)).rowcount
+    return n_before, n_after
+
+
+def _secondary_indexes(conn, relname: str) -> list[tuple[str, str]]:
+    """(name, definition) of the non-constraint indexes on silver.<relname>."""
+    return conn.execute(text("""
+        SELECT i.indexname, i.indexdef FROM pg_indexes i
+        WHERE i.schemaname = 'silver' AND i.tablename = :t
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)
+    """), {"t": relname}).fetchall()
+
+
+def _sort_dedupe_table(engine, name: str):
+    """Unpartitioned table: dedupe into silver.sensor_events_dedup, index
+    it, swap it in (drop old + rename) in one short transaction."""
+    new = "silver.sensor_events_dedup"
+    cols_csv = ", ".join(COLS)
+    with engine.begin() as conn:
+        _session_tuning(conn)
+        t0 = time.monotonic()
+        n_before, n_after = _sorted_copy(conn, TABLE, new)
+        ok(f"Sorted copy: {n_before:,} -> {n_after:,} rows "
+           f"({n_before - n_after:,} duplicates, {(time.monotonic() - t0)/60:.1f} min)")
+
+        t0 = time.monotonic()
+        conn.execute(text(f"ALTER TABLE {new} ADD CONSTRAINT sensor_events_pkey_new PRIMARY KEY (id)"))
+        conn.execute(text(f"ALTER TABLE {new} ADD CONSTRAINT {name}_new UNIQUE ({cols_csv})"))
+        secondary = _secondary_indexes(conn, "sensor_events")
+        for idx, definition in secondary:
+            conn.execute(text(definition.replace(f"INDEX {idx} ", f"INDEX {idx}_new ", 1)
+                                        .replace(f" ON {TABLE} ", f" ON {new} ", 1)))
+        ok(f"Indexes built on the new table ({len(secondary) + 2}, {(time.monotonic() - t0)/60:.1f} min)")
+
+    t0 = time.monotonic()
+    with engine.begin() as conn:
+        conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text("ALTER SEQUENCE silver.sensor_events_id_seq OWNED BY NONE"))
+        conn.execute(text(f"DROP TABLE {TABLE}"))
+        conn.execute(text(f"ALTER TABLE {new} RENAME TO sensor_events"))
+        # Renaming a constraint's index renames the constraint too.
+        for idx in ["sensor_events_pkey", name] + [i for i, _ in secondary]:
+            conn.execute(text(f"ALTER INDEX silver.{idx}_new RENAME TO {idx}"))
+        conn.execute(text(f"ALTER SEQUENCE silver.sensor_events_id_seq OWNED BY {TABLE}.id"))
+        conn.execute(text(f"ANALYZE {TABLE}"))
+    ok(f"Swapped in ({time.monotonic() - t0:.1f}s)")
+
+
+def _sort_dedupe_partitions(engine, name: str):
+    """Partitioned table: dedupe each monthly partition into a sibling
+    table, then swap it in with DETACH + ATTACH; finally re-add the unique
+    constraint on the parent, which adopts the partitions' own."""
+    cols_csv = ", ".join(COLS)
+    with engine.connect() as conn:
+        months = sorted(sensor_partitions.existing_months(conn))
+    total_before = total_after = 0
+    t_all = time.monotonic()
+    for i, month in enumerate(months, 1):
+        part = sensor_partitions.partition_name(month)
+        new = f"{part}_dedup"
+        lo = f"{month.isoformat()} 00:00:00+00"
+        hi = f"{sensor_partitions.next_month(month).isoformat()} 00:00:00+00"
+        t0 = time.monotonic()
+        with engine.begin() as conn:
+            _session_tuning(conn)
+            n_before, n_after = _sorted_copy(conn, f"silver.{part}", f"silver.{new}")
+            conn.execute(text(f"ALTER TABLE silver.{new} ADD PRIMARY KEY (id, timestamp)"))
+            conn.execute(text(f"ALTER TABLE silver.{new} ADD UNIQUE ({cols_csv})"))
+            conn.execute(text(f"ALTER TABLE silver.{new} ADD CONSTRAINT {new}_range "
+                              f"CHECK (timestamp >= '{lo}' AND timestamp < '{hi}')"))
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION silver.{part}"))
+            conn.execute(text(f"DROP TABLE silver.{part}"))
+            conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION silver.{new} "
+                              f"FOR VALUES FROM ('{lo}') TO ('{hi}')"))
+            conn.execute(text(f"ALTER TABLE silver.{new} RENAME TO {part}"))
+            conn.execute(text(f"ALTER TABLE silver.{part} DROP CONSTRAINT {new}_range"))
+        total_before += n_before
+        total_after += n_after
+        ok(f"[{i}/{len(months)}] {part}: {n_before:,} -> {n_after:,} rows "
+           f"({time.monotonic() - t0:.1f}s)")
+    ok(f"All partitions: {total_before:,} -> {total_after:,} rows "
+       f"({total_before - total_after:,} duplicates, {(time.monotonic() - t_all)/60:.1f} min)")
+
+    t0 = time.monotonic()
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} UNIQUE ({cols_csv})"))
+        conn.execute(text(f"ANALYZE {TABLE}"))
+    ok(f"Constraint {name} re-added on the parent ({time.monotonic() - t0:.1f}s)")
+
+
+def phase_3_4_sort_dedupe(engine, original_name: str | None):
+    header("Phase 3+4 — sorted copy, index, swap")
+    print(f"  {DIM}SELECT DISTINCT ON (key) ... ORDER BY key into a new table, "
+          f"maintenance_work_mem={MAINTENANCE_WORK_MEM}, work_mem={WORK_MEM}{RESET}\n")
+    name = original_name or CONSTRAINT_NAME
+    with engine.begin() as conn:
+        existing = find_constraint(conn)
+        if existing:
+            # --dedupe-only on a table that still has its constraint: the
+            # rebuilt table(s) get it back at the end.
+            conn.execute(text(f"ALTER TABLE {TABLE} DROP CONSTRAINT {existing}"))
+            name = existing
+        partitioned = sensor_partitions.is_partitioned(conn)
+    if partitioned:
+        _sort_dedupe_partitions(engine, name)
+    else:
+        _sort_dedupe_table(engine, name)
+
+
 # ── MAIN ──────────────────────────────────────────────────────────────────────
 def main():
-    engine = create_engine(DB_URL)
-
     skip_drop  = "--dropped"     in sys.argv
     dedupe_only = "--dedupe-only" in sys.argv
+    engine_name = "join"
+    if "--engine" in sys.argv:
+        i = sys.argv.index("--engine") + 1
+        engine_name = sys.argv[i] if i < len(sys.argv) else ""
+        if engine_name not in ("join", "sort"):
+            sys.exit("Usage: python scripts/fast_silver_backfill.py [--dropped] [--dedupe-only] "
+                     "[--engine join|sort]")
+    sort_engine = engine_name == "sort"
+
+    engine = create_engine(DB_URL)
+    with engine.connect() as conn:
+        if is_compact_layout(conn):
+            sys.exit("silver.sensor_events is the compact-layout view: its (channel_id, timestamp) "
+                     "key stays small, run flatten_sensors directly.")
 
     print(f"\n{BOLD}{BLUE}fast_silver_backfill — drop / load / dedupe / re-add{RESET}\n")
     warn("Don't run any silver-reading code while this is in flight.")
@@ -191,6 +372,9 @@ def main():
 
     original_name: str | None = None
 
+    if dedupe_only and sort_engine:
+        phase_3_4_sort_dedupe(engine, None)
+        return
     if dedupe_only:
         phase_3_dedupe(engine)
         # Skip recreating constraint? Caller probably has it dropped
@@ -205,8 +389,11 @@ def main():
         ok("--dropped flag: assuming constraint already gone")
 
     phase_2_flatten_sensors()
-    phase_3_dedupe(engine)
-    phase_4_recreate_constraint(engine, original_name)
+    if sort_engine:
+        phase_3_4_sort_dedupe(engine, original_name)
+    else:
+        phase_3_dedupe(engine)
+        phase_4_recreate_constraint(engine, original_name)
 
     print(f"\n{BOLD}{GREEN}\u2713 Done. silver.sensor_events is now fully loaded "
           f"and idempotent again.{RESET}\n")
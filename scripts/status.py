@@ -29,6 +29,10 @@ from sqlalchemy import create_engine, text
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 load_dotenv(PROJECT_ROOT / ".env")
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from ingestion.fast_flow import skip_list
 
 DB_URL      = os.getenv("DB_URL", "")
 BRONZE_ROOT = Path(os.getenv("BRONZE_ROOT", "storage/bronze"))
@@ -176,12 +180,14 @@ def bronze_status():
         # Lazy approximation: count files with os.walk (faster than glob,
         # interruptible). Stops gracefully on huge trees.
         n = 0
+        segments = 0
         size = 0
         newest_mtime = 0.0
         try:
             for dirpath, _, filenames in os.walk(sub):
                 for f in filenames:
                     n += 1
+                    segments += f.endswith(".seg")
                     full = os.path.join(dirpath, f)
                     try:
                         st = os.stat(full)
@@ -205,16 +211,18 @@ def bronze_status():
             newest_dt = datetime.fromtimestamp(newest_mtime, tz=timezone.utc)
             newest_str = f"  newest: {newest_dt.strftime('%Y-%m-%d %H:%M')}"
         cap = " (capped)" if n >= 500_000 else ""
-        row(f"  {sub.name}", f"{n:,} files, {size_str}{cap}{newest_str}", "ok" if n > 0 else "warn")
+        seg_str = f" ({segments:,} hourly segments)" if segments else ""
+        row(f"  {sub.name}", f"{n:,} files{seg_str}, {size_str}{cap}{newest_str}", "ok" if n > 0 else "warn")
 
-    # Processed.log if present (from cleanup_bronze)
-    processed_log = BRONZE_ROOT.parent / "processed.log"
-    if processed_log.exists():
-        try:
-            n_processed = sum(1 for _ in processed_log.open(encoding="utf-8"))
-            row("processed.log", f"{n_processed:,} entries (deleted from bronze, do-not-recopy list)", "ok")
-        except Exception:
-            pass
+    # Skip list (from cleanup_bronze / DELETE_BRONZE) -- see skip_list.py
+    try:
+        counts = skip_list.stats()
+        n_skip = sum(counts.values())
+        if n_skip:
+            row("skip list", f"~{n_skip:,} entries (deleted from bronze, do-not-recopy list), "
+                             f"{counts['journal']:,} not yet compacted", "ok")
+    except Exception:
+        pass
 
 
 # ── LOGS ──────────────────────────────────────────────────────────────────────
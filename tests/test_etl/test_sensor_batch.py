@@ -0,0 +1,127 @@
+"""Tests for the columnar SensorBatch and its use in flatten_sensors."""
+
+import json
+import math
+import struct
+
+import pytest
+
+from etl.bronze_to_silver import flatten_sensors
+from etl.bronze_to_silver.sensor_batch import PGCOPY_HEADER, PGCOPY_TRAILER, SensorBatch
+
+
+def _payload(temp):
+    return {"datetime": "01.01.2024 10:00",
+            "humidities": {"Bedroom": {"temperature": temp, "humidity": 40}}}
+
+
+def test_bad_value_leaves_columns_aligned():
+    batch = SensorBatch()
+    batch.append("jimmy", "Bedroom", "humidity", "temperature", 21.5, "C", 0)
+    with pytest.raises(ValueError):
+        batch.append("jimmy", "Bedroom", "humidity", "temperature", "n/a", "C", 60)
+    batch.finish()
+    assert len(batch) == 1
+    assert len(batch.codes["room"]) == len(batch.value) == len(batch.ts) == 1
+
+
+def test_truncate_drops_rows_after_mark():
+    batch = SensorBatch()
+    batch.append("jimmy", "Bedroom", "humidity", "temperature", 21.5, "C", 0)
+    mark = batch.mark()
+    batch.append("jimmy", "Bedroom", "humidity", "humidity", 40, "%", 0)
+    batch.truncate(mark)
+    batch.finish()
+    assert batch.value.tolist() == [21.5]
+
+
+def test_process_batch_bad_reading_is_a_file_error(tmp_path):
+    good_a = tmp_path / "01.01.2024 1000_JimmyLoup_received.json"
+    bad    = tmp_path / "01.01.2024 1001_JimmyLoup_received.json"
+    good_b = tmp_path / "01.01.2024 1002_JimmyLoup_received.json"
+    good_a.write_text(json.dumps(_payload(21.0)))
+    # temperature is appended before humidity fails: the file breaks
+    # after one of its readings is already in the batch.
+    bad.write_text(json.dumps({"datetime": "01.01.2024 10:01",
+                               "humidities": {"Bedroom": {"temperature": 20.0, "humidity": "n/a"}}}))
+    good_b.write_text(json.dumps(_payload(22.0)))
+
+    result = flatten_sensors.process_batch(
+        ([(str(p), "jimmy") for p in (good_a, bad, good_b)], None, False, {}))
+
+    assert result["errors"] == 1
+    assert result["processed"] == [good_a.name, good_b.name]
+    rows = result["rows"]
+    assert len(rows) == 4
+    assert 20.0 not in rows.value.tolist()
+    assert not any(math.isnan(v) for v in rows.value.tolist())
+
+
+def _sample():
+    batch = SensorBatch()
+    batch.append("jimmy", "bedroom", "meteo", "temperature_c", 21.5, "C", 60)
+    batch.append("jimmy", "bedroom", "meteo", "temperature_c", 99.0, "C", 120)
+    batch.append("jimmy", "Living, Room", "plug", "power", None, "W", 60)
+    batch.append("jeremie", "office", "meteo", "temperature_c", 22.0, "C", 60)
+    return batch
+
+
+def test_finish_maps_rooms_and_flags_outliers():
+    batch = _sample().finish(room_map={"bedroom": "Bedroom"}, bounds={"temperature_c": (-10, 50)})
+    assert batch.strings("room")[batch.codes["room"][0]] == "Bedroom"
+    assert batch.is_outlier.tolist() == [False, True, False, False]  # NULL never an outlier
+    assert math.isnan(batch.value[2])
+    assert batch.apartment_spans() == {"jimmy": (60, 120), "jeremie": (60, 60)}
+
+
+def test_dedupe_keeps_last_occurrence():
+    batch = SensorBatch()
+    batch.append("jimmy", "bedroom", "meteo", "temperature_c", 1.0, "C", 60)
+    batch.append("jimmy", "bedroom", "meteo", "temperature_c", 2.0, "C", 120)
+    batch.append("jimmy", "bedroom", "meteo", "temperature_c", 3.0, "C", 60)
+    out = batch.finish().dedupe()
+    assert sorted(zip(out.ts.tolist(), out.value.tolist())) == [(60, 3.0), (120, 2.0)]
+    single = SensorBatch()
+    single.append("jimmy", "bedroom", "meteo", "temperature_c", 1.0, "C", 60)
+    single.finish()
+    assert single.dedupe() is single
+
+
+def test_to_csv_quotes_and_nulls():
+    lines = _sample().finish().to_csv().read().splitlines()
+    assert lines[0] == "jimmy,bedroom,meteo,temperature_c,21.5,C,1970-01-01T00:01:00+00:00,false"
+    assert lines[2] == 'jimmy,"Living, Room",plug,power,,W,1970-01-01T00:01:00+00:00,false'
+
+
+def _decode_pgcopy(data):
+    """Minimal PGCOPY reader for BINARY_COLUMNS: list of row tuples."""
+    assert data.startswith(PGCOPY_HEADER) and data.endswith(PGCOPY_TRAILER)
+    pos, rows = len(PGCOPY_HEADER), []
+    while data[pos:pos + 2] != PGCOPY_TRAILER:
+        (n,) = struct.unpack_from("!h", data, pos)
+        pos += 2
+        row = []
+        for _ in range(n):
+            (length,) = struct.unpack_from("!i", data, pos)
+            pos += 4
+            row.append(None if length < 0 else data[pos:pos + length])
+            pos += max(length, 0)
+        rows.append(row)
+    out = []
+    for a, r, s, f, u, v, t, o in rows:
+        out.append((a.decode(), r.decode(), s.decode(), f.decode(), u.decode(),
+                    None if v is None else struct.unpack("!d", v)[0],
+                    struct.unpack("!q", t)[0] // 1_000_000 + 946_684_800, o == b"\x01"))
+    return out
+
+
+def test_binary_stream_matches_columns():
+    batch = _sample().finish(bounds={"temperature_c": (-10, 50)})
+    rows = _decode_pgcopy(b"".join(batch.iter_binary(chunk_rows=3)))
+    assert rows == [
+        ("jimmy", "bedroom", "meteo", "temperature_c", "C", 21.5, 60, False),
+        ("jimmy", "bedroom", "meteo", "temperature_c", "C", 99.0, 120, True),
+        ("jimmy", "Living, Room", "plug", "power", "W", None, 60, False),
+        ("jeremie", "office", "meteo", "temperature_c", "C", 22.0, 60, False),
+    ]
+    assert batch.binary_stream().read() == b"".join(batch.iter_binary())
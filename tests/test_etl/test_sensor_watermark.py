@@ -0,0 +1,62 @@
+"""Tests for the range-compressed sensor watermark (in-memory parts)."""
+
+from etl.bronze_to_silver import sensor_watermark
+from etl.bronze_to_silver.sensor_watermark import MinuteWatermark
+
+NAME = "31.08.2023 2144_JimmyLoup_received.json"
+
+
+def test_parse_key_round_trip():
+    apt, minute = sensor_watermark.parse_key(NAME)
+    assert apt == "jimmy"
+    assert sensor_watermark.minute_to_filename(apt, minute) == NAME
+    assert sensor_watermark.dt_to_minute(sensor_watermark.minute_to_dt(minute)) == minute
+    assert sensor_watermark.parse_key("Pred_2024-01-01.csv") is None
+    assert sensor_watermark.parse_key(NAME + ".gz") is None
+
+
+def test_runs():
+    assert sensor_watermark.runs([5, 1, 2, 3, 3, 7, 6]) == [(1, 3), (5, 7)]
+    assert sensor_watermark.runs([]) == []
+
+
+def test_add_range_merges_overlapping_and_adjacent():
+    wm = MinuteWatermark()
+    wm.add_range("jimmy", 10, 12)
+    wm.add_range("jimmy", 20, 25)
+    assert wm.range_count() == 2
+    wm.add_range("jimmy", 13, 14)      # adjacent to the first
+    assert wm.range_count() == 2
+    wm.add_range("jimmy", 15, 19)      # bridges both
+    assert wm.range_count() == 1
+    assert wm.covers("jimmy", 10, 25)
+    wm.add_range("jimmy", 1, 30)       # swallows everything
+    assert wm.range_count() == 1 and len(wm) == 30
+
+
+def test_covers():
+    wm = MinuteWatermark()
+    wm.add_range("jimmy", 10, 20)
+    wm.add_range("jimmy", 30, 40)
+    assert wm.covers("jimmy", 15)
+    assert wm.covers("jimmy", 30, 40)
+    assert not wm.covers("jimmy", 20, 30)
+    assert not wm.covers("jimmy", 9)
+    assert not wm.covers("jeremie", 15)
+
+
+def test_update_contains_and_len():
+    wm = MinuteWatermark()
+    apt, minute = sensor_watermark.parse_key(NAME)
+    nxt = sensor_watermark.minute_to_filename(apt, minute + 1)
+    wm.update([NAME, nxt, "odd-name.json"])
+    assert NAME in wm and nxt in wm and "odd-name.json" in wm
+    assert sensor_watermark.minute_to_filename(apt, minute + 2) not in wm
+    assert wm.range_count() == 1
+    assert len(wm) == 3
+
+
+def test_digest_is_stable_and_short():
+    assert sensor_watermark.digest(b"{}") == sensor_watermark.digest(b"{}")
+    assert sensor_watermark.digest(b"{}") != sensor_watermark.digest(b"{ }")
+    assert len(sensor_watermark.digest(b"{}")) == 16
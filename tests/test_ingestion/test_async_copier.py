@@ -0,0 +1,95 @@
+"""Tests for the async probe/copy engine and its AIMD limiter."""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from ingestion.fast_flow import async_copier
+
+START = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def _probe(hits, failing=()):
+    """probe_minute stand-in: files at `hits` (minute offsets), OSError at
+    `failing`."""
+    def probe(dt):
+        m = int((dt - START) / timedelta(minutes=1))
+        if m in failing:
+            raise OSError("share unreachable")
+        return (m in hits), ([(Path(f"src{m:03d}"), Path(f"dst{m:03d}"))] if m in hits else []), [], []
+    return probe
+
+
+def test_stops_after_max_empty_minutes():
+    result = async_copier.predict_and_copy(START, _probe({1, 2, 3}), max_empty=5)
+    assert [src.name for src, _ in result["new_files"]] == ["src001", "src002", "src003"]
+    assert result["probe_errors"] == 0
+    assert result["minutes"] >= 8
+
+
+def test_failed_probe_is_counted_and_stops_the_frontier():
+    result = async_copier.predict_and_copy(START, _probe(set(range(1, 50)), failing={4}), max_empty=5)
+    assert result["probe_errors"] == 1
+    dt, err = result["first_probe_error"]
+    assert dt == START + timedelta(minutes=4) and "unreachable" in err
+    # Hits past the failed minute never extend the scan beyond it.
+    found = {int(src.name[3:]) for src, _ in result["new_files"]}
+    assert {1, 2, 3} <= found
+    assert max(found) < 4 + async_copier.INITIAL_CONCURRENCY * 2 + 1
+
+
+def test_copies_each_new_file():
+    copied = []
+    result = async_copier.predict_and_copy(
+        START, _probe({1, 2}), copy_fn=lambda src, dst: copied.append(src.name) or "copied", max_empty=3)
+    assert sorted(copied) == ["src001", "src002"]
+    assert sorted(r for _, r in result["copied"]) == ["copied", "copied"]
+
+
+def _window(limiter, latency, errors=0):
+    limiter._window = [latency] * async_copier.WINDOW
+    limiter._window_errors = errors
+    limiter._adjust()
+
+
+def test_aimd_grows_by_one_while_latency_holds():
+    limiter = async_copier.AimdLimiter(initial=4, minimum=2, maximum=6, tolerance=2.0)
+    _window(limiter, 0.010)
+    assert limiter.limit == 5 and limiter.baseline == 0.010
+    _window(limiter, 0.015)
+    _window(limiter, 0.015)
+    assert limiter.limit == 6  # capped at maximum
+    assert limiter.peak == 6
+
+
+def test_aimd_halves_on_latency_rise_and_errors():
+    limiter = async_copier.AimdLimiter(initial=16, minimum=2, maximum=64, tolerance=2.0)
+    _window(limiter, 0.010)
+    _window(limiter, 0.050)   # > 2x baseline: queueing at the share
+    assert limiter.limit == 8
+    _window(limiter, 0.010, errors=1)
+    assert limiter.limit == 4
+    for _ in range(5):
+        _window(limiter, 0.010, errors=1)
+    assert limiter.limit == 2  # floored at minimum
+
+
+def test_aimd_baseline_drifts_up_slowly():
+    limiter = async_copier.AimdLimiter(initial=4, minimum=2, maximum=64, tolerance=100.0)
+    _window(limiter, 0.010)
+    _window(limiter, 0.100)
+    assert limiter.baseline == 0.010 * async_copier.BASELINE_DRIFT
+
+
+def test_aimd_run_counts_failures():
+    async def go():
+        limiter = async_copier.AimdLimiter(initial=2, minimum=1, maximum=4)
+        assert await limiter.run(lambda x: x * 2, 21) == 42
+        try:
+            await limiter.run(lambda: 1 / 0)
+        except ZeroDivisionError:
+            pass
+        return limiter
+
+    limiter = asyncio.run(go())
+    assert limiter.ops == 2 and limiter.errors == 1 and limiter.in_flight == 0
@@ -0,0 +1,86 @@
+"""Round-trip tests for the pluggable bronze codec."""
+
+import json
+import threading
+
+import pytest
+
+from ingestion.fast_flow import bronze_codec
+
+PAYLOAD = json.dumps({"datetime": "01.01.2024 10:00",
+                      "humidities": {"Bedroom": {"temperature": 21.5, "humidity": 40}}}).encode()
+
+
+@pytest.fixture
+def codec(tmp_path, monkeypatch):
+    """Select a codec with fresh dictionary / (de)compressor caches."""
+    monkeypatch.setattr(bronze_codec, "DICT_DIR", tmp_path / "_dictionaries")
+    monkeypatch.setattr(bronze_codec, "_DICTS", None)
+    monkeypatch.setattr(bronze_codec, "_LOCAL", threading.local())
+    monkeypatch.setattr(bronze_codec, "_warned", True)
+
+    def use(name):
+        monkeypatch.setattr(bronze_codec, "BRONZE_CODEC", name)
+    return use
+
+
+def test_strip_suffix_and_is_compressed():
+    assert bronze_codec.strip_suffix("a.json.gz") == "a.json"
+    assert bronze_codec.strip_suffix("a.json.zst") == "a.json"
+    assert bronze_codec.strip_suffix("a.json") == "a.json"
+    assert bronze_codec.is_compressed("x/a.json.zst")
+    assert not bronze_codec.is_compressed("x/a.json")
+
+
+def test_gzip_round_trip(codec):
+    codec("gzip")
+    blob = bronze_codec.compress(PAYLOAD)
+    assert blob[:2] == bronze_codec.GZIP_MAGIC
+    assert bronze_codec.suffix() == ".gz"
+    assert bronze_codec.decompress(blob) == PAYLOAD
+
+
+def test_plain_bytes_pass_through():
+    assert bronze_codec.decompress(PAYLOAD) == PAYLOAD
+
+
+def test_zstd_round_trip(codec):
+    pytest.importorskip("zstandard")
+    codec("zstd")
+    blob = bronze_codec.compress(PAYLOAD)
+    assert blob[:4] == bronze_codec.ZSTD_MAGIC
+    assert bronze_codec.suffix() == ".zst"
+    assert bronze_codec.decompress(blob) == PAYLOAD
+
+
+def test_zstd_dict_without_dictionary_falls_back_to_zstd(codec):
+    pytest.importorskip("zstandard")
+    codec("zstd+dict")
+    assert bronze_codec.active_codec() == "zstd"
+
+
+def test_zstd_dict_round_trip(codec):
+    zstandard = pytest.importorskip("zstandard")
+    samples = [json.dumps({"datetime": f"01.01.2024 {h:02d}:{m:02d}",
+                           "humidities": {f"Room{m % 5}": {"temperature": 20 + m / 10, "humidity": h}}}).encode()
+               for h in range(24) for m in range(60)]
+    d = zstandard.train_dictionary(4096, samples)
+    bronze_codec.DICT_DIR.mkdir()
+    (bronze_codec.DICT_DIR / f"{bronze_codec.DICT_PREFIX}1{bronze_codec.DICT_SUFFIX}").write_bytes(d.as_bytes())
+    codec("zstd+dict")
+    assert bronze_codec.active_codec() == "zstd+dict"
+    blob = bronze_codec.compress(PAYLOAD)
+    assert zstandard.get_frame_parameters(blob).dict_id == d.dict_id()
+    assert bronze_codec.decompress(blob) == PAYLOAD
+    # Non-sensor payloads skip the dictionary.
+    assert zstandard.get_frame_parameters(bronze_codec.compress(b"a,b\n1,2\n", use_dict=False)).dict_id == 0
+
+
+def test_compress_file_and_open_text(codec, tmp_path):
+    codec("gzip")
+    src = tmp_path / "01.01.2024 1000_JimmyLoup_received.json"
+    src.write_bytes(PAYLOAD)
+    dst = bronze_codec.compress_file(src)
+    assert dst.name == src.name + ".gz" and not src.exists()
+    with bronze_codec.open_text(dst) as f:
+        assert json.loads(f.read())["datetime"] == "01.01.2024 10:00"
@@ -0,0 +1,70 @@
+"""Tests for packed hourly bronze segments and their offset index."""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from ingestion.fast_flow import bronze_codec, bronze_segments
+
+A = "01.01.2024 1000_JimmyLoup_received.json"
+B = "01.01.2024 1001_JimmyLoup_received.json"
+
+
+@pytest.fixture
+def seg(tmp_path, monkeypatch):
+    monkeypatch.setattr(bronze_codec, "BRONZE_CODEC", "gzip")
+    return tmp_path / "jimmy" / "2024" / "01" / "01" / "10.seg"
+
+
+def test_parse_index_ignores_partial_and_dangling_entries():
+    data = b"a\t0\t10\nb\t10\t5\nc\t15\t100\nbad line\nd\t20"
+    assert bronze_segments._parse_index(data, seg_size=20) == {"a": (0, 10), "b": (10, 5)}
+
+
+def test_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(bronze_segments, "BRONZE_ROOT", tmp_path)
+    dt = datetime(2024, 1, 1, 10, 5, tzinfo=timezone.utc)
+    seg = bronze_segments.segment_path("jimmy", dt)
+    assert seg == tmp_path / "jimmy" / "2024" / "01" / "01" / "10.seg"
+    assert bronze_segments.segment_for_folder(seg.with_suffix("")) == seg
+    assert bronze_segments.index_path(seg).name == "10.idx"
+    member = bronze_segments.member_path(seg, A)
+    assert member.name == A and bronze_segments.is_member(member)
+    assert not bronze_segments.is_member(seg.with_suffix("") / A)
+
+
+def test_append_and_read_back(seg):
+    assert bronze_segments.append(seg, [(A, b'{"a": 1}'), (B, b'{"b": 2}')]) == [A, B]
+    assert bronze_segments.members(seg) == [A, B]
+    assert bronze_segments.contains(seg, B)
+    assert bronze_segments.read_member(seg / A) == b'{"a": 1}'
+    assert bronze_segments.open_member(seg / B).read() == '{"b": 2}'
+    assert list(bronze_segments.iter_segment(seg)) == [(A, b'{"a": 1}'), (B, b'{"b": 2}')]
+    with pytest.raises(FileNotFoundError):
+        bronze_segments.read_member(seg / "01.01.2024 1002_JimmyLoup_received.json")
+
+
+def test_append_skips_names_already_indexed(seg):
+    bronze_segments.append(seg, [(A, b"1")])
+    assert bronze_segments.append(seg, [(A, b"2"), (B, b"3")]) == [B]
+    assert bronze_segments.read_member(seg / A) == b"1"
+
+
+def test_torn_tail_is_truncated_on_next_append(seg):
+    bronze_segments.append(seg, [(A, b"1")])
+    committed = seg.stat().st_size
+    with open(seg, "ab") as f:
+        f.write(b"garbage from a crashed append")
+    bronze_segments.append(seg, [(B, b"2")])
+    assert bronze_segments.read_index(seg)[B][0] == committed
+    assert bronze_segments.read_member(seg / B) == b"2"
+
+
+def test_pack_hour_folder(seg):
+    folder = seg.with_suffix("")
+    folder.mkdir(parents=True)
+    (folder / A).write_bytes(b"1")
+    (folder / (B + ".gz")).write_bytes(bronze_codec.compress(b"2"))
+    assert bronze_segments.pack_hour_folder(folder) == [A, B]
+    assert not folder.exists()
+    assert bronze_segments.read_member(seg / B) == b"2"
@@ -0,0 +1,58 @@
+"""Tests for the per-day minute-coverage bitmaps."""
+
+from datetime import date, datetime, timezone
+
+import pytest
+
+from ingestion.fast_flow import bronze_catalog, coverage
+
+DAY = date(2024, 1, 1)
+DAY_START = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp()) // 60
+
+
+def _name(minute_of_day, apt="JimmyLoup"):
+    dt = datetime.fromtimestamp((DAY_START + minute_of_day) * 60, tz=timezone.utc)
+    return f"{dt:%d.%m.%Y %H%M}_{apt}_received.json"
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(bronze_catalog, "ENABLED", True)
+    monkeypatch.setattr(bronze_catalog, "CATALOG_PATH", tmp_path / "bronze_catalog.sqlite")
+    c = coverage.connect()
+    yield c
+    c.close()
+
+
+def test_split():
+    assert coverage._split(DAY_START + 61) == ("2024-01-01", 61)
+    assert coverage._split(DAY_START - 1) == ("2023-12-31", 1439)
+
+
+def test_mark_sets_one_bit_per_minute(conn):
+    coverage.mark("bronze", [_name(0), _name(61), _name(61), _name(1439)])
+    coverage.mark("silver", [_name(0)])
+    coverage.mark("bronze", ["Pred_2024-01-01.csv"])  # not a sensor file: ignored
+    summary = coverage.day_summary(conn, "jimmy", DAY)
+    assert summary == {"smb": 0, "bronze": 3, "silver": 1, "absent": 0}
+    assert coverage.day_summary(conn, "jeremie", DAY)["bronze"] == 0
+
+
+def test_unknown_layer_is_rejected(conn):
+    with pytest.raises(ValueError):
+        coverage._set_keys(conn, "gold", [("jimmy", DAY_START)])
+
+
+def test_gaps_skip_bronze_silver_and_absent(conn):
+    coverage.mark("bronze", [_name(0), _name(1)])
+    coverage.mark("silver", [_name(2)])
+    coverage.mark("absent", [_name(4)])
+    coverage.mark("smb", [_name(3)])  # seen on SMB only: still a gap
+    assert list(coverage.gaps(conn, "jimmy", DAY, DAY_START + 5)) == [DAY_START + 3, DAY_START + 5]
+
+
+def test_gaps_cover_days_without_a_row(conn):
+    last = DAY_START + 1440 + 2
+    missing = list(coverage.gaps(conn, "jeremie", DAY, last))
+    assert missing[0] == DAY_START and missing[-1] == last
+    assert len(missing) == 1440 + 3
@@ -0,0 +1,81 @@
+"""Tests for the skip-list bitsets, journal and compaction."""
+
+import pytest
+
+from ingestion.fast_flow import skip_list
+
+JIMMY = "31.08.2023 2144_JimmyLoup_received.json"
+JEREMIE = "01.01.2024 0000_JeremieVianin_received.json"
+
+
+@pytest.fixture(autouse=True)
+def skip_dir(tmp_path, monkeypatch):
+    d = tmp_path / "skiplist"
+    monkeypatch.setattr(skip_list, "SKIP_DIR", d)
+    monkeypatch.setattr(skip_list, "LEGACY_LOG", tmp_path / "processed.log")
+    monkeypatch.setattr(skip_list, "JOURNAL", d / "journal.txt")
+    monkeypatch.setattr(skip_list, "COMPACTING", d / "journal.compacting")
+    monkeypatch.setattr(skip_list, "OTHER", d / "other.txt")
+    monkeypatch.setattr(skip_list, "LOCK", d / "compact.lock")
+    monkeypatch.setattr(skip_list, "GENERATION", d / "generation")
+    monkeypatch.setattr(skip_list, "COMPACT_BYTES", 1 << 30)
+    return d
+
+
+def test_key():
+    assert skip_list.key(JIMMY)[0] == "jimmy"
+    assert skip_list.key(JIMMY + ".gz") == skip_list.key(JIMMY)
+    assert skip_list.key("Pred_2020-01-03.csv") == ("weather", 2)
+    assert skip_list.key("notes.txt") is None
+    assert skip_list.key("31.12.2019 2359_JimmyLoup_received.json") is None
+
+
+def test_journal_then_compaction():
+    skip_list.add([JIMMY, "Pred_2024-03-01.csv", "notes.txt"])
+    skip = skip_list.SkipList()
+    assert JIMMY in skip and JIMMY + ".zst" in skip
+    assert "Pred_2024-03-01.csv" in skip and "notes.txt" in skip
+    assert JEREMIE not in skip
+
+    assert skip_list.compact() == 3
+    assert not skip_list.JOURNAL.exists()
+    skip = skip_list.SkipList()
+    assert JIMMY in skip and "notes.txt" in skip
+    assert len(skip) == 3
+    assert skip_list.stats() == {"jimmy": 1, "weather": 1, "other": 1, "journal": 0}
+
+
+def test_bitset_bits():
+    bits = bytearray()
+    skip_list._set_bit(bits, 17)
+    assert len(bits) == 3
+    assert skip_list._test_bit(bits, 17)
+    assert not skip_list._test_bit(bits, 16)
+    assert not skip_list._test_bit(bits, 10_000)
+
+
+def test_read_lines_leaves_partial_line(skip_dir):
+    skip_dir.mkdir()
+    skip_list.JOURNAL.write_bytes(b"a\nb\npart")
+    names, offset = skip_list._read_lines(skip_list.JOURNAL)
+    assert names == ["a", "b"] and offset == 4
+
+
+def test_refresh_picks_up_appends():
+    skip = skip_list.SkipList()
+    skip_list.add([JIMMY])
+    skip.refresh()
+    assert JIMMY in skip
+
+
+def test_refresh_reloads_after_compaction_past_old_offset():
+    skip_list.add([JIMMY])
+    skip = skip_list.SkipList()
+    skip_list.compact()
+    # The new journal grows past the reader's old offset before it refreshes.
+    later = [f"01.01.2024 00{m:02d}_JeremieVianin_received.json" for m in range(10)]
+    skip_list.add(later)
+    skip.refresh()
+    assert JIMMY in skip
+    assert all(name in skip for name in later)
+    assert len(skip) == 11